@@ -1,32 +1,102 @@
 import time
-import board
-import busio
 import io
 import base64
 import sys
+import argparse
+import hashlib
+import json
+import threading
+
+from timeline import Timeline
+# standard library only; the loop histograms below need it at import time
+import metrics
+
+# counts from process start, before the imports
+BOOT = Timeline()
 
 # ---------------------------------------------------------------
 # IMPORT YOUR SENSORS
 # ---------------------------------------------------------------
+# Only what Bluetooth needs is imported here. Drivers, NumPy, gpiozero,
+# asyncio and multiprocessing are imported by the functions that use
+# them, so the sender is up first and sensors load on the supervisor
+# threads.
 try:
-    from hr2 import HeartRateMonitor
-    from TfLunaI2C import TfLunaI2C
-    import adafruit_mpu6050
     from bt_sender import BluetoothSender 
-    from gpiozero import RGBLED  # <--- ADD THIS LINE
+    from backlog import Backlog
+    import transport
+    from i2c_bus import shared_bus, open_buses, PRIORITY_HR, PRIORITY_IMU, PRIORITY_LIDAR
+    from supervisor import Supervisor
+    import profiler
 except ImportError as e:
     print(f"[CRITICAL] Library missing: {e}")
+BOOT.event("imports")
 
 # Camera Imports
 
+# Set by --record (trace file) or the sample log: every driver created by
+# the init functions is wrapped so its readings end up there
+RECORDER = None
+
+# Every I2C driver goes through one i2c_bus.BusManager on this channel
+I2C_CHANNEL = 1
+# Closer than this the lidar goes first on the shared bus
+OBSTACLE_CM = 100
+# Reconfigure the GPS module for 10 Hz fixes at startup (falls back to 1 Hz)
+GPS_HIGH_RATE = True
+# GPIO of the MAX30102 INT line (--int-pin); None polls the FIFO on a timer
+HR_INT_PIN = None
+# hrcalc engine of the HR thread (--engine), a name in hrcalc.ENGINES
+HR_ENGINE = "python"
+# Feed the HR thread's samples to hrcalc.StreamingEstimator (O(1) per
+# sample) instead of recomputing the whole window (--streaming)
+HR_STREAMING = False
+# TF-Luna frame rate, sampled by a TfLunaReader thread
+LIDAR_FPS = 100
+# MPU6050 FIFO sample rate; the loops drain it in blocks (85 samples max,
+# so at least IMU_RATE / 85 drains per second)
+IMU_RATE = 200
+# Packets recorded while no phone is connected spill here past 30 s
+BACKLOG_DIR = "/var/tmp/pathpal-backlog"
+# Every raw sample and HR result goes to a ring of segment files here
+SAMPLE_LOG_DIR = "/var/tmp/pathpal-samples"
+# Where phones connect; --listen replaces this, e.g. --listen rfcomm:// --listen tcp://0.0.0.0:8765
+LISTEN = ["rfcomm://"]
+
 
 # ---------------------------------------------------------------
 # 1. ROBUST INIT FUNCTIONS
 # ---------------------------------------------------------------
 
+def _max30102_factory():
+    from max30102 import MAX30102
+    sensor = MAX30102(bus=shared_bus(I2C_CHANNEL).client("max30102", PRIORITY_HR))
+    if RECORDER is not None:
+        from sensor_trace import RecordingMax30102
+        sensor = RecordingMax30102(sensor, RECORDER)
+    return sensor
+
+_int_pins = {}
+
+def _int_pin(gpio):
+    # opened once: a second DigitalInputDevice on the pin would fail after
+    # the supervisor re-inits the sensor
+    if gpio is None:
+        return None
+    if gpio not in _int_pins:
+        from max30102 import GpioInterruptPin
+        _int_pins[gpio] = GpioInterruptPin(gpio)
+    return _int_pins[gpio]
+
 def init_max30102():
     try:
-        hr = HeartRateMonitor()
+        from hr2 import HeartRateMonitor
+        # open the chip here, not in the HR thread, so a missing sensor
+        # fails the init instead of killing the thread
+        sensor = _max30102_factory()
+        hr = HeartRateMonitor(sensor_factory=lambda: sensor, recorder=RECORDER,
+                              engine=HR_ENGINE, streaming=HR_STREAMING,
+                              int_pin=_int_pin(HR_INT_PIN))
         hr.start_sensor()
         print("[OK] MAX30102 initialized")
         return hr
@@ -36,8 +106,12 @@ def init_max30102():
 
 def init_mpu6050():
     try:
-        i2c = busio.I2C(board.SCL, board.SDA)
-        mpu = adafruit_mpu6050.MPU6050(i2c)
+        from mpu6050 import MPU6050
+        mpu = MPU6050(bus=shared_bus(I2C_CHANNEL).client("mpu6050", PRIORITY_IMU), sample_rate=IMU_RATE)
+        mpu.enable_fifo()
+        if RECORDER is not None:
+            from sensor_trace import RecordingMpu6050
+            mpu = RecordingMpu6050(mpu, RECORDER)
         print("[OK] MPU6050 initialized")
         return mpu
     except Exception as e:
@@ -46,9 +120,15 @@ def init_mpu6050():
 
 def init_lidar():
     try:
-        lidar = TfLunaI2C()
+        from TfLunaI2C import TfLunaI2C, TfLunaReader
+        lidar = TfLunaI2C(i2cbus=shared_bus(I2C_CHANNEL).client("tfluna", PRIORITY_LIDAR))
+        if RECORDER is not None:
+            from sensor_trace import RecordingTfLuna
+            lidar = RecordingTfLuna(lidar, RECORDER)
         # Verify it works immediately
         lidar.read_data()
+        # from here on read_data() returns the newest frame without I2C
+        lidar = TfLunaReader(lidar, fps=LIDAR_FPS).start()
         print("[OK] TF-Luna initialized")
         return lidar
     except Exception as e:
@@ -56,16 +136,38 @@ def init_lidar():
         print(f"[ERR] TF-Luna missing/disconnected")
         return None
 
+def flag_obstacle(lidar, distance):
+    # a pending obstacle alert puts the lidar ahead of the other devices;
+    # a no-op under --processes, see open_tfluna
+    client = getattr(lidar, "i2cbus", None)
+    if client is not None and hasattr(client, "alert"):
+        client.alert = 0 < distance < OBSTACLE_CM
+
+def init_gps():
+    try:
+        from gps_reader import GpsService
+        # the reader thread switches the module to 10 Hz / 115200 baud first
+        gps = GpsService(high_rate=GPS_HIGH_RATE)
+        if RECORDER is not None:
+            from sensor_trace import RecordingSerial
+            gps.ser = RecordingSerial(gps.ser, RECORDER)
+        gps.start()
+        print("[OK] GPS reader started")
+        return gps
+    except Exception as e:
+        print(f"[ERR] GPS init failed: {e}")
+        return None
+
 def init_status_led():
     try:
+        from gpiozero import RGBLED
         # gpiozero uses BCM GPIO numbers (12, 13, 18)
         # pwm=True allows color mixing and brightness control
         led = RGBLED(red=12, green=13, blue=18, pwm=True)
         
-        # Flash white briefly to prove it works
-        led.color = (1, 1, 1) 
-        time.sleep(0.5)
-        led.color = (0, 0, 0) # Turn off
+        # Flash white briefly to prove it works, in gpiozero's background
+        # thread; the first status color ends it early
+        led.blink(on_time=0.5, off_time=0, on_color=(1, 1, 1), n=1)
         
         print("[OK] RGB Status LED initialized")
         return led
@@ -74,40 +176,154 @@ def init_status_led():
         return None
 
 
+# ---------------------------------------------------------------
+# 2. SENSOR SUPERVISOR
+# ---------------------------------------------------------------
+
+def _close_quietly(close):
+    def closer(driver):
+        try: close(driver)
+        except: pass
+    return closer
+
+def hr_healthy(hr):
+    # the HR thread recovers from short I2C errors by itself; a dead thread
+    # or a chip that keeps failing gets re-initialized
+    return hr.alive and hr.consecutive_errors <= 10
+
+def start_supervisor(acquisition=None):
+    """
+    Init and reconnect every I2C sensor on background threads; the loops
+    pick the drivers up with supervisor.get() as they become ready. With
+    an ACQUISITION the processes keep the hardware up and a ring reader
+    counts as ready while its samples are fresh.
+    """
+    if acquisition is not None:
+        supervisor = Supervisor(base_delay=0.1, max_delay=1.0)
+        for name, kind in (("lidar", "lidar"), ("mpu", "imu"), ("hr", "hr")):
+            reader = acquisition.reader(kind)
+            supervisor.add(name, reader.ready, check=lambda reader: reader.ready())
+        return supervisor.start()
+
+    supervisor = Supervisor()
+    supervisor.add("lidar", init_lidar, close=_close_quietly(lambda lidar: lidar.stop()))
+    supervisor.add("mpu", init_mpu6050, close=_close_quietly(lambda mpu: mpu.close()))
+    supervisor.add("hr", init_max30102, close=_close_quietly(lambda hr: hr.stop_sensor()),
+                   check=hr_healthy)
+    return supervisor.start()
+
+
+def report_startup(boot, supervisor, timeout=15.0):
+    """
+    Prints the startup timeline from a thread once every sensor is up,
+    or after TIMEOUT seconds with the ones that are still missing.
+    """
+    def wait():
+        deadline = time.monotonic() + timeout
+        sensors = supervisor.sensors.values()
+        while time.monotonic() < deadline and any(s.first_up is None for s in sensors):
+            time.sleep(0.05)
+        ups = []
+        for sensor in sensors:
+            if sensor.first_up is not None:
+                boot.add(f"{sensor.name} up after {sensor.attempts} attempt(s)",
+                         sensor.first_attempt, sensor.first_up)
+                ups.append(sensor.first_up)
+            elif sensor.first_attempt is not None:
+                boot.add(f"{sensor.name} not up", sensor.first_attempt, time.monotonic())
+        if ups:
+            boot.add("first sensor data", min(ups))
+        print(boot.format())
+
+    threading.Thread(target=wait, name="startup-report", daemon=True).start()
+
+
+# ---------------------------------------------------------------
+# 3. ACQUISITION PROCESSES (--processes)
+# ---------------------------------------------------------------
+
+# Called in the sensor processes: each opens its own bus and raises
+# instead of printing, acquisition.worker retries with backoff. With a
+# BusManager per process nothing arbitrates between the devices, so
+# there is no obstacle priority either (RingLidar has no bus client
+# for flag_obstacle to flag)
+
+def open_tfluna():
+    from TfLunaI2C import TfLunaI2C
+    lidar = TfLunaI2C(i2cbus=shared_bus(I2C_CHANNEL).client("tfluna", PRIORITY_LIDAR))
+    lidar.read_data()
+    lidar.set_frame_rate(LIDAR_FPS)
+    return lidar
+
+def open_mpu6050():
+    from mpu6050 import MPU6050
+    mpu = MPU6050(bus=shared_bus(I2C_CHANNEL).client("mpu6050", PRIORITY_IMU), sample_rate=IMU_RATE)
+    mpu.enable_fifo()
+    return mpu
+
+def open_max30102(engine="python", streaming=False, int_pin=None):
+    from hr2 import HeartRateMonitor
+    sensor = _max30102_factory()
+    hr = HeartRateMonitor(sensor_factory=lambda: sensor, recorder=RECORDER,
+                          engine=engine, streaming=streaming, int_pin=_int_pin(int_pin))
+    hr.start_sensor()
+    return hr
+
+def start_acquisition():
+    from functools import partial
+    from acquisition import Acquisition
+    # the children import this module afresh, settings from the command
+    # line reach them as arguments
+    return Acquisition({
+        "lidar": (open_tfluna, 1.0 / LIDAR_FPS),
+        "imu": (open_mpu6050, 1.0 / RATES["imu"]),
+        "hr": (partial(open_max30102, HR_ENGINE, HR_STREAMING, HR_INT_PIN), 0.1),
+    }).start()
 
 
 # ---------------------------------------------------------------
 # MAIN LOOP
 # ---------------------------------------------------------------
-if __name__ == "__main__":
-    print("---------------------------------------")
-    print("STARTING ROBUST SENSOR LOOP")
-    print("---------------------------------------")
 
-    mpu = init_mpu6050()
-    lidar = init_lidar()
-    hr = init_max30102()
-    status_led = init_status_led() # <--- ADD THIS LINE
-    
+LOOP_TIME = 0.1
+# seconds between console status lines; printing costs a lot on the
+# serial console, the numbers are in the metrics anyway
+STATUS_EVERY = 10.0
 
-    try:
-        bt = BluetoothSender() 
-        bt.start()
-        print("[OK] Bluetooth Sender started")
-    except Exception as e:
-        print(f"[FATAL] Bluetooth start failed: {e}")
-        bt = None 
+LOOP_PERIOD_MS = metrics.histogram("loop.period_ms", metrics.BUCKETS_MS)
+LOOP_JITTER_MS = metrics.histogram("loop.jitter_ms", metrics.BUCKETS_MS)
+LOOP_WORK_US = metrics.histogram("loop.work_us")
 
+def status_line(distance, bpm, lidar_on):
+    line = f"[STATUS] Dist: {distance}cm | BPM: {bpm}"
+    if not lidar_on: line += " | [LIDAR OFF]"
+    return line
+
+def run(mpu, lidar, hr, status_led, bt, sleep=time.sleep, should_stop=None,
+        on_packet=None, verbose=True, gps=None, supervisor=None):
+    """
+    The sensor loop. SLEEP, SHOULD_STOP and ON_PACKET(packet, loop_time)
+    let trace replay drive it; on the device it runs forever. With a
+    SUPERVISOR the drivers come from it every loop and failures go back
+    to it, nothing is initialized here.
+    """
     loop_count = 0 
-     
-    LIDAR_RETRY_RATE = 50 # Retry LiDAR only every 50 loops (~5 seconds)
+    last_start = None
+    next_status = 0.0
+    reporter = metrics.Reporter()
 
     if status_led:
         status_led.color = (0, 0, 1)
 
 
-    while True:
+    while should_stop is None or not should_stop():
+        loop_start = time.perf_counter()
         loop_count += 1
+        if metrics.enabled and last_start is not None:
+            period = loop_start - last_start
+            LOOP_PERIOD_MS.observe(period * 1e3)
+            LOOP_JITTER_MS.observe(abs(period - LOOP_TIME) * 1e3)
+        last_start = loop_start
         
         # --- SAFE VARIABLES ---
         bpm = 0
@@ -115,36 +331,36 @@ if __name__ == "__main__":
         accel = [0, 0, 0]
         gyro = [0, 0, 0]
   
+        # ready drivers from the supervisor threads, never blocks
+        if supervisor is not None:
+            hr, lidar, mpu = supervisor.get("hr"), supervisor.get("lidar"), supervisor.get("mpu")
 
         # 1. Heart Rate
-        if hr is None: hr = init_max30102()
         if hr is not None:
             try: bpm = hr.bpm
-            except: hr = None
+            except Exception as e:
+                if supervisor is not None: supervisor.failed("hr", hr, e)
+                hr = None
 
-        # 2. LiDAR (THROTTLED RECONNECT)
-        # If LiDAR is disconnected, don't hammer the I2C bus every loop.
-        # Wait for the retry counter.
-        if lidar is None:
-            if loop_count % LIDAR_RETRY_RATE == 0:
-                lidar = init_lidar()
-        
+        # 2. LiDAR
         if lidar is not None:
             try:
                 lidar.read_data()
                 distance = lidar.dist
+                flag_obstacle(lidar, distance)
             except Exception as e:
                 print(f"[LIDAR LOST] Sensor disconnected.")
-                lidar = None # Mark as dead so we stop trying for 5 seconds
+                # the supervisor reconnects it with backoff
+                if supervisor is not None: supervisor.failed("lidar", lidar, e)
+                lidar = None
                 distance = 0
 
         # 3. MPU6050
-        if mpu is None: mpu = init_mpu6050()
         if mpu is not None:
-            try:
-                accel = mpu.acceleration
-                gyro  = mpu.gyro
-            except: mpu = None
+            try: accel, gyro = mpu.motion()
+            except Exception as e:
+                if supervisor is not None: supervisor.failed("mpu", mpu, e)
+                mpu = None
 
         # 4. Camera
         
@@ -155,17 +371,19 @@ if __name__ == "__main__":
             "dist_cm": distance if distance is not None else 0,
             "accel": accel,
             "gyro": gyro,
-            
+            # latest fix from the GPS thread, no serial I/O here
+            "gps": gps.as_dict() if gps is not None else None,
         }    
 
         if bt:
             bt.send_data(packet)
 
-        # 6. Console Status
-        status = f"Loop {loop_count} | Dist: {distance}cm | BPM: {bpm}"
-        
-        if lidar is None: status += " | [LIDAR OFF]"
-        print(status)
+        # 6. Console Status, every STATUS_EVERY seconds
+        if verbose and loop_start >= next_status:
+            next_status = loop_start + STATUS_EVERY
+            print(status_line(distance, bpm, lidar is not None))
+            if metrics.enabled:
+                print(reporter.line())
 
         if status_led:
             if lidar is None:
@@ -178,6 +396,318 @@ if __name__ == "__main__":
                 # Working but no phone connected -> BLUE
                 status_led.color = (0, 0, 1) 
 
-        time.sleep(0.1)
+        work = time.perf_counter() - loop_start
+        if metrics.enabled:
+            LOOP_WORK_US.observe(work * 1e6)
+        if on_packet is not None:
+            on_packet(packet, work)
+
+        sleep(LOOP_TIME)
+
+
+# ---------------------------------------------------------------
+# MULTI-RATE LOOP
+# ---------------------------------------------------------------
 
-   
+# Hz per task, override with --rate NAME=HZ
+RATES = {
+    "lidar": 100,     # TF-Luna does 100 Hz by default
+    "imu": 50,        # drains ~4 FIFO samples at a time
+    "publish": 10,    # packets to the phone
+    "status": 1,      # console line + LED
+}
+
+def run_scheduled(mpu, lidar, hr, status_led, bt, rates=None, duration=None,
+                  verbose=True, gps=None, supervisor=None):
+    """
+    Each sensor is read at its own rate, heart rate results are pushed by
+    the HR thread, and packets go out at the publish rate with the newest
+    value of everything. Drivers come from SUPERVISOR when given.
+    Returns the per-task timing stats.
+    """
+    import asyncio
+    from scheduler import Scheduler
+
+    rates = dict(RATES, **(rates or {}))
+    devices = {"mpu": mpu, "lidar": lidar, "hr": hr}
+    latest = {"bpm": 0, "dist_cm": 0, "accel": [0, 0, 0], "gyro": [0, 0, 0], "gps": None}
+    sched = Scheduler()
+    hr_event = asyncio.Event()
+    loop = None
+
+    def hr_result(bpm, spo2):
+        # called from the HR thread
+        if loop is not None:
+            try: loop.call_soon_threadsafe(hr_event.set)
+            except RuntimeError: pass  # run_scheduled has returned
+
+    def attach_hr(monitor):
+        if monitor is not None:
+            monitor.on_result = hr_result
+        return monitor
+
+    attach_hr(hr)
+
+    def device(name):
+        # the supervisor swaps drivers in from its threads
+        if supervisor is not None:
+            current = supervisor.get(name)
+            if current is not devices[name] and name == "hr":
+                attach_hr(current)
+            devices[name] = current
+        return devices[name]
+
+    def lost(name, error):
+        if supervisor is not None:
+            supervisor.failed(name, devices[name], error)
+        devices[name] = None
+
+    def read_lidar():
+        lidar = device("lidar")
+        if lidar is None:
+            return
+        try:
+            lidar.read_data()
+            latest["dist_cm"] = lidar.dist or 0
+            flag_obstacle(lidar, latest["dist_cm"])
+        except Exception as e:
+            print(f"[LIDAR LOST] Sensor disconnected.")
+            lost("lidar", e)
+            latest["dist_cm"] = 0
+
+    def read_imu():
+        mpu = device("mpu")
+        if mpu is None:
+            return
+        try:
+            latest["accel"], latest["gyro"] = mpu.motion()
+        except Exception as e:
+            lost("mpu", e)
+
+    def hr_update():
+        hr = device("hr")
+        if hr is not None:
+            latest["bpm"] = hr.bpm
+
+    def publish():
+        # the HR thread pushes results, a ring reader has nobody to push
+        hr = device("hr")
+        latest["bpm"] = hr.bpm if hr is not None else 0
+        if gps is not None:
+            latest["gps"] = gps.as_dict()
+        if bt:
+            bt.send_data(dict(latest))
+
+    reporter = metrics.Reporter()
+    next_status = [0.0]
+
+    def status():
+        now = time.monotonic()
+        if verbose and now >= next_status[0]:
+            next_status[0] = now + STATUS_EVERY
+            line = status_line(latest["dist_cm"], latest["bpm"], devices["lidar"] is not None)
+            if metrics.enabled:
+                # task lateness and run times are in sched.* there
+                print(line)
+                print(reporter.line())
+            else:
+                for name in ("lidar", "imu", "publish"):
+                    stats = sched.stats[name]
+                    line += f" | {name} {stats.rate:.0f}Hz ovr {stats.overruns} jit {stats.jitter * 1e6:.0f}us"
+                print(line)
+        if status_led:
+            if devices["lidar"] is None:
+                status_led.color = (1, 0, 0)
+            elif bt and bt.connected:
+                status_led.color = (0, 1, 0)
+            else:
+                status_led.color = (0, 0, 1)
+
+    sched.every("lidar", rates["lidar"], read_lidar)
+    sched.every("imu", rates["imu"], read_imu)
+    sched.on_event("hr", hr_event, hr_update)
+    sched.every("publish", rates["publish"], publish)
+    sched.every("status", rates["status"], status)
+
+    async def main():
+        nonlocal loop
+        loop = asyncio.get_running_loop()
+        await sched.run(duration)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    return sched.report()
+
+
+# ---------------------------------------------------------------
+# TRACE REPLAY
+# ---------------------------------------------------------------
+
+def run_replay(path, realtime=False, engine="python", streaming=False):
+    """
+    Run the sensor loop, the HR algorithm and the BluetoothSender framing
+    against a recorded trace. Returns timing stats and a digest of every
+    packet, so two runs (e.g. two hrcalc engines) can be compared.
+    """
+    import sensor_trace
+    from gps_reader import GpsService
+    from hr2 import HeartRateMonitor
+
+    replay = sensor_trace.TraceReplay(path, realtime=realtime)
+    monitor = HeartRateMonitor(engine=engine, streaming=streaming)
+    hr = sensor_trace.ReplayHeartRateMonitor(monitor, replay.max30102())
+
+    sink = sensor_trace.TraceSink(keep=False)
+    bt = BluetoothSender()
+    bt.add_client(sink, "trace")
+
+    digest = hashlib.sha1()
+    loop_times = []
+
+    def on_packet(packet, loop_time):
+        bt.flush()
+        digest.update(json.dumps(packet, sort_keys=True).encode())
+        loop_times.append(loop_time)
+
+    wall = time.perf_counter()
+    gps = GpsService(replay.gps_serial(), clock=replay.time)
+    run(replay.mpu6050(), replay.lidar(), hr, None, bt, sleep=replay.sleep,
+        should_stop=replay.finished, on_packet=on_packet, verbose=False, gps=gps)
+    wall = time.perf_counter() - wall
+
+    loop_us = [t * 1e6 for t in loop_times] or [0.0]
+    return {
+        "trace_seconds": replay.duration,
+        "wall_seconds": wall,
+        "packets": len(loop_times),
+        "packet_rate": len(loop_times) / replay.duration if replay.duration else 0.0,
+        "loop_us_p50": float(sorted(loop_us)[len(loop_us) // 2]),
+        "loop_us_max": float(max(loop_us)),
+        "hr_calc_us": hr.calc_time / hr.calc_calls * 1e6 if hr.calc_calls else 0.0,
+        "bt_bytes": sink.bytes,
+        "digest": digest.hexdigest(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PathPal sensor loop")
+    parser.add_argument("--record", metavar="TRACE", help="record every sensor reading to TRACE")
+    parser.add_argument("--replay", metavar="TRACE", help="run the pipeline against TRACE, no hardware")
+    parser.add_argument("--realtime", action="store_true", help="replay at recorded speed")
+    # hrcalc.ENGINES, not imported here to keep NumPy off the startup path
+    parser.add_argument("--engine", default="python", choices=("python", "numpy", "numpy-float"),
+                        help="hrcalc engine of the HR thread and replay (default %(default)s)")
+    parser.add_argument("--streaming", action="store_true", help="use the streaming HR estimator (O(1) work per sample)")
+    parser.add_argument("--int-pin", type=int, metavar="GPIO",
+                        help="wake the HR thread on the MAX30102 INT line at this GPIO instead of polling")
+    parser.add_argument("--fixed-loop", action="store_true", help="old single 10 Hz loop instead of the scheduler")
+    parser.add_argument("--rate", action="append", default=[], metavar="TASK=HZ",
+                        help="task rate for the scheduler, e.g. --rate lidar=250")
+    parser.add_argument("--listen", action="append", metavar="URL",
+                        help="transport for phones: rfcomm://, tcp://HOST:PORT or unix:///PATH (repeatable)")
+    parser.add_argument("--no-metrics", action="store_true", help="turn the runtime metrics off")
+    parser.add_argument("--metrics-socket", default=metrics.SOCKET_PATH, metavar="PATH",
+                        help="metrics snapshots and commands (profile) here, '' for none (default %(default)s)")
+    parser.add_argument("--status-every", type=float, default=STATUS_EVERY, metavar="SECONDS",
+                        help="seconds between console status lines (default %(default)s)")
+    parser.add_argument("--log", type=int, default=0, metavar="MIB",
+                        help="keep the newest MIB MiB of samples in a log in --log-dir (off by default)")
+    parser.add_argument("--log-dir", default=SAMPLE_LOG_DIR, metavar="DIR",
+                        help="sample log directory (default %(default)s)")
+    parser.add_argument("--processes", action="store_true",
+                        help="read each sensor in its own process through shared memory "
+                             "(no --record, --log or I2C priority for obstacles)")
+    args = parser.parse_args()
+    # the drivers live in the child processes, a recorder would only see vitals
+    if args.record and args.processes:
+        parser.error("--record cannot be used with --processes")
+    if args.log and args.processes:
+        parser.error("--log cannot be used with --processes")
+
+    if args.replay:
+        stats = run_replay(args.replay, args.realtime, args.engine, args.streaming)
+        for key, value in stats.items():
+            print(f"{key:14s} {value}")
+        sys.exit(0)
+
+    if args.record:
+        from sensor_trace import TraceWriter
+        RECORDER = TraceWriter(args.record)
+        print(f"[OK] Recording to {args.record}")
+    elif args.log:
+        try:
+            from sample_log import SEGMENT_BYTES, SampleLog
+            segments = max(2, args.log * 1024 * 1024 // SEGMENT_BYTES)
+            RECORDER = SampleLog(args.log_dir, segments=segments).start()
+            print(f"[OK] Sample log in {args.log_dir} ({segments} x {SEGMENT_BYTES >> 20} MiB)")
+        except OSError as e:
+            print(f"[ERR] Sample log failed: {e}")
+
+    print("---------------------------------------")
+    print("STARTING ROBUST SENSOR LOOP")
+    print("---------------------------------------")
+
+    STATUS_EVERY = args.status_every
+    HR_ENGINE = args.engine
+    HR_INT_PIN = args.int_pin
+    HR_STREAMING = args.streaming
+    metrics.enable(not args.no_metrics)
+    # kill -USR1 or "python metrics.py profile 30" take a stack profile
+    profiler.install()
+    metrics_server = None
+    if args.metrics_socket:
+        try:
+            metrics_server = metrics.MetricsServer(args.metrics_socket).start()
+            print(f"[OK] Metrics and control on {args.metrics_socket}")
+        except OSError as e:
+            print(f"[ERR] Metrics socket failed: {e}")
+
+    # Bluetooth first: phones can connect while the sensors come up
+    try:
+        with BOOT.phase("bluetooth"):
+            links = [transport.from_url(url) for url in args.listen or LISTEN]
+            bt = BluetoothSender(obstacle_cm=OBSTACLE_CM, backlog=Backlog(BACKLOG_DIR), transports=links)
+            bt.start()
+        print("[OK] Bluetooth Sender started")
+    except Exception as e:
+        print(f"[FATAL] Bluetooth start failed: {e}")
+        bt = None 
+
+    # sensors come up in parallel in the background, the loop starts right away
+    with BOOT.phase("supervisor"):
+        acquisition = start_acquisition() if args.processes else None
+        supervisor = start_supervisor(acquisition)
+    with BOOT.phase("gps"):
+        gps = init_gps()
+    with BOOT.phase("led"):
+        status_led = init_status_led() # <--- ADD THIS LINE
+    report_startup(BOOT, supervisor)
+    BOOT.event("loop")
+
+    try:
+        if args.fixed_loop:
+            run(None, None, None, status_led, bt, gps=gps, supervisor=supervisor)
+        else:
+            rates = {}
+            for item in args.rate:
+                name, hz = item.split("=")
+                rates[name] = float(hz)
+            report = run_scheduled(None, None, None, status_led, bt, rates, gps=gps,
+                                   supervisor=supervisor)
+            for name, stats in report.items():
+                print(f"[SCHED] {name}: {stats}")
+            for manager in open_buses():
+                for name, stats in manager.report().items():
+                    print(f"[I2C] {name}: {stats}")
+    finally:
+        supervisor.stop()
+        for name, health in supervisor.health().items():
+            print(f"[SUP] {name}: {health}")
+        if acquisition is not None:
+            acquisition.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        if RECORDER is not None:
+            RECORDER.close()
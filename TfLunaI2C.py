@@ -1,3 +1,6 @@
+import collections
+import struct
+import threading
 import time
 from smbus import SMBus
 
@@ -14,6 +17,8 @@ class TfLunaI2C:
     TICK_LO = 0x06
     ERROR_LO = 0x08
     VERSION_MAJOR = 0x0C
+    MODE = 0x23
+    TRIG_ONE_SHOT = 0x24
     FPS_LO = 0x26
     SAVE_SETTINGS = 0x20
     REBOOT = 0x21
@@ -23,14 +28,22 @@ class TfLunaI2C:
     REBOOT_CODE = 0x02
     TRUE = 0x01
     FALSE = 0x00
+    MODE_CONTINUOUS = 0x00
+    MODE_TRIGGER = 0x01
 
-    def __init__(self, address=DEFAULT_I2C_ADDR, us=True, bus=1):
+    # registers 0x00-0x07: distance (cm), amplitude, temperature (0.01 C), tick (ms)
+    FRAME = struct.Struct("<HHHH")
+
+    def __init__(self, address=DEFAULT_I2C_ADDR, us=True, bus=1, i2cbus=None):
         self.address = address
         self.us = us
         self.dist = 0
         self.amp = 0
+        self.temp = 0.0
+        self.tick = 0
         self.bus = bus
-        self.i2cbus = SMBus(self.bus)
+        # pass an already opened bus (e.g. a simulated one) to skip SMBus
+        self.i2cbus = i2cbus if i2cbus is not None else SMBus(self.bus)
         
         # We attempt to load settings. If device is missing, this will fail 
         # (which is good, so the main script knows it's offline).
@@ -49,20 +62,29 @@ class TfLunaI2C:
     def _write_byte(self, register, data):
         self.i2cbus.write_byte_data(self.address, register, data)
 
-    def read_data(self):
+    def read_frame(self):
         """
-        Reads data set from device.
+        Reads distance, amplitude, temperature and tick in one block read.
         """
         # This will throw an OSError if the wire is disconnected
-        distance = self._read_word(self.DIST_LO)
-        amplitude = self._read_word(self.AMP_LO)
-        
+        data = self.i2cbus.read_i2c_block_data(self.address, self.DIST_LO, self.FRAME.size)
+        distance, amplitude, temp, tick = self.FRAME.unpack(bytes(data))
+
         # Filter obvious garbage data
         if distance > 1200: 
             distance = 0
             
         self.dist = distance
         self.amp = amplitude
+        self.temp = temp / 100.0
+        self.tick = tick
+        return distance, amplitude, self.temp, tick
+
+    def read_data(self):
+        """
+        Reads data set from device.
+        """
+        self.read_frame()
         return [self.dist, self.amp]
 
     def _load_settings(self):
@@ -71,6 +93,22 @@ class TfLunaI2C:
 
     def read_frame_rate(self):
         return self._read_word(self.FPS_LO)
+
+    def set_frame_rate(self, fps):
+        """
+        Frames per second in continuous mode (1-250 on the TF-Luna).
+        """
+        self._write_word(self.FPS_LO, int(fps))
+
+    def set_trigger_mode(self, enabled=True):
+        """
+        In trigger mode the sensor measures once per trigger() instead of
+        continuously at the frame rate.
+        """
+        self._write_byte(self.MODE, self.MODE_TRIGGER if enabled else self.MODE_CONTINUOUS)
+
+    def trigger(self):
+        self._write_byte(self.TRIG_ONE_SHOT, 0x01)
     
     # Helper properties required by your script
     @property
@@ -84,4 +122,133 @@ class TfLunaI2C:
 
     @staticmethod
     def celsius2fahrenheit(celsius):
-        return (1.8 * celsius) + 32.0
\ No newline at end of file
+        return (1.8 * celsius) + 32.0
+
+
+Reading = collections.namedtuple("Reading", "time dist amp temp tick")
+
+
+class TfLunaReader(object):
+    """
+    Samples a TfLunaI2C in a background thread at the sensor frame rate.
+
+    The newest Reading and a short history are published without locks:
+    the thread only ever replaces `latest` and writes a history slot
+    before bumping `count`, so the main loop gets a fresh distance without
+    touching the bus. Has read_data()/dist like the driver, so it can be
+    used in its place.
+    """
+
+    MAX_ERRORS = 3  # consecutive I2C errors before giving up
+
+    def __init__(self, lidar, fps=100, trigger=False, history=64, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.lidar = lidar
+        self.fps = fps
+        self.trigger = trigger
+        self.clock = clock
+        self.sleep = sleep
+        self.latest = None
+        self.count = 0
+        self.reads = 0
+        self.error = None
+        # one spare slot: the one the thread may be writing
+        self._history = [None] * (history + 1)
+        self._thread = None
+        self._stop = False
+
+    # -----------------------------------------------------
+    # consumer side
+    # -----------------------------------------------------
+    def read_data(self):
+        """
+        Newest distance and amplitude. Raises the I2C error that stopped
+        the thread, so callers see a disconnect like with the driver.
+        """
+        if self.error is not None:
+            raise self.error
+        latest = self.latest
+        if latest is None:
+            return [0, 0]
+        return [latest.dist, latest.amp]
+
+    @property
+    def dist(self):
+        latest = self.latest
+        return latest.dist if latest is not None else 0
+
+    @property
+    def distance(self):
+        return self.dist
+
+    @property
+    def i2cbus(self):
+        return self.lidar.i2cbus
+
+    def history(self, n=None):
+        """
+        Up to N newest readings, oldest first.
+        """
+        size = len(self._history)
+        n = size - 1 if n is None else min(n, size - 1)
+        while True:
+            count = self.count
+            n = min(n, count)
+            readings = [self._history[i % size] for i in range(count - n, count)]
+            # retry if the writer reached the slots we copied
+            if self.count - count < size - n:
+                return readings
+
+    # -----------------------------------------------------
+    # acquisition thread
+    # -----------------------------------------------------
+    def start(self):
+        if self.trigger:
+            self.lidar.set_trigger_mode(True)
+        elif self.fps:
+            self.lidar.set_frame_rate(self.fps)
+        self._stop = False
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        self._stop = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run(self):
+        period = 1.0 / self.fps
+        release = self.clock()
+        errors = 0
+        last_tick = None
+        while not self._stop:
+            try:
+                if self.trigger:
+                    self.lidar.trigger()
+                dist, amp = self.lidar.read_data()
+                self.reads += 1
+                errors = 0
+            except OSError as e:
+                errors += 1
+                if errors > self.MAX_ERRORS:
+                    self.error = e
+                    return
+                dist = None
+
+            tick = getattr(self.lidar, "tick", None)
+            if dist is not None and (tick is None or tick != last_tick or self.trigger):
+                last_tick = tick
+                reading = Reading(self.clock(), dist, amp,
+                                  getattr(self.lidar, "temp", 0.0), tick)
+                self._history[self.count % len(self._history)] = reading
+                self.latest = reading
+                self.count += 1
+
+            release += period
+            delay = release - self.clock()
+            if delay > 0:
+                self.sleep(delay)
+            else:
+                release = self.clock()  # fell behind, do not burst
@@ -0,0 +1,245 @@
+"""
+Optional multi-process acquisition: every sensor driver runs in its own
+process and publishes timestamped samples in a shm_ring.SampleRing, so
+hrcalc crunching a window or the BluetoothSender threads can no longer
+hold the GIL while the lidar is due.
+
+    acq = Acquisition({
+        "lidar": (Sensortest.open_tfluna, 1 / 100),
+        "imu": (Sensortest.open_mpu6050, 1 / 50),
+        "hr": (Sensortest.open_max30102, 1 / 10),
+    }).start()
+    lidar = acq.reader("lidar")      # read_data()/dist like TfLunaReader
+    mpu = acq.reader("imu")          # motion() like MPU6050
+    hr = acq.reader("hr")            # bpm like HeartRateMonitor
+
+Each process keeps its driver up with its own supervisor.Supervisor and
+samples it every PERIOD seconds; the heart rate process publishes the
+current (bpm, spo2) of its HeartRateMonitor thread. The openers are
+called in the child, so they must be module level functions (the
+processes are spawned, not forked, because the parent has threads).
+A reader raises OSError when its ring has had nothing new for
+MAX_AGE, so the loops treat a dead process like a disconnected sensor.
+"""
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from shm_ring import SampleRing
+from supervisor import Supervisor
+
+# ring layout per kind: values per row and rows
+RINGS = {
+    "lidar": (2, 1024),   # dist, amp
+    "imu": (6, 2048),     # accel x/y/z, gyro x/y/z
+    "hr": (2, 64),        # bpm, spo2
+}
+MAX_AGE = 0.5  # seconds without a new sample before a reader gives up
+
+
+# ---------------------------------------------------------------
+# CHILD PROCESSES
+# ---------------------------------------------------------------
+
+def _sample_lidar(lidar, ring, state):
+    dist, amp = lidar.read_data()
+    # only new frames, the sensor repeats the last one between frames
+    tick = getattr(lidar, "tick", None)
+    if tick is None or tick != state.get("tick"):
+        state["tick"] = tick
+        ring.write(time.monotonic(), (dist, amp))
+
+
+def _sample_imu(mpu, ring, state):
+    block = mpu.drain()
+    ring.write_block(block.t, np.hstack((block.accel, block.gyro)))
+
+
+def _sample_hr(hr, ring, state):
+    # the monitor thread computes, this loop stays the only ring writer
+    ring.write(time.monotonic(), (hr.bpm, hr.spo2))
+
+
+def _close_hr(hr):
+    hr.stop_sensor()
+
+
+def _hr_healthy(hr):
+    return hr.alive and hr.consecutive_errors <= 10
+
+
+SAMPLERS = {"lidar": _sample_lidar, "imu": _sample_imu, "hr": _sample_hr}
+CLOSERS = {"lidar": None, "imu": lambda mpu: mpu.close(), "hr": _close_hr}
+CHECKS = {"hr": _hr_healthy}
+
+
+def worker(kind, ring_name, opener, period, stop):
+    """
+    Body of one acquisition process.
+    """
+    ring = SampleRing.attach(ring_name)
+    sup = Supervisor(max_delay=5.0)
+    sup.add(kind, opener, close=CLOSERS[kind], check=CHECKS.get(kind)).start()
+    sample = SAMPLERS[kind]
+    state = {}
+    release = time.monotonic()
+    try:
+        while not stop.is_set():
+            driver = sup.get(kind)
+            if driver is not None:
+                try:
+                    sample(driver, ring, state)
+                except Exception as e:
+                    sup.failed(kind, driver, e)
+            release += period
+            delay = release - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                release = time.monotonic()  # fell behind, do not burst
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sup.stop()
+        ring.close()
+
+
+# ---------------------------------------------------------------
+# PARENT SIDE
+# ---------------------------------------------------------------
+
+class RingReader(object):
+    """
+    Newest row of a ring, checked for age.
+    """
+
+    def __init__(self, name, ring, max_age=MAX_AGE, clock=time.monotonic):
+        self.name = name
+        self.ring = ring
+        self.max_age = max_age
+        self.clock = clock
+
+    def newest(self):
+        """
+        Copy of the newest row; OSError when it is older than max_age.
+        """
+        while True:
+            seq, row = self.ring.latest()
+            if seq is None:
+                raise OSError(f"no {self.name} samples yet")
+            values = row.copy()
+            if self.ring.valid(seq):
+                break
+        age = self.clock() - values[0]
+        if age > self.max_age:
+            raise OSError(f"no {self.name} samples for {age:.1f} s")
+        return values
+
+    def ready(self):
+        """
+        Self once fresh samples arrive, for Supervisor init functions.
+        """
+        self.newest()
+        return self
+
+
+class RingLidar(RingReader):
+
+    def __init__(self, ring, **kwargs):
+        RingReader.__init__(self, "lidar", ring, **kwargs)
+        self.time = 0.0  # when the newest read_data() sample was taken
+        self.dist = 0
+        self.amp = 0
+
+    def read_data(self):
+        t, dist, amp = self.newest()
+        self.time, self.dist, self.amp = t, int(dist), int(amp)
+        return [self.dist, self.amp]
+
+    @property
+    def distance(self):
+        return self.dist
+
+
+class RingImu(RingReader):
+
+    def __init__(self, ring, **kwargs):
+        RingReader.__init__(self, "imu", ring, **kwargs)
+        self._seq = -1
+        self.block = None
+
+    def motion(self):
+        values = self.newest()
+        # everything since the last call, like MPU6050.block
+        self._seq, rows = self.ring.since(self._seq)
+        self.block = rows
+        return values[1:4].tolist(), values[4:7].tolist()
+
+
+class RingHeartRate(RingReader):
+    """
+    Reads like a HeartRateMonitor; bpm is 0 while the process is down.
+    """
+
+    def __init__(self, ring, **kwargs):
+        RingReader.__init__(self, "hr", ring, **kwargs)
+        self.on_result = None  # results arrive by polling
+
+    @property
+    def bpm(self):
+        try: return float(self.newest()[1])
+        except OSError: return 0
+
+    @property
+    def spo2(self):
+        try: return float(self.newest()[2])
+        except OSError: return -999
+
+
+READERS = {"lidar": RingLidar, "imu": RingImu, "hr": RingHeartRate}
+
+
+class Acquisition(object):
+    """
+    Creates the rings and the processes, and readers for the loop.
+    CHANNELS maps a kind in RINGS to (opener, period).
+    """
+
+    def __init__(self, channels, prefix=None, context="spawn"):
+        self.channels = channels
+        self.prefix = prefix or f"pathpal-{os.getpid()}"
+        self.ctx = multiprocessing.get_context(context)
+        self.stop_event = self.ctx.Event()
+        self.rings = {}
+        self.processes = {}
+
+    def start(self):
+        for kind, (opener, period) in self.channels.items():
+            width, capacity = RINGS[kind]
+            ring = SampleRing.create(f"{self.prefix}-{kind}", width, capacity)
+            self.rings[kind] = ring
+            process = self.ctx.Process(target=worker, name=f"acq-{kind}",
+                                       args=(kind, ring.name, opener, period, self.stop_event))
+            process.daemon = True
+            process.start()
+            self.processes[kind] = process
+        return self
+
+    def reader(self, kind, **kwargs):
+        return READERS[kind](self.rings[kind], **kwargs)
+
+    def alive(self):
+        return {kind: process.is_alive() for kind, process in self.processes.items()}
+
+    def stop(self, timeout=3.0):
+        self.stop_event.set()
+        for process in self.processes.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        for ring in self.rings.values():
+            ring.close()
+        self.rings.clear()
+        self.processes.clear()
@@ -0,0 +1,126 @@
+"""
+Store-and-forward backlog for packets recorded while no phone is
+connected.
+
+Packets are kept in RAM; past RAM_PACKETS the oldest are spilled to disk
+in segment files of SEGMENT_PACKETS (one JSON line per packet), so an
+SD card write happens once per segment, never per packet. Both tiers are
+bounded: without a directory the oldest packets in RAM are dropped, with
+one the oldest segment file is deleted once the files pass DISK_BYTES.
+
+    backlog = Backlog("/var/tmp/pathpal-backlog")
+    backlog.append(packet, t)    # main loop, cheap
+    backlog.spill()              # background thread, writes segments
+    for t, packet in backlog.take(64): ...
+
+take() returns the oldest packets first. The BluetoothSender replays
+them after a reconnect in chunks between live batches.
+"""
+import collections
+import json
+import os
+import threading
+
+RAM_PACKETS = 3000      # 30 s at 100 Hz
+SEGMENT_PACKETS = 1000
+DISK_BYTES = 64 * 1024 * 1024
+
+
+class Backlog(object):
+
+    def __init__(self, path=None, ram_packets=RAM_PACKETS, segment_packets=SEGMENT_PACKETS,
+                 disk_bytes=DISK_BYTES):
+        self.path = path
+        self.ram_packets = ram_packets
+        self.segment_packets = segment_packets
+        self.disk_bytes = disk_bytes
+        self._ram = collections.deque()      # (t, packet), newest on the right
+        self._segments = collections.deque()  # (file name, packets, bytes), oldest first
+        self._reading = collections.deque()  # the oldest segment, loaded back
+        self._lock = threading.Lock()
+        self._next_segment = 0
+        self.disk_used = 0
+        self.dropped = 0
+        self.spilled = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            # left over from a previous boot: the timestamps are meaningless now
+            for name in os.listdir(path):
+                if name.endswith(".seg"):
+                    os.remove(os.path.join(path, name))
+
+    def __len__(self):
+        return len(self._reading) + sum(n for _, n, _ in self._segments) + len(self._ram)
+
+    def append(self, packet, t):
+        with self._lock:
+            self._ram.append((t, packet))
+            # spill() runs in another thread; past twice the RAM budget, or
+            # with nowhere to spill, the oldest go
+            limit = self.ram_packets if self.path is None else 2 * self.ram_packets
+            if len(self._ram) > limit:
+                self._ram.popleft()
+                self.dropped += 1
+
+    def spill(self):
+        """
+        Writes the oldest RAM packets to segment files while RAM is over budget.
+        """
+        while self.path is not None and len(self._ram) > self.ram_packets:
+            with self._lock:
+                n = min(self.segment_packets, len(self._ram))
+                chunk = [self._ram.popleft() for _ in range(n)]
+            name = os.path.join(self.path, f"{self._next_segment:08d}.seg")
+            self._next_segment += 1
+            data = "".join(json.dumps([t, packet]) + "\n" for t, packet in chunk).encode()
+            with open(name, "wb") as f:
+                f.write(data)
+            with self._lock:
+                self._segments.append((name, n, len(data)))
+                self.disk_used += len(data)
+                self.spilled += n
+                while self.disk_used > self.disk_bytes and len(self._segments) > 1:
+                    old, old_n, old_bytes = self._segments.popleft()
+                    os.remove(old)
+                    self.disk_used -= old_bytes
+                    self.dropped += old_n
+
+    def take(self, n):
+        """
+        Removes and returns up to N of the oldest (t, packet).
+        """
+        out = []
+        while len(out) < n:
+            if self._reading:
+                out.append(self._reading.popleft())
+                continue
+            with self._lock:
+                segment = self._segments.popleft() if self._segments else None
+                if segment is None:
+                    while len(out) < n and self._ram:
+                        out.append(self._ram.popleft())
+                    break
+                self.disk_used -= segment[2]
+            # read back outside the lock, append() keeps going meanwhile
+            with open(segment[0], "rb") as f:
+                self._reading.extend(tuple(json.loads(line)) for line in f)
+            os.remove(segment[0])
+        return out
+
+    def clear(self):
+        with self._lock:
+            for name, _, _ in self._segments:
+                os.remove(name)
+            self._segments.clear()
+            self._reading.clear()
+            self._ram.clear()
+            self.disk_used = 0
+
+    def stats(self):
+        return {
+            "packets": len(self),
+            "ram_packets": len(self._ram) + len(self._reading),
+            "disk_bytes": self.disk_used,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+        }
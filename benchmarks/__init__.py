@@ -0,0 +1,154 @@
+"""
+Benchmark suite for the PathPal hot paths.
+
+    python3 -m benchmarks run                      # run everything
+    python3 -m benchmarks run hrcalc --save base.json
+    python3 -m benchmarks compare base.json new.json
+
+Every benchmark is a function registered with @benchmark(name). It gets
+the command line options and returns a flat dict of metrics. Timings come
+from timeit() (warmup, repeats, percentiles in microseconds); other
+metrics (transactions per sample, bytes per packet...) are plain numbers.
+"""
+import gc
+import json
+import platform
+import time
+
+import numpy as np
+
+BENCHMARKS = {}
+
+
+class Skip(Exception):
+    """
+    Raised by a benchmark that cannot run here (missing input or library).
+    """
+
+# timing percentiles that are reported but too noisy to flag regressions on
+NOISY_METRICS = ("p90_us", "p99_us", "max_us", "min_us", "mean_us")
+
+
+def benchmark(name):
+    """
+    Register FUNC(options) -> {metric: value} under NAME.
+    """
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def higher_is_better(metric):
+    return metric.endswith("_per_s") or metric.endswith("_speedup")
+
+
+def timeit(func, repeat=200, warmup=20, min_sample=50e-6):
+    """
+    Time FUNC() REPEAT times after WARMUP calls. Fast functions are run
+    several times per sample so each sample lasts at least MIN_SAMPLE
+    seconds. Returns percentiles of the per-call time in microseconds.
+    """
+    for _ in range(warmup):
+        func()
+
+    start = time.perf_counter()
+    func()
+    once = time.perf_counter() - start
+    number = max(1, int(min_sample / max(once, 1e-9)))
+
+    samples = np.empty(repeat)
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for i in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            samples[i] = (time.perf_counter() - start) / number
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    samples *= 1e6
+    return {
+        "p50_us": float(np.percentile(samples, 50)),
+        "p90_us": float(np.percentile(samples, 90)),
+        "p99_us": float(np.percentile(samples, 99)),
+        "mean_us": float(samples.mean()),
+        "min_us": float(samples.min()),
+    }
+
+
+def run(names, options):
+    """
+    Run the benchmarks in NAMES (prefix match, all when empty).
+    Returns {"meta": ..., "results": {name: metrics}}.
+    """
+    # importing the modules registers their benchmarks
+    from benchmarks import bench_hrcalc, bench_drivers, bench_io, bench_pipeline
+
+    results = {}
+    for name in sorted(BENCHMARKS):
+        if names and not any(name.startswith(n) for n in names):
+            continue
+        try:
+            results[name] = BENCHMARKS[name](options)
+        except (ImportError, Skip) as e:
+            # e.g. pynmea2 or pyserial missing on this box
+            print(f"[SKIP] {name}: {e}")
+            continue
+        print(format_result(name, results[name]))
+
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "node": platform.node(),
+            "repeat": options.repeat,
+        },
+        "results": results,
+    }
+
+
+def format_result(name, metrics):
+    values = " ".join(f"{key}={value:.4g}" for key, value in metrics.items()
+                      if key not in NOISY_METRICS or key == "p99_us")
+    return f"{name:36s} {values}"
+
+
+def save(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.10):
+    """
+    Compare two reports. Returns a list of (name, metric, old, new, change,
+    regressed) for every metric present in both; change is relative and
+    positive when the metric got worse.
+    """
+    rows = []
+    for name, old_metrics in sorted(baseline["results"].items()):
+        new_metrics = current["results"].get(name)
+        if new_metrics is None:
+            continue
+        for metric, old in sorted(old_metrics.items()):
+            new = new_metrics.get(metric)
+            if new is None or metric.endswith(NOISY_METRICS):
+                continue
+            if old == 0:
+                change = 0.0 if new == 0 else float("inf")
+            else:
+                change = (new - old) / abs(old)
+            if higher_is_better(metric):
+                change = -change
+            rows.append((name, metric, old, new, change, change > threshold))
+    return rows
@@ -0,0 +1,64 @@
+import argparse
+import sys
+
+import benchmarks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m benchmarks", description=benchmarks.__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command")
+
+    run = sub.add_parser("run", help="run benchmarks")
+    run.add_argument("names", nargs="*", help="benchmark name prefixes (default: all)")
+    run.add_argument("--repeat", type=int, default=200)
+    run.add_argument("--trace", help="also use the PPG windows of a recorded trace")
+    run.add_argument("--save", metavar="JSON", help="write the results as a baseline")
+    run.add_argument("--baseline", metavar="JSON", help="compare against a saved baseline")
+    run.add_argument("--threshold", type=float, default=0.10)
+
+    cmp = sub.add_parser("compare", help="compare two saved results")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+    cmp.add_argument("--threshold", type=float, default=0.10)
+
+    sub.add_parser("list", help="list benchmarks")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        from benchmarks import bench_hrcalc, bench_drivers, bench_io, bench_pipeline
+        for name in sorted(benchmarks.BENCHMARKS):
+            print(name)
+        return 0
+
+    if args.command == "compare":
+        return report_compare(benchmarks.load(args.baseline), benchmarks.load(args.current),
+                              args.threshold)
+
+    if args.command == "run":
+        report = benchmarks.run(args.names, args)
+        if args.save:
+            benchmarks.save(report, args.save)
+            print(f"saved {args.save}")
+        if args.baseline:
+            return report_compare(benchmarks.load(args.baseline), report, args.threshold)
+        return 0
+
+    parser.print_help()
+    return 2
+
+
+def report_compare(baseline, current, threshold):
+    rows = benchmarks.compare(baseline, current, threshold)
+    regressions = 0
+    for name, metric, old, new, change, regressed in rows:
+        flag = "REGRESSION" if regressed else ""
+        regressions += regressed
+        print(f"{name:36s} {metric:24s} {old:12.4g} -> {new:12.4g} {change:+8.1%} {flag}")
+    print(f"{regressions} regression(s) over {threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""
+I2C drivers on the simulated bus: decoding, transactions, acquisition modes.
+"""
+import struct
+import threading
+import time
+
+import numpy as np
+
+from benchmarks import benchmark, timeit
+from i2c_bus import BusManager, PRIORITY_HR, PRIORITY_IMU, PRIORITY_LIDAR
+from max30102 import MAX30102, FifoPoller, SAMPLE_RATE, decode_fifo
+from mpu6050 import MPU6050
+from sim_i2c import (I2C_BYTE_TIME, I2C_TRANSACTION_TIME, SimBus, SimClock,
+                     SimInterruptPin, SimMax30102, SimMpu6050, SimTfLuna)
+from TfLunaI2C import TfLunaI2C, TfLunaReader
+
+
+@benchmark("max30102.decode")
+def bench_decode(options):
+    """
+    decode_fifo on a full FIFO (32 samples).
+    """
+    data = bytes(range(6)) * 32
+    return timeit(lambda: decode_fifo(data), repeat=options.repeat)
+
+
+@benchmark("max30102.fifo_transactions")
+def bench_fifo_transactions(options, samples=320):
+    """
+    I2C transactions per sample: read_fifo loop vs drain, 17-sample polls.
+    """
+    bus = SimBus()
+    ppg = bus.attach(SimMax30102())
+    sensor = MAX30102(bus=bus)
+    results = {}
+
+    start = bus.transactions
+    count = 0
+    while count < samples:
+        ppg.push_samples(17)
+        num_samples = sensor.get_data_present()
+        while num_samples > 0:
+            sensor.read_fifo()
+            num_samples -= 1
+            count += 1
+    results["read_fifo_transactions_per_sample"] = (bus.transactions - start) / count
+
+    start = bus.transactions
+    count = 0
+    while count < samples:
+        ppg.push_samples(17)
+        red, ir = sensor.drain()
+        count += len(ir)
+    results["drain_transactions_per_sample"] = (bus.transactions - start) / count
+    return results
+
+
+@benchmark("max30102.acquisition")
+def bench_acquisition(options, seconds=60.0):
+    """
+    Wakeups and I2C transactions per sample for the three acquisition modes,
+    on a simulated clock so it runs instantly.
+    """
+    results = {}
+    for mode in ("poll_10ms", "adaptive", "interrupt"):
+        clock = SimClock()
+        bus = SimBus()
+        ppg = bus.attach(SimMax30102(sample_rate=SAMPLE_RATE, clock=clock.time))
+        sensor = MAX30102(bus=bus)
+        # do not count the setup transactions
+        sensor.drain()
+        start = bus.transactions
+        wakeups = 0
+        samples = 0
+        poller = None
+        if mode != "poll_10ms":
+            pin = SimInterruptPin(ppg, sleep=clock.sleep) if mode == "interrupt" else None
+            poller = FifoPoller(sensor, int_pin=pin, clock=clock.time, sleep=clock.sleep)
+        end = clock.time() + seconds
+        while clock.time() < end:
+            if poller is None:
+                clock.sleep(0.01)
+                red, ir = sensor.drain()
+            else:
+                red, ir = poller.read()
+            wakeups += 1
+            samples += len(ir)
+        results[f"{mode}_wakeups"] = wakeups / seconds
+        results[f"{mode}_transactions_per_sample"] = (bus.transactions - start) / samples
+        results[f"{mode}_lost"] = ppg.lost
+    return results
+
+
+def measure_driver(bus, read, reads=2000):
+    """
+    Run READ() (returning the number of samples it got) READS times on a
+    SimBus with 100 kHz timing, report throughput, bus and CPU cost.
+    CPU time includes the device model, so it is an upper bound.
+    """
+    read()  # warmup
+    transactions = bus.transactions
+    bus_time = bus.bus_time
+    samples = 0
+    cpu = time.process_time()
+    for _ in range(reads):
+        samples += read()
+    cpu = time.process_time() - cpu
+    bus_time = bus.bus_time - bus_time
+    return {
+        "samples_per_s": samples / (cpu + bus_time),
+        "transactions_per_sample": (bus.transactions - transactions) / samples,
+        "bus_us_per_sample": bus_time / samples * 1e6,
+        "cpu_us_per_sample": cpu / samples * 1e6,
+    }
+
+
+def adafruit_mpu6050_read(bus, address=0x68):
+    # what adafruit_mpu6050 does for .acceleration and .gyro: two 6-byte reads
+    accel = struct.unpack(">hhh", bytes(bus.read_i2c_block_data(address, 0x3B, 6)))
+    gyro = struct.unpack(">hhh", bytes(bus.read_i2c_block_data(address, 0x43, 6)))
+    return [v / 16384.0 * 9.80665 for v in accel], [v / 131.0 for v in gyro]
+
+
+@benchmark("driver.max30102")
+def bench_driver_max30102(options):
+    bus = SimBus(I2C_TRANSACTION_TIME, I2C_BYTE_TIME)
+    ppg = bus.attach(SimMax30102())
+    sensor = MAX30102(bus=bus)
+
+    def read():
+        ppg.push_samples(17)
+        red, ir = sensor.drain()
+        return len(ir)
+    return measure_driver(bus, read)
+
+
+@benchmark("driver.tfluna")
+def bench_driver_tfluna(options):
+    bus = SimBus(I2C_TRANSACTION_TIME, I2C_BYTE_TIME)
+    bus.attach(SimTfLuna())
+    lidar = TfLunaI2C(i2cbus=bus)
+
+    def read():
+        lidar.read_data()
+        return 1
+    return measure_driver(bus, read)
+
+
+@benchmark("driver.mpu6050")
+def bench_driver_mpu6050(options):
+    """
+    Per IMU sample: two 6-byte property reads (adafruit_mpu6050), one
+    14-byte burst, and the FIFO at 1 kHz drained every 10 ms.
+    """
+    results = {}
+    for mode in ("adafruit", "burst", "fifo_1khz"):
+        clock = SimClock()
+        bus = SimBus(I2C_TRANSACTION_TIME, I2C_BYTE_TIME)
+        bus.attach(SimMpu6050(clock=clock.time))
+        mpu = MPU6050(bus=bus, sample_rate=1000, clock=clock.time, sleep=clock.sleep)
+        if mode == "adafruit":
+            def read():
+                clock.sleep(0.01)
+                adafruit_mpu6050_read(bus)
+                return 1
+        elif mode == "burst":
+            def read():
+                clock.sleep(0.01)
+                mpu.read()
+                return 1
+        else:
+            mpu.enable_fifo()
+
+            def read():
+                clock.sleep(0.01)
+                return len(mpu.drain().t)
+        for key, value in measure_driver(bus, read).items():
+            results[f"{mode}_{key}"] = value
+        if mode == "fifo_1khz":
+            results["fifo_overflows"] = mpu.overflow_count
+    return results
+
+
+class LockedBus(object):
+    """
+    A SimBus shared the way the kernel shares /dev/i2c-1: one lock per
+    transaction, first come first served.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        method = getattr(self.bus, name)
+
+        def call(*args):
+            with self.lock:
+                return method(*args)
+        return call
+
+
+@benchmark("i2c.shared_bus")
+def bench_shared_bus(options, seconds=2.0):
+    """
+    MAX30102 drains, 200 Hz IMU reads and 100 Hz lidar reads from three
+    threads on one bus with real 100 kHz timing. Lidar read latency
+    (request to data) with a plain per-transaction lock vs the BusManager
+    with priorities, obstacle alert and batched reads.
+
+    At that load the bus is mostly idle and the tail is the scheduler's;
+    busy_* repeats it with the bus saturated (HR catching up on a full
+    FIFO in 30-byte bursts, IMU read back to back), where the lidar
+    otherwise queues behind every other transaction.
+    """
+    results = {}
+    for load in ("typical", "busy"):
+        prefix = "busy_" if load == "busy" else ""
+        for mode in ("locked", "managed"):
+            bus = SimBus(I2C_TRANSACTION_TIME, I2C_BYTE_TIME, sleep=time.sleep)
+            bus.attach(SimMax30102(sample_rate=SAMPLE_RATE))
+            bus.attach(SimTfLuna())
+            imu = bus.attach(SimMpu6050())
+            bus.write_byte_data(imu.address, SimMpu6050.REG_PWR_MGMT_1, 0x00)
+            if mode == "locked":
+                shared = LockedBus(bus)
+                hr_bus = imu_bus = lidar_bus = shared
+            else:
+                manager = BusManager(bus)
+                hr_bus = manager.client("max30102", PRIORITY_HR)
+                imu_bus = manager.client("mpu6050", PRIORITY_IMU)
+                lidar_bus = manager.client("tfluna", PRIORITY_LIDAR)
+                lidar_bus.alert = True
+            sensor = MAX30102(bus=hr_bus)
+            lidar = TfLunaI2C(i2cbus=lidar_bus)
+            stop = threading.Event()
+            busy = load == "busy"
+
+            def run_hr():
+                while not stop.is_set():
+                    if busy:
+                        sensor.read_fifo_burst(5)
+                    else:
+                        sensor.drain()
+                        time.sleep(0.01)
+
+            def run_imu():
+                while not stop.is_set():
+                    adafruit_mpu6050_read(imu_bus)
+                    if not busy:
+                        time.sleep(0.005)
+
+            threads = [threading.Thread(target=run_hr), threading.Thread(target=run_imu)]
+            for thread in threads:
+                thread.start()
+            latency = []
+            transactions = bus.transactions
+            end = time.monotonic() + seconds
+            while time.monotonic() < end:
+                start = time.perf_counter()
+                lidar.read_data()
+                latency.append(time.perf_counter() - start)
+                time.sleep(0.01)
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+            latency = np.array(latency) * 1e6
+            results[f"{prefix}{mode}_lidar_p50_us"] = float(np.percentile(latency, 50))
+            results[f"{prefix}{mode}_lidar_p99_us"] = float(np.percentile(latency, 99))
+            results[f"{prefix}{mode}_lidar_max_us"] = float(latency.max())
+            results[f"{prefix}{mode}_bus_transactions_per_s"] = (bus.transactions - transactions) / seconds
+            if mode == "managed":
+                for name, stats in manager.report().items():
+                    results[f"{prefix}managed_{name}_wait_mean_us"] = stats["wait_mean_us"]
+    return results
+
+
+@benchmark("tfluna.reader")
+def bench_tfluna_reader(options):
+    """
+    What a main loop lidar read costs: the driver on a bus with real
+    100 kHz timing vs the newest frame from a TfLunaReader thread.
+    """
+    bus = SimBus(I2C_TRANSACTION_TIME, I2C_BYTE_TIME, sleep=time.sleep)
+    bus.attach(SimTfLuna())
+    lidar = TfLunaI2C(i2cbus=bus)
+    results = {}
+    for key, value in timeit(lidar.read_data, repeat=options.repeat).items():
+        results[f"driver_{key}"] = value
+    reader = TfLunaReader(lidar, fps=100).start()
+    try:
+        for key, value in timeit(reader.read_data, repeat=options.repeat).items():
+            results[f"reader_{key}"] = value
+        count = reader.count
+        time.sleep(1.0)
+        results["reader_frames_per_s"] = float(reader.count - count)
+    finally:
+        reader.stop()
+    return results
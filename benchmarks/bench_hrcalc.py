@@ -0,0 +1,121 @@
+"""
+hrcalc: full window computation per engine, streaming updates, peak search.
+"""
+import itertools
+
+import numpy as np
+
+import hrcalc
+import sensor_trace
+from benchmarks import Skip, benchmark, timeit
+from sim_i2c import synthetic_ppg
+
+# signal quality -> (bpm, noise)
+QUALITIES = {
+    "clean": (60, 50),
+    "typical": (72, 200),
+    "noisy": (110, 800),
+    "motion": (90, 2500),
+}
+
+
+def windows(quality):
+    bpm, noise = QUALITIES[quality]
+    return [synthetic_ppg(bpm=bpm, noise=noise, seed=seed) for seed in range(4)]
+
+
+def recorded_windows(path, size=hrcalc.BUFFER_SIZE, stride=25):
+    times, records = sensor_trace.read_trace(path)[sensor_trace.PPG]
+    if not records:
+        return []
+    red = np.concatenate([r for r, _ in records]).tolist()
+    ir = np.concatenate([i for _, i in records]).tolist()
+    return [(ir[i:i + size], red[i:i + size]) for i in range(0, len(ir) - size + 1, stride)]
+
+
+def inverted_ma(ir):
+    # the signal calc_hr_and_spo2 hands to find_peaks
+    x = -1 * (np.array(ir) - int(np.mean(ir)))
+    for i in range(x.shape[0] - hrcalc.MA_SIZE):
+        x[i] = np.sum(x[i:i + hrcalc.MA_SIZE]) / hrcalc.MA_SIZE
+    return x
+
+
+def time_windows(func, data, repeat):
+    """
+    Time FUNC over a rotating set of windows.
+    """
+    cycle = itertools.cycle(data)
+    return timeit(lambda: func(*next(cycle)), repeat=repeat)
+
+
+def _engine_benchmark(engine, quality):
+    def run(options):
+        data = windows(quality)
+        if engine != "python":
+            # the numpy engine must give the same answer as the reference
+            for ir, red in data:
+                expected = hrcalc.calc_hr_and_spo2(ir, red)
+                got = hrcalc.calc_hr_and_spo2_np(ir, red)
+                if got != expected:
+                    raise AssertionError(f"numpy engine differs: {got} != {expected}")
+        return time_windows(hrcalc.get_engine(engine), data, options.repeat)
+    return run
+
+
+for _engine in hrcalc.ENGINES:
+    for _quality in QUALITIES:
+        benchmark(f"hrcalc.{_engine}.{_quality}")(_engine_benchmark(_engine, _quality))
+
+
+@benchmark("hrcalc.recorded")
+def bench_recorded(options):
+    """
+    Every engine on the PPG windows of a recorded trace (--trace).
+    """
+    if not options.trace:
+        raise Skip("no --trace given")
+    data = recorded_windows(options.trace)
+    if not data:
+        raise Skip("no PPG samples in " + options.trace)
+    results = {"windows": len(data)}
+    for name in hrcalc.ENGINES:
+        stats = time_windows(hrcalc.get_engine(name), data, options.repeat)
+        results[f"{name}_p50_us"] = stats["p50_us"]
+    return results
+
+
+@benchmark("hrcalc.streaming")
+def bench_streaming(options):
+    """
+    Cost of one new sample: StreamingEstimator.update vs rerunning the window.
+    """
+    ir, red = synthetic_ppg(n=2000)
+    estimator = hrcalc.StreamingEstimator()
+    samples = itertools.cycle(zip(ir, red))
+    stats = timeit(lambda: estimator.update(*next(samples)), repeat=options.repeat)
+    window = time_windows(hrcalc.calc_hr_and_spo2, windows("typical"), options.repeat)
+    stats["window_p50_us"] = window["p50_us"]
+    stats["per_sample_speedup"] = window["p50_us"] / stats["p50_us"]
+    return stats
+
+
+def _peaks_benchmark(func, quality):
+    def run(options):
+        xs = [inverted_ma(ir) for ir, _ in windows(quality)]
+        if func in (hrcalc.find_peaks, hrcalc.find_peaks_np):
+            args = [(x, hrcalc.BUFFER_SIZE, 30, 4, 15) for x in xs]
+        else:
+            # the candidates find_peaks_above_min_height hands over
+            args = []
+            for x in xs:
+                locs, n = hrcalc.find_peaks_above_min_height(x, hrcalc.BUFFER_SIZE, 30, 15)
+                args.append((n, locs, x, 4))
+        return time_windows(func, args, options.repeat)
+    return run
+
+
+for _func in (hrcalc.find_peaks, hrcalc.find_peaks_np,
+              hrcalc.remove_close_peaks, hrcalc.remove_close_peaks_np):
+    for _quality in QUALITIES:
+        benchmark(f"hrcalc.{_func.__name__}.{_quality}")(_peaks_benchmark(_func, _quality))
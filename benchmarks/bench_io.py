@@ -0,0 +1,628 @@
+"""
+UART parsing (TF-Luna frames, NMEA) and the BluetoothSender send path.
+"""
+import itertools
+import socket
+import threading
+import time
+
+from benchmarks import benchmark, timeit
+from sim_i2c import SimClock
+from sim_serial import ByteStream, PacedStream, nmea_epoch, tfluna_frame
+
+
+@benchmark("lidar.uart_frame")
+def bench_lidar_uart(options):
+    """
+    lidar.read_frame on a clean stream of TF-Luna frames.
+    """
+    import lidar
+    stream = ByteStream(b"".join(tfluna_frame(d) for d in range(100, 400)))
+    return timeit(lambda: lidar.read_frame(stream), repeat=options.repeat)
+
+
+@benchmark("lidar.uart_throughput")
+def bench_lidar_uart_throughput(options, seconds=10.0, poll=0.01):
+    """
+    TF-Luna UART at 250 and 1000 frames/s with one corrupted byte every
+    500, polled every 10 ms on a simulated clock. LidarUart in both modes
+    vs the old read_frame + 50 ms sleep loop (how far behind it falls).
+    """
+    import lidar
+    results = {}
+    for rate in (250, 1000):
+        data = bytearray(b"".join(tfluna_frame(100 + i % 300) for i in range(rate)))
+        for i in range(0, len(data), 500):
+            data[i] ^= 0x5A
+        data = bytes(data)
+        byte_rate = rate * lidar.FRAME_SIZE
+
+        for mode in ("every", "newest"):
+            clock = SimClock()
+            uart = lidar.LidarUart(PacedStream(data, byte_rate, clock.time), mode)
+            cpu = 0.0
+            reads = 0
+            while clock.time() < seconds:
+                clock.sleep(poll)
+                start = time.perf_counter()
+                uart.read()
+                cpu += time.perf_counter() - start
+                reads += 1
+            parser = uart.parser
+            if mode == "every":
+                results[f"{rate}hz_every_frames_per_s"] = parser.frames / seconds
+                results[f"{rate}hz_every_cpu_us_per_frame"] = cpu / parser.frames * 1e6
+                results[f"{rate}hz_bad_checksums"] = parser.bad_checksums
+            else:
+                results[f"{rate}hz_newest_cpu_us_per_read"] = cpu / reads * 1e6
+
+        clock = SimClock()
+        stream = PacedStream(data, byte_rate, clock.time)
+        frames = 0
+        while clock.time() < seconds:
+            if lidar.read_frame(stream) is not None:
+                frames += 1
+            clock.sleep(0.05)
+        results[f"{rate}hz_legacy_frames_per_s"] = frames / seconds
+        results[f"{rate}hz_legacy_lag_ms"] = stream.in_waiting / byte_rate * 1e3
+    return results
+
+
+@benchmark("gps.pynmea2")
+def bench_pynmea2(options):
+    """
+    What gps_reader does per line: decode, check for '$', pynmea2.parse.
+    """
+    import pynmea2
+    lines = b"".join(nmea_epoch(t) for t in range(60)).splitlines(keepends=True)
+    cycle = itertools.cycle(lines)
+
+    def parse():
+        line = next(cycle).decode("utf-8", errors="ignore")
+        if line.startswith("$"):
+            return pynmea2.parse(line)
+    return timeit(parse, repeat=options.repeat)
+
+
+def nmea_lines(options):
+    """
+    Sentences of the --trace recording if it has any, synthetic epochs otherwise.
+    """
+    if options.trace:
+        import sensor_trace
+        lines = sensor_trace.read_trace(options.trace)[sensor_trace.GPS][1]
+        if lines:
+            return list(lines), "trace"
+    return b"".join(nmea_epoch(t) for t in range(60)).splitlines(keepends=True), "synthetic"
+
+
+@benchmark("gps.nmea_parser")
+def bench_nmea_parser(options):
+    """
+    gps_reader.NmeaParser vs pynmea2 per sentence and per fix epoch
+    (GGA, GSA, 3 x GSV, RMC, VTG), with the fix each one produces.
+    """
+    import pynmea2
+    from gps_reader import NmeaParser
+    lines, source = nmea_lines(options)
+    parser = NmeaParser()
+    cycle = itertools.cycle(lines)
+
+    def fast():
+        parser.feed_line(next(cycle))
+
+    def slow():
+        line = next(cycle).decode("utf-8", errors="ignore")
+        if line.startswith("$"):
+            try:
+                pynmea2.parse(line)
+            except pynmea2.ParseError:
+                pass
+
+    results = {}
+    for name, func in (("fast", fast), ("pynmea2", slow)):
+        for key, value in timeit(func, repeat=options.repeat).items():
+            results[f"{name}_{key}"] = value
+    results["speedup"] = results["pynmea2_p50_us"] / results["fast_p50_us"]
+    results["sentences_per_s"] = 1e6 / results["fast_p50_us"]
+    results["trace"] = source == "trace"
+    return results
+
+
+def sample_packet(i=0):
+    return {
+        "bpm": 72,
+        "dist_cm": 150 + i % 50,
+        "accel": [0.123456789, -0.0456789, 9.80665],
+        "gyro": [0.0123456, -0.00345678, 0.0567891],
+    }
+
+
+def connected_sender():
+    from bt_sender import BluetoothSender
+    from sensor_trace import TraceSink
+    bt = BluetoothSender()
+    bt.add_client(TraceSink(keep=False), "sink")
+    return bt
+
+
+@benchmark("bt.send_data")
+def bench_bt_send_data(options):
+    """
+    send_data alone: serialization + queue put (drop-oldest when full).
+    """
+    bt = connected_sender()
+    packet = sample_packet()
+    stats = timeit(lambda: bt.send_data(packet), repeat=options.repeat)
+    bt.flush()
+    bt = connected_sender()
+    sink = bt.clients[0].sock
+    bt.send_data(packet)
+    bt.flush()
+    stats["bytes_per_packet"] = sink.bytes / sink.calls
+    return stats
+
+
+@benchmark("bt.queue_throughput")
+def bench_bt_queue(options):
+    """
+    send_data followed by the send thread's work (queue get + send).
+    """
+    bt = connected_sender()
+    counter = itertools.count()
+
+    def send():
+        bt.send_data(sample_packet(next(counter)))
+        bt.flush()
+    stats = timeit(send, repeat=options.repeat)
+    stats["packets_per_s"] = 1e6 / stats["p50_us"]
+    return stats
+
+
+def gps_packet(i=0):
+    packet = sample_packet(i)
+    packet["gps"] = {"lat": 45.4215296, "lon": -75.6971931, "speed": 1.28, "age_ms": 40}
+    return packet
+
+
+class SlowReader(object):
+    """
+    The phone end of a busy link: a thread that reads a connected socket
+    at BYTE_RATE, CALL_TIME per recv(), and logs every complete line with
+    the time it arrived. STALLED never reads at all.
+    """
+
+    def __init__(self, sock, call_time=0.004, byte_rate=10000.0, stalled=False):
+        self.sock = sock
+        self.call_time = call_time
+        self.byte_rate = byte_rate
+        self.stalled = stalled
+        self.log = []  # (time received, line)
+        self.recvs = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _loop(self):
+        self.sock.settimeout(0.1)
+        rest = b""
+        while self.running:
+            if self.stalled:
+                time.sleep(0.1)
+                continue
+            try:
+                data = self.sock.recv(512)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if not data:
+                break
+            now = time.monotonic()
+            self.recvs += 1
+            *lines, rest = (rest + data).split(b"\n")
+            self.log.extend((now, line) for line in lines)
+            time.sleep(self.call_time + len(data) / self.byte_rate)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+def small_buffers(sock, size=1024):
+    """
+    Kernel buffers about the size of an RFCOMM link's, so a slow reader
+    pushes back on the sender quickly.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, size)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    return sock
+
+
+def listening_sender(**kwargs):
+    """
+    A started BluetoothSender on a localhost TCP transport with small
+    buffers instead of RFCOMM, and a function that connects one more
+    client to it.
+    """
+    from bt_sender import BluetoothSender
+    from transport import TcpTransport
+
+    class SmallTcp(TcpTransport):
+        def listen(self, backlog):
+            return small_buffers(super().listen(backlog))
+
+        def accepted(self, sock):
+            # stands in for RFCOMM, which has no TCP_NODELAY
+            pass
+
+    link = SmallTcp("127.0.0.1", 0)
+    bt = BluetoothSender(transports=[link], **kwargs)
+    bt.start()
+    while not bt.server_socks:
+        time.sleep(0.001)
+
+    def connect():
+        count = len(bt.clients)
+        sock = small_buffers(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+        sock.connect(("127.0.0.1", link.port))
+        while len(bt.clients) == count:
+            time.sleep(0.001)
+        return sock
+    return bt, connect
+
+
+def legacy_sender(sock):
+    """
+    The previous send path: queue of 2, drop oldest, one blocking send()
+    per packet.
+    """
+    import json
+    import queue
+
+    out = queue.Queue(maxsize=2)
+    running = [True]
+
+    def loop():
+        while running[0]:
+            try:
+                sock.sendall(out.get(timeout=0.1).encode())
+            except queue.Empty:
+                pass
+
+    def send_data(packet):
+        if out.full():
+            try: out.get_nowait()
+            except queue.Empty: pass
+        out.put_nowait(json.dumps(packet) + "\n")
+
+    def stop():
+        running[0] = False
+        thread.join()
+
+    thread = threading.Thread(target=loop)
+    thread.start()
+    return send_data, stop
+
+
+def stream(send_data, seconds, rate, obstacle_every):
+    """
+    RATE packets/s for SECONDS, one in OBSTACLE_EVERY with an obstacle
+    in range, each stamped with the time it was handed over.
+    """
+    start = time.monotonic()
+    for i in range(int(seconds * rate)):
+        packet = sample_packet(i)
+        if i % obstacle_every == 0:
+            packet["dist_cm"] = 50
+        packet["t"] = time.monotonic()
+        send_data(packet)
+        time.sleep(max(start + (i + 1) / rate - time.monotonic(), 0))
+
+
+def drain(reader, quiet=0.3, timeout=3.0):
+    """
+    Waits until READER has received nothing for QUIET seconds, so what
+    was still in the kernel buffers when the stream ended is counted.
+    """
+    deadline = time.monotonic() + timeout
+    count = -1
+    while time.monotonic() < deadline and count != len(reader.log):
+        count = len(reader.log)
+        time.sleep(quiet)
+
+
+def delivery(reader, seconds, prefix):
+    """
+    Delivered rate, recv() calls and lag (hand-over to arrival) of what
+    READER got, obstacle packets separately.
+    """
+    import json
+    lag = []
+    obstacle = []
+    for received, line in reader.log:
+        packet = json.loads(line)
+        lag.append(received - packet["t"])
+        if packet["dist_cm"] == 50:
+            obstacle.append(received - packet["t"])
+    delivered = len(obstacle)
+    lag = sorted(lag) or [0.0]
+    obstacle = sorted(obstacle) or [0.0]
+    return {
+        f"{prefix}_delivered_per_s": len(reader.log) / seconds,
+        f"{prefix}_recvs_per_s": reader.recvs / seconds,
+        f"{prefix}_lag_p50_ms": lag[len(lag) // 2] * 1e3,
+        f"{prefix}_lag_max_ms": lag[-1] * 1e3,
+        f"{prefix}_obstacle_p50_ms": obstacle[len(obstacle) // 2] * 1e3,
+        f"{prefix}_obstacle_max_ms": obstacle[-1] * 1e3,
+        f"{prefix}_obstacles_delivered": delivered,
+    }
+
+
+@benchmark("bt.batching")
+def bench_bt_batching(options, seconds=3.0, rate=100, obstacle_every=10):
+    """
+    100 packets/s to a phone that reads 10 kB/s with 4 ms per recv(),
+    one packet in 10 with an obstacle in range, the same small-buffered
+    socketpair for both. Delivered packets (counted until the link has
+    drained), recv() calls, lag and obstacle latency for the old
+    queue-of-2 path vs the batching sender.
+    """
+    results = {}
+    for mode in ("legacy", "batched"):
+        sock, phone = (small_buffers(s) for s in socket.socketpair())
+        if mode == "legacy":
+            send_data, stop = legacy_sender(sock)
+        else:
+            bt, _ = listening_sender()
+            bt.add_client(sock, "socketpair")
+            send_data, stop = bt.send_data, bt.stop
+        reader = SlowReader(phone)
+        stream(send_data, seconds, rate, obstacle_every)
+        drain(reader)
+        stop()
+        reader.stop()
+        results.update(delivery(reader, seconds, mode))
+    return results
+
+
+@benchmark("bt.fanout")
+def bench_bt_fanout(options, seconds=3.0, rate=100, obstacle_every=10):
+    """
+    Two phones reading at 10 kB/s, alone and then next to a third that
+    has stopped reading. The stalled one must only lose its own packets:
+    the others keep their delivered rate and lag.
+    """
+    results = {}
+    for mode in ("alone", "stalled"):
+        bt, connect = listening_sender()
+        readers = [SlowReader(connect()) for _ in range(2)]
+        if mode == "stalled":
+            stalled = SlowReader(connect(), stalled=True)
+        stream(bt.send_data, seconds, rate, obstacle_every)
+        for reader in readers:
+            drain(reader)
+        stats = bt.stats()
+        bt.stop()
+        for i, reader in enumerate(readers):
+            reader.stop()
+            for key, value in delivery(reader, seconds, f"{mode}_phone{i}").items():
+                if "_recvs_" not in key:
+                    results[key] = value
+        if mode == "stalled":
+            stalled.stop()
+            client = stats["per_client"][2]
+            results["stalled_dropped"] = client["packets_dropped"]
+            results["stalled_unsent_bytes"] = client["unsent_bytes"]
+    return results
+
+
+@benchmark("bt.backlog")
+def bench_bt_backlog(options, offline=5.0, online=3.0, rate=100):
+    """
+    5 s of packets with no phone connected (spilling to disk past 2 s),
+    then a phone connects while live packets keep coming. Replay
+    throughput, time to catch up and live packet lag during the replay,
+    for a phone that reads as fast as it can and one paced at 40 kB/s.
+    """
+    import json
+    import tempfile
+    from backlog import Backlog
+
+    results = {}
+    for mode, byte_rate in (("fast", float("inf")), ("paced", 40000.0)):
+        with tempfile.TemporaryDirectory() as path:
+            backlog = Backlog(path, ram_packets=2 * rate, segment_packets=rate)
+            bt, connect = listening_sender(backlog=backlog)
+            stream(bt.send_data, offline, rate, obstacle_every=10)
+            bt.backlog.spill()
+            results[f"{mode}_backlog_packets"] = len(backlog)
+            results[f"{mode}_spilled"] = backlog.spilled
+            reader = SlowReader(connect(), call_time=0.0, byte_rate=byte_rate)
+            stream(bt.send_data, online, rate, obstacle_every=10)
+            time.sleep(0.2)
+            catchup = bt.catchup
+            bt.stop()
+            reader.stop()
+
+        replayed = 0
+        live = []
+        for received, line in reader.log:
+            packet = json.loads(line)
+            if "backlog_ms" in packet:
+                replayed += 1
+            elif catchup is None or received - reader.log[0][0] < catchup["seconds"]:
+                live.append(received - packet["t"])
+        live = sorted(live) or [0.0]
+        results[f"{mode}_replayed"] = replayed
+        results[f"{mode}_catchup_s"] = catchup["seconds"] if catchup else float("nan")
+        results[f"{mode}_replay_per_s"] = catchup["per_s"] if catchup else 0.0
+        results[f"{mode}_live_lag_p50_ms"] = live[len(live) // 2] * 1e3
+        results[f"{mode}_live_lag_max_ms"] = live[-1] * 1e3
+    return results
+
+
+@benchmark("bt.transports")
+def bench_bt_transports(options, seconds=3.0):
+    """
+    loadgen against the TCP and Unix socket transports, two clients:
+    end-to-end latency at 100 packets/s, and sustained throughput with
+    the sender saturated (binary frames).
+    """
+    import os
+    import tempfile
+    import loadgen
+
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        for name, url in (("tcp", "tcp://127.0.0.1:0"), ("unix", "unix://" + os.path.join(path, "load.sock"))):
+            stats, clients = loadgen.run(url, clients=2, rate=100, seconds=seconds)
+            results[f"{name}_latency_p50_ms"] = max(c["latency_p50_ms"] for c in clients)
+            results[f"{name}_latency_p99_ms"] = max(c["latency_p99_ms"] for c in clients)
+            stats, clients = loadgen.run(url, clients=2, rate=0, seconds=seconds, binary=True)
+            results[f"{name}_sustained_per_s"] = min(c["packets_per_s"] for c in clients)
+            results[f"{name}_sustained_kib_s"] = min(c["bytes_per_s"] for c in clients) / 1024
+    return results
+
+
+@benchmark("bt.wire_format")
+def bench_wire_format(options):
+    """
+    Bytes and encode time per packet: JSON line vs the wire.py binary
+    frame, without and with a GPS fix. Also checks that the reference
+    decoder gets the packet back within the fixed-point resolution.
+    """
+    import json
+    import wire
+
+    results = {}
+    encoder = wire.Encoder()
+    for name, packet in (("imu", sample_packet()), ("gps", gps_packet())):
+        results[f"{name}_json_bytes"] = len(json.dumps(packet) + "\n")
+        results[f"{name}_binary_bytes"] = len(encoder.encode(packet))
+        json_us = timeit(lambda: json.dumps(packet) + "\n", repeat=options.repeat)["p50_us"]
+        binary_us = timeit(lambda: encoder.encode(packet), repeat=options.repeat)["p50_us"]
+        results[f"{name}_json_encode_us"] = json_us
+        results[f"{name}_binary_encode_us"] = binary_us
+        results[f"{name}_decode_us"] = timeit(
+            lambda: wire.decode(encoder.encode(packet)), repeat=options.repeat)["p50_us"] - binary_us
+
+        decoded = wire.decode(encoder.encode(packet))
+        error = max(abs(a - b) for a, b in zip(decoded["accel"] + decoded["gyro"],
+                                               packet["accel"] + packet["gyro"]))
+        if error > 0.005:
+            raise AssertionError(f"decoded IMU off by {error}")
+    return results
+
+
+@benchmark("gps.high_rate")
+def bench_gps_high_rate(options, seconds=10.0):
+    """
+    Startup configuration against the scripted fake module (MTK and
+    u-blox): time it takes, then fix rate and worst fix age seen by a
+    10 Hz reader, compared with the module left at 9600 baud / 1 Hz.
+    """
+    from gps_reader import GpsConfigurator, GpsService
+    from sim_serial import FakeGpsModule
+
+    results = {}
+    for chip in ("default", "mtk", "ublox"):
+        clock = SimClock()
+        module = FakeGpsModule(chip="mtk" if chip == "default" else chip, clock=clock.time)
+        if chip != "default":
+            result = GpsConfigurator(module, clock=clock.time, sleep=clock.sleep).configure()
+            results[f"{chip}_ok"] = result.ok
+            results[f"{chip}_setup_s"] = clock.time()
+        gps = GpsService(module, clock=clock.time)
+        start = clock.time()
+        fixes = set()
+        worst_age = 0.0
+        while clock.time() - start < seconds:
+            clock.sleep(0.1)
+            fix = gps.fix()
+            if fix.time is not None:
+                fixes.add(fix.utc)
+                worst_age = max(worst_age, gps.age())
+        results[f"{chip}_fix_hz"] = len(fixes) / seconds
+        results[f"{chip}_worst_fix_age_ms"] = worst_age * 1e3
+    return results
+
+
+def log_session(recorder, clock, seconds, flush=None, flush_every=2.0):
+    """
+    SECONDS of everything at full rate into RECORDER: lidar 100 Hz, IMU
+    200 Hz, PPG drains of 10 samples at 10 Hz, GPS 10 Hz, vitals 1 Hz.
+    """
+    import numpy as np
+
+    ppg = np.arange(10) + 100000
+    sentence = b"$GPRMC,123519,A,4807.038,N,01131.000,E,022.4,084.4,230394,003.1,W*6A\r\n"
+    next_flush = flush_every
+    for tick in range(int(seconds * 200)):
+        clock[0] += 0.005
+        recorder.imu((0.1, 0.2, 9.8), (0.01, 0.02, 0.03))
+        if tick % 2 == 0:
+            recorder.lidar(150 + tick % 50, 3000)
+        if tick % 20 == 0:
+            recorder.ppg(ppg, ppg + 5000)
+            recorder.gps(sentence)
+        if tick % 200 == 0:
+            recorder.vitals(72.0, 98.0)
+        if flush is not None and clock[0] >= next_flush:
+            flush()
+            next_flush += flush_every
+
+
+@benchmark("log.sample_log")
+def bench_sample_log(options, seconds=600.0):
+    """
+    Ten minutes of samples into a SampleLog: cost per sample for the
+    sensor thread, pages and write calls per minute against the bytes of
+    records, and a 1 s time-range read through mmap compared with
+    loading the same session from a sensor_trace file.
+    """
+    import os
+    import tempfile
+    from sample_log import PAGE, SampleLog, SampleLogReader
+    from sensor_trace import TraceWriter, read_trace
+
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        clock = [0.0]
+        log = SampleLog(os.path.join(path, "log"), max_pending=1 << 30, clock=lambda: clock[0])
+        results["producer_us"] = timeit(lambda: log.lidar(150, 3000), repeat=options.repeat)["p50_us"]
+        log.close()
+
+        clock = [0.0]
+        log = SampleLog(os.path.join(path, "session"), clock=lambda: clock[0])
+        trace = TraceWriter(os.path.join(path, "session.trace"), clock=lambda: clock[0])
+
+        class Both(object):
+            def __getattr__(self, name):
+                a, b = getattr(log, name), getattr(trace, name)
+                return lambda *args: (a(*args), b(*args))
+
+        start = time.perf_counter()
+        log_session(Both(), clock, seconds, flush=log.flush)
+        log.close()
+        trace.close()
+        minutes = seconds / 60
+        payload = os.path.getsize(os.path.join(path, "session.trace"))
+        results["records_per_s"] = log.records / seconds
+        results["record_kb_per_min"] = payload / 1024 / minutes
+        results["written_kb_per_min"] = log.pages_written * PAGE / 1024 / minutes
+        results["write_amplification"] = log.pages_written * PAGE / payload
+        results["writes_per_min"] = log.writes / minutes
+        results["dropped"] = log.dropped
+        results["session_s"] = time.perf_counter() - start
+
+        reader = SampleLogReader(os.path.join(path, "session"))
+        middle = seconds / 2
+        results["mmap_read_1s_us"] = timeit(
+            lambda: sum(1 for _ in reader.read(middle, middle + 1.0)), repeat=20, warmup=2)["p50_us"]
+        results["trace_load_us"] = timeit(
+            lambda: read_trace(os.path.join(path, "session.trace")), repeat=3, warmup=1)["p50_us"]
+        reader.close()
+    return results
@@ -0,0 +1,473 @@
+"""
+End-to-end: the Sensortest loops against simulated devices.
+"""
+import os
+import time
+
+import numpy as np
+
+from benchmarks import benchmark, timeit
+from benchmarks.bench_io import connected_sender
+from max30102 import MAX30102, SAMPLE_RATE
+from mpu6050 import MPU6050
+from sim_i2c import SimBus, SimClock, SimMax30102, SimMpu6050, SimTfLuna
+from TfLunaI2C import TfLunaI2C
+
+
+class WallClock(object):
+    """
+    SimClock interface on the real clock.
+    """
+
+    def time(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+def sim_devices(clock):
+    """
+    MAX30102 monitor, TF-Luna and MPU6050 on one simulated bus.
+    CLOCK is a SimClock or WallClock.
+    """
+    import Sensortest
+    from hr2 import HeartRateMonitor
+    from sensor_trace import ReplayHeartRateMonitor
+
+    bus = SimBus()
+    bus.attach(SimMax30102(sample_rate=SAMPLE_RATE, clock=clock.time))
+    bus.attach(SimTfLuna(clock=clock.time))
+    bus.attach(SimMpu6050(clock=clock.time))
+    mpu = MPU6050(bus=bus, sample_rate=Sensortest.IMU_RATE, clock=clock.time, sleep=clock.sleep)
+    mpu.enable_fifo()
+
+    hr = ReplayHeartRateMonitor(HeartRateMonitor(), MAX30102(bus=bus))
+    return hr, TfLunaI2C(i2cbus=bus), mpu, bus
+
+
+@benchmark("pipeline.sensortest_loop")
+def bench_sensortest_loop(options):
+    """
+    One pass of Sensortest.run: HR update, lidar, IMU, packet, BT send.
+    """
+    import Sensortest
+
+    clock = SimClock()
+    hr, lidar, mpu, bus = sim_devices(clock)
+    bt = connected_sender()
+
+    def one_iteration():
+        calls = iter((False, True))
+        Sensortest.run(mpu, lidar, hr, None, bt, sleep=clock.sleep,
+                       should_stop=lambda: next(calls), on_packet=lambda p, t: bt.flush(),
+                       verbose=False)
+
+    transactions = bus.transactions
+    stats = timeit(one_iteration, repeat=options.repeat, warmup=120)
+    stats["transactions_per_loop"] = (bus.transactions - transactions) / max(clock.sleeps, 1)
+    return stats
+
+
+@benchmark("pipeline.metrics")
+def bench_metrics(options):
+    """
+    Cost of the instrumentation: one guarded observe() with metrics off
+    and on, and a Sensortest.run pass with metrics off and on.
+    """
+    import metrics
+    import Sensortest
+
+    hist = metrics.histogram("bench.observe_us")
+    result = {}
+    was = metrics.enabled
+    try:
+        for on in (False, True):
+            metrics.enable(on)
+            label = "on" if on else "off"
+
+            def guarded():
+                if metrics.enabled:
+                    hist.observe(137.0)
+
+            result[f"observe_{label}_ns"] = timeit(guarded, repeat=options.repeat)["p50_us"] * 1e3
+            loop = bench_sensortest_loop(options)
+            result[f"loop_{label}_p50_us"] = loop["p50_us"]
+            result[f"loop_{label}_p99_us"] = loop["p99_us"]
+    finally:
+        metrics.enable(was)
+    result["loop_overhead_pct"] = (result["loop_on_p50_us"] / result["loop_off_p50_us"] - 1) * 100
+    return result
+
+
+@benchmark("pipeline.profiler")
+def bench_profiler(options):
+    """
+    Sensortest.run pass with and without the sampling profiler running
+    in the background, and what one sample of all threads costs.
+    """
+    import profiler
+
+    idle = bench_sensortest_loop(options)
+    start = time.perf_counter()
+    prof = profiler.SamplingProfiler(duration=3600, path=os.devnull, verbose=False).start()
+    try:
+        busy = bench_sensortest_loop(options)
+        elapsed = time.perf_counter() - start
+        samples, sampling = prof.samples, prof.busy
+        sample = timeit(prof.sample, repeat=options.repeat)
+    finally:
+        prof.stop()
+        prof.join()
+    return {
+        "loop_p50_us": idle["p50_us"],
+        "loop_p99_us": idle["p99_us"],
+        "profiled_p50_us": busy["p50_us"],
+        "profiled_p99_us": busy["p99_us"],
+        "sample_us": sample["p50_us"],
+        "samples_per_s": samples / elapsed,
+        "overhead_pct": sampling / elapsed * 100,
+    }
+
+
+@benchmark("pipeline.scheduler")
+def bench_scheduler(options, seconds=2.0):
+    """
+    Sensortest.run_scheduled for a few real seconds with 100 kHz bus timing:
+    achieved rate, overruns and jitter of every task.
+    """
+    import Sensortest
+    from sim_i2c import I2C_BYTE_TIME, I2C_TRANSACTION_TIME
+
+    hr, lidar, mpu, bus = sim_devices(WallClock())
+    bus.transaction_time = I2C_TRANSACTION_TIME
+    bus.byte_time = I2C_BYTE_TIME
+    bus.sleep = time.sleep
+    bt = connected_sender()
+
+    report = Sensortest.run_scheduled(mpu, lidar, hr, None, bt, duration=seconds, verbose=False)
+    results = {}
+    for name in ("lidar", "imu", "publish"):
+        stats = report[name]
+        results[f"{name}_per_s"] = stats["rate_hz"]
+        results[f"{name}_overruns"] = stats["overruns"]
+        results[f"{name}_jitter_us"] = stats["jitter_us"]
+    return results
+
+
+class InlineInit(object):
+    """
+    Supervisor interface with the old in-loop behaviour: get() initializes
+    a missing sensor on the calling thread, the lidar every RETRY loops,
+    the others every loop.
+    """
+
+    def __init__(self, inits, closes, retry=None):
+        self.inits = inits
+        self.closes = closes
+        self.retry = retry or {}
+        self.drivers = dict.fromkeys(inits)
+        self.calls = dict.fromkeys(inits, 0)
+
+    def get(self, name):
+        if self.drivers[name] is None:
+            self.calls[name] += 1
+            if self.calls[name] % self.retry.get(name, 1) == 0:
+                try: self.drivers[name] = self.inits[name]()
+                except Exception: pass
+        return self.drivers[name]
+
+    def failed(self, name, driver=None, error=None):
+        if driver is self.drivers[name]:
+            self.drivers[name] = None
+            try: self.closes[name](driver)
+            except Exception: pass
+
+    def stop(self):
+        for name, driver in self.drivers.items():
+            if driver is not None:
+                self.failed(name, driver)
+
+
+def hotplug_devices():
+    """
+    Detached sim devices on a 100 kHz bus, and init/close functions like
+    Sensortest's for the supervisor.
+    """
+    import Sensortest
+    from hr2 import HeartRateMonitor
+    from sim_i2c import I2C_BYTE_TIME, I2C_TRANSACTION_TIME
+    from TfLunaI2C import TfLunaReader
+
+    bus = SimBus(I2C_TRANSACTION_TIME, I2C_BYTE_TIME, time.sleep)
+    models = [SimMax30102(sample_rate=SAMPLE_RATE, clock=time.monotonic),
+              SimTfLuna(clock=time.monotonic), SimMpu6050(clock=time.monotonic)]
+
+    def init_lidar():
+        lidar = TfLunaI2C(i2cbus=bus)
+        lidar.read_data()
+        return TfLunaReader(lidar, fps=Sensortest.LIDAR_FPS).start()
+
+    def init_mpu():
+        mpu = MPU6050(bus=bus, sample_rate=Sensortest.IMU_RATE)
+        mpu.enable_fifo()
+        return mpu
+
+    def init_hr():
+        sensor = MAX30102(bus=bus)
+        hr = HeartRateMonitor(sensor_factory=lambda: sensor)
+        hr.start_sensor()
+        return hr
+
+    inits = {"lidar": init_lidar, "mpu": init_mpu, "hr": init_hr}
+    closes = {"lidar": lambda lidar: lidar.stop(), "mpu": lambda mpu: mpu.close(),
+              "hr": lambda hr: hr.stop_sensor()}
+    return bus, models, inits, closes
+
+
+@benchmark("pipeline.supervisor")
+def bench_supervisor(options, phases=(("unplugged", 2.0), ("plugged", 6.0), ("unplugged_again", 2.0))):
+    """
+    Sensortest.run in real time while every sensor is unplugged, plugged
+    in and pulled out again: loop time per phase and how long after the
+    plug-in the first lidar distance arrives, with the old in-loop init
+    and with the Supervisor.
+    """
+    import Sensortest
+    from supervisor import Supervisor
+
+    results = {}
+    for mode in ("inline", "supervisor"):
+        bus, models, inits, closes = hotplug_devices()
+        if mode == "inline":
+            sup = InlineInit(inits, closes, retry={"lidar": 50})
+        else:
+            sup = Supervisor(verbose=False)
+            for name in inits:
+                sup.add(name, inits[name], closes[name],
+                        check=Sensortest.hr_healthy if name == "hr" else None)
+            sup.start()
+
+        ends = []
+        total = 0.0
+        for name, seconds in phases:
+            total += seconds
+            ends.append((name, total))
+        start = time.monotonic()
+        state = {"phase": 0, "plugged_at": None, "recovered": None}
+        loop_ms = {name: [] for name, _ in phases}
+
+        def should_stop():
+            elapsed = time.monotonic() - start
+            while state["phase"] < len(ends) and elapsed >= ends[state["phase"]][1]:
+                state["phase"] += 1
+                if state["phase"] < len(ends):
+                    plugged = ends[state["phase"]][0] == "plugged"
+                    for model in models:
+                        if plugged:
+                            bus.attach(model)
+                        else:
+                            bus.devices.pop(model.address, None)
+                    if plugged:
+                        state["plugged_at"] = time.monotonic()
+            return state["phase"] >= len(ends)
+
+        def on_packet(packet, loop_time):
+            loop_ms[ends[min(state["phase"], len(ends) - 1)][0]].append(loop_time * 1e3)
+            if packet["dist_cm"] and state["plugged_at"] and state["recovered"] is None:
+                state["recovered"] = time.monotonic() - state["plugged_at"]
+
+        Sensortest.run(None, None, None, None, None, should_stop=should_stop,
+                       on_packet=on_packet, verbose=False, supervisor=sup)
+        sup.stop()
+
+        for name, times in loop_ms.items():
+            times = sorted(times) or [0.0]
+            results[f"{mode}_{name}_p50_ms"] = times[len(times) // 2]
+            results[f"{mode}_{name}_max_ms"] = times[-1]
+        recovered = state["recovered"]
+        results[f"{mode}_recovery_s"] = recovered if recovered is not None else float("nan")
+    return results
+
+
+# obstacle 40 cm away for the second half of every OBSTACLE_PERIOD
+OBSTACLE_PERIOD = 0.2
+
+
+def obstacle_distance(t):
+    return 40 if t % OBSTACLE_PERIOD >= OBSTACLE_PERIOD / 2 else 300
+
+
+def _sim_bus(device):
+    from sim_i2c import I2C_BYTE_TIME, I2C_TRANSACTION_TIME
+    bus = SimBus(I2C_TRANSACTION_TIME, I2C_BYTE_TIME, time.sleep)
+    bus.attach(device)
+    return bus
+
+
+# openers for acquisition processes, module level so they can be pickled
+
+def open_sim_lidar():
+    lidar = TfLunaI2C(i2cbus=_sim_bus(SimTfLuna(distance=obstacle_distance)))
+    lidar.read_data()
+    return lidar
+
+
+def open_sim_mpu():
+    import Sensortest
+    mpu = MPU6050(bus=_sim_bus(SimMpu6050()), sample_rate=Sensortest.IMU_RATE)
+    mpu.enable_fifo()
+    return mpu
+
+
+def open_sim_hr():
+    from hr2 import HeartRateMonitor
+    sensor = MAX30102(bus=_sim_bus(SimMax30102(sample_rate=SAMPLE_RATE)))
+    hr = HeartRateMonitor(sensor_factory=lambda: sensor)
+    hr.start_sensor()
+    return hr
+
+
+class ObstacleProbe(object):
+    """
+    Wraps the loop's lidar: the time from an obstacle appearing (in
+    obstacle_distance) to read_data() first returning it.
+    """
+
+    def __init__(self, lidar):
+        self.lidar = lidar
+        self.latency = []
+        self.near = None  # unknown until the first reading
+
+    def read_data(self):
+        data = self.lidar.read_data()
+        near = 0 < data[0] < 100
+        if near and self.near is False:
+            now = time.monotonic()
+            appeared = now - (now % OBSTACLE_PERIOD) + OBSTACLE_PERIOD / 2
+            if appeared > now:
+                appeared -= OBSTACLE_PERIOD
+            self.latency.append(now - appeared)
+        self.near = near
+        return data
+
+    @property
+    def dist(self):
+        return self.lidar.dist
+
+
+@benchmark("pipeline.multiprocess")
+def bench_multiprocess(options, seconds=10.0):
+    """
+    Obstacle path latency of run_scheduled (obstacle in front of the
+    sim TF-Luna until the lidar task reads it) while the HR thread runs
+    hrcalc and the BluetoothSender streams to a TCP client: with every
+    driver in this process, and with acquisition processes and
+    shared-memory rings.
+    """
+    import threading
+    import Sensortest
+    from acquisition import Acquisition
+    from benchmarks.bench_io import listening_sender
+    from TfLunaI2C import TfLunaReader
+
+    results = {}
+    for mode in ("threads", "processes"):
+        bt, connect = listening_sender()
+        client = connect()
+
+        def drain():
+            try:
+                while client.recv(65536):
+                    pass
+            except OSError:
+                pass
+        threading.Thread(target=drain, daemon=True).start()
+
+        if mode == "threads":
+            acq = None
+            lidar = TfLunaReader(open_sim_lidar(), fps=Sensortest.LIDAR_FPS).start()
+            mpu, hr = open_sim_mpu(), open_sim_hr()
+        else:
+            acq = Acquisition({
+                "lidar": (open_sim_lidar, 1.0 / Sensortest.LIDAR_FPS),
+                "imu": (open_sim_mpu, 1.0 / Sensortest.RATES["imu"]),
+                "hr": (open_sim_hr, 0.1),
+            }).start()
+            lidar, mpu, hr = acq.reader("lidar"), acq.reader("imu"), acq.reader("hr")
+            for reader in (lidar, mpu, hr):
+                while True:
+                    try:
+                        reader.ready()
+                        break
+                    except OSError:
+                        time.sleep(0.05)
+
+        probe = ObstacleProbe(lidar)
+        report = Sensortest.run_scheduled(mpu, probe, hr, None, bt, duration=seconds, verbose=False)
+        bt.stop()
+        client.close()
+        if acq is None:
+            lidar.stop()
+            hr.stop_sensor()
+        else:
+            acq.stop()
+
+        latency = np.sort(probe.latency) * 1e3
+        results[f"{mode}_obstacle_p50_ms"] = float(np.percentile(latency, 50))
+        results[f"{mode}_obstacle_p99_ms"] = float(np.percentile(latency, 99))
+        results[f"{mode}_obstacle_max_ms"] = float(latency[-1])
+        results[f"{mode}_lidar_jitter_us"] = report["lidar"]["jitter_us"]
+        results[f"{mode}_lidar_overruns"] = report["lidar"]["overruns"]
+    return results
+
+
+@benchmark("pipeline.startup")
+def bench_startup(options, runs=3):
+    """
+    Cold start pieces: importing Sensortest (only the Bluetooth stack)
+    against importing every driver up front like it used to, and the
+    sim sensors coming up one after another against in parallel on the
+    Supervisor. Both on a 100 kHz sim bus.
+    """
+    import subprocess
+    import sys
+    from supervisor import Supervisor
+
+    def import_time(modules):
+        code = ("import time; t = time.perf_counter(); import " + ", ".join(modules) +
+                "; print(time.perf_counter() - t)")
+        times = []
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                 env=dict(os.environ, PYTHONPATH=os.getcwd())).stdout
+            times.append(float(out.strip().splitlines()[-1]))
+        return min(times) * 1e3
+
+    eager = ["Sensortest", "hr2", "mpu6050", "TfLunaI2C", "gps_reader", "scheduler", "sensor_trace"]
+    results = {
+        "import_lazy_ms": import_time(["Sensortest"]),
+        "import_eager_ms": import_time(eager),
+    }
+
+    bus, models, inits, closes = hotplug_devices()
+    for model in models:
+        bus.attach(model)
+    start = time.monotonic()
+    drivers = {name: init() for name, init in inits.items()}
+    results["init_sequential_ms"] = (time.monotonic() - start) * 1e3
+    for name, driver in drivers.items():
+        closes[name](driver)
+
+    sup = Supervisor(verbose=False)
+    for name in inits:
+        sup.add(name, inits[name], closes[name])
+    start = time.monotonic()
+    sup.start()
+    while any(sensor.first_up is None for sensor in sup.sensors.values()):
+        time.sleep(0.001)
+    ups = [sensor.first_up - start for sensor in sup.sensors.values()]
+    results["init_parallel_first_ms"] = min(ups) * 1e3
+    results["init_parallel_all_ms"] = max(ups) * 1e3
+    sup.stop()
+    return results
@@ -1,120 +1,541 @@
-import bluetooth
+import collections
+import selectors
+import socket
 import threading
 import json
 import time
-import queue
+
+import metrics
+import wire
+from backlog import Backlog
+from transport import RfcommTransport, Transport
+
+LAG_MS = metrics.histogram("bt.lag_ms", metrics.BUCKETS_MS)
+SENT = metrics.counter("bt.packets_sent")
+DROPPED = metrics.counter("bt.packets_dropped")
+BYTES = metrics.counter("bt.bytes_sent")
+
+
+class Subscriber:
+    """
+    One connected phone: its own queues, encoding, write buffer and
+    counters. Only the sender's I/O thread writes to its socket.
+    """
+
+    def __init__(self, sock, address, clock=time.monotonic, max_pending=64, drop="oldest"):
+        if drop not in ("oldest", "newest"):
+            raise ValueError(f"drop must be 'oldest' or 'newest', not {drop!r}")
+        self.sock = sock
+        self.address = address
+        self.clock = clock
+        self.max_pending = max_pending
+        self.drop = drop  # which packet is lost when the queue is full
+        # "json" until the phone asks for something else (see wire.py)
+        self.encoding = wire.JSON
+        self.encoder = wire.Encoder(clock)
+        self.pending = collections.deque()   # (time queued, packet)
+        self.priority = collections.deque()  # obstacle packets, sent first
+        self.out = bytearray()  # encoded, not yet accepted by the socket
+        self._sizes = collections.deque()  # size of every frame in out, in order
+        self._sent = 0  # bytes of the first frame the socket already took
+        self.rx = b""
+        self.decimate = 1
+        self._count = 0
+        self.full = False  # the socket refused bytes since the last batch
+        self._calm_since = None  # on time since then, None while late
+        self._changed = 0.0      # last change of decimate
+        # the Backlog this client is replaying, None once caught up
+        self.backlog = None
+        self.replayed = 0
+        self.chunk = BluetoothSender.REPLAY_CHUNK  # backlog packets per batch
+
+        self.connected_at = clock()
+        self.sends = 0
+        self.packets_sent = 0
+        self.packets_dropped = 0
+        self.bytes_sent = 0
+        self.lag = 0.0      # age of the oldest packet in the last batch
+        self.lag_max = 0.0
+
+    def offer(self, packet, urgent, now, budget):
+        """Queues PACKET, or drops it (thinning, stale or full queue). Call with the sender lock held."""
+        if not urgent:
+            # backpressure: keep 1 in DECIMATE ordinary packets
+            self._count += 1
+            if self._count % self.decimate:
+                self.packets_dropped += 1
+                if metrics.enabled:
+                    DROPPED.inc()
+                return
+        lane = self.priority if urgent else self.pending
+        if len(lane) >= self.max_pending:
+            self.packets_dropped += 1
+            if metrics.enabled:
+                DROPPED.inc()
+            if self.drop == "newest":
+                return
+            lane.popleft()
+        lane.append((now, packet))
+        if self.out and not urgent and self.drop == "oldest":
+            # the link is busy with the last batch: keep what is fresh, like
+            # the old queue of 2, so it stays full and nothing goes out stale
+            while self.pending[0][0] < now - budget:
+                self.pending.popleft()
+                self.packets_dropped += 1
+                if metrics.enabled:
+                    DROPPED.inc()
+
+    def due(self, now, budget):
+        """Seconds until the next batch must go out, 0 if now, None if nothing to do."""
+        if self.priority:
+            return 0.0
+        if self.out:
+            # the socket is full, EVENT_WRITE wakes the loop when it drains
+            return None
+        if self.replaying():
+            return 0.0
+        if self.pending:
+            return max(self.pending[0][0] + budget - now, 0.0)
+        return None
+
+    def replaying(self):
+        """Whether to add backlog packets to the next batch."""
+        return self.backlog is not None and self.chunk > 0 and len(self.backlog) > 0
+
+    def take(self, now, budget, everything=False, replay=()):
+        """
+        Encodes every due packet into the write buffer, live ones first, then
+        REPLAY (backlog (t, packet) pairs). Call with the sender lock held.
+        Only obstacle packets are taken while the last batch is still unsent,
+        ahead of it, so a slow phone's backlog stays in the queues where it can
+        be thinned out and dropped.
+        """
+        packets = [packet for _, packet in self.priority]
+        self.priority.clear()
+        if self.out and not everything:
+            if packets:
+                self._queue(packets, ahead=True)
+            return
+        ordinary = bool(self.pending) and (everything or now >= self.pending[0][0] + budget)
+        if ordinary:
+            self.lag = now - self.pending[0][0]
+            self.lag_max = max(self.lag_max, self.lag)
+            if metrics.enabled:
+                LAG_MS.observe(self.lag * 1e3)
+            packets += [packet for _, packet in self.pending]
+            self.pending.clear()
+            self._adapt(budget, now)
+        for t, packet in replay:
+            packets.append(dict(packet, backlog_ms=round((now - t) * 1000)))
+        self.replayed += len(replay)
+        if packets:
+            self._queue(packets)
+
+    def _queue(self, packets, ahead=False):
+        """
+        Encodes PACKETS into the write buffer, at its end or AHEAD of every
+        frame the socket has not started on.
+        """
+        if self.encoding == wire.JSON:
+            frames = [(json.dumps(packet) + "\n").encode() for packet in packets]
+        else:
+            frames = [self.encoder.encode(packet) for packet in packets]
+        self._add(frames, ahead)
+        self.packets_sent += len(packets)
+        if metrics.enabled:
+            SENT.inc(len(packets))
+
+    def _add(self, frames, ahead=False):
+        if ahead and self.out:
+            # behind the rest of a frame already half sent, never inside it
+            index = 1 if self._sent else 0
+            pos = self._sizes[0] - self._sent if self._sent else 0
+            self.out[pos:pos] = b"".join(frames)
+            for i, frame in enumerate(frames):
+                self._sizes.insert(index + i, len(frame))
+        else:
+            self.out += b"".join(frames)
+            self._sizes.extend(len(frame) for frame in frames)
+
+    def _adapt(self, budget, now):
+        """
+        Thins out ordinary packets while they wait longer than the budget,
+        one step per SETTLE_TIME so a single stall of the link costs one
+        step; CALM_TIME on time undoes one. A full socket is no reason to
+        thin: at link capacity send() refuses bytes all the time, and the
+        packets only start to wait here once the kernel buffer is full.
+        """
+        full, self.full = self.full, False
+        late = self.lag > 2 * budget
+        # a batch is taken once its oldest packet is BUDGET old, so the
+        # lag is never below it
+        calm = self.lag < 1.25 * budget
+        if self.backlog is not None and (self.chunk or not late):
+            # replaying: the backlog gives way first, on a full link too;
+            # live packets are only thinned once it is paused (chunk 0)
+            # and still late
+            if late or full:
+                self.chunk //= 2
+            elif calm:
+                self.chunk = min(2 * self.chunk or 1, BluetoothSender.REPLAY_CHUNK)
+            return
+        if late:
+            self._calm_since = None
+            if now - self._changed >= BluetoothSender.SETTLE_TIME:
+                self.decimate = min(self.decimate + 1, BluetoothSender.MAX_DECIMATE)
+                self._changed = now
+        elif not calm:
+            self._calm_since = None
+        elif self._calm_since is None:
+            self._calm_since = now
+        elif self.decimate > 1 and now - max(self._calm_since, self._changed) >= BluetoothSender.CALM_TIME:
+            self.decimate -= 1
+            self._changed = now
+
+    def write(self):
+        """One non-blocking send() of the write buffer. Raises OSError if the link is gone."""
+        if not self.out:
+            return
+        try:
+            n = self.sock.send(self.out)
+        except (BlockingIOError, InterruptedError):
+            self.full = True
+            return
+        except Exception as e:
+            # PyBluez reports a full buffer as BluetoothError("Resource temporarily unavailable")
+            if "temporarily unavailable" in str(e):
+                self.full = True
+                return
+            raise OSError(str(e))
+        self.full = self.full or n < len(self.out)
+        del self.out[:n]
+        n += self._sent
+        while self._sizes and n >= self._sizes[0]:
+            n -= self._sizes.popleft()
+        self._sent = n
+        self.sends += 1
+        self.bytes_sent += n
+        if metrics.enabled:
+            BYTES.inc(n)
+
+    def read(self):
+        """Reads what the phone sent; returns the encoding it asked for, or None."""
+        data = self.sock.recv(256)
+        if not data:
+            raise ConnectionError("closed by the phone")
+        self.rx = (self.rx + data)[-1024:]
+        encoding = None
+        while b"\n" in self.rx:
+            line, self.rx = self.rx.split(b"\n", 1)
+            encoding = wire.negotiate(line) or encoding
+        return encoding
+
+    def set_encoding(self, encoding):
+        self.encoding = encoding
+        self.encoder.reset()
+        # the reply goes ahead of everything not yet encoded
+        self._add([wire.reply(encoding)])
+
+    def stats(self):
+        alive = max(self.clock() - self.connected_at, 1e-9)
+        return {
+            "address": str(self.address),
+            "encoding": self.encoding,
+            "packets_sent": self.packets_sent,
+            "packets_dropped": self.packets_dropped,
+            "bytes_sent": self.bytes_sent,
+            "sends": self.sends,
+            "bytes_per_s": self.bytes_sent / alive,
+            "queued": len(self.pending) + len(self.priority),
+            "unsent_bytes": len(self.out),
+            "lag_ms": self.lag * 1e3,
+            "lag_max_ms": self.lag_max * 1e3,
+            "decimate": self.decimate,
+            "replayed": self.replayed,
+            "replay_chunk": self.chunk,
+        }
+
 
 class BluetoothSender:
-    def __init__(self):
-        self.server_sock = None
-        self.client_sock = None
-        self.connected = False
+    """
+    Streams sensor packets to every connected phone.
+
+    Phones connect through one or more transports (transport.py: RFCOMM
+    by default, TCP, Unix socket). One I/O thread runs a selector over
+    their listening sockets and all clients; sockets are non-blocking, so a stalled phone only fills its
+    own queue. Each Subscriber batches ordinary packets for up to
+    LATENCY_BUDGET seconds into one send(); a packet with an obstacle
+    closer than OBSTACLE_CM goes out at once. While a client's link is
+    busy with the last batch only its fresh ordinary packets are kept,
+    so the link stays full; one whose packets still wait past the budget
+    gets them thinned out until it catches up.
+
+    While no phone is connected packets go to a Backlog (RAM, spilling to
+    disk when it has a directory). The next phone to connect gets it
+    replayed behind each live batch, up to REPLAY_CHUNK packets at a
+    time, as fast as the link takes them. Live packets always go first:
+    when they run late the chunk is halved, down to pausing the replay,
+    before any live packet is thinned out.
+    """
+
+    LATENCY_BUDGET = 0.020
+    MAX_PENDING = 64   # per client and lane
+    MAX_DECIMATE = 8
+    SETTLE_TIME = 0.25  # seconds between two thinning steps
+    CALM_TIME = 0.5     # seconds on time before a step is undone
+    MAX_CLIENTS = 4
+    REPLAY_CHUNK = 32
+
+    def __init__(self, latency_budget=LATENCY_BUDGET, obstacle_cm=100, clock=time.monotonic,
+                 max_clients=MAX_CLIENTS, max_pending=MAX_PENDING, drop="oldest", backlog=None,
+                 transports=None):
+        self.transports = [RfcommTransport()] if transports is None else list(transports)
+        self.server_socks = []
         self.running = False
-        self.accept_thread = None
-        self.send_thread = None
-        
-        # A mailbox to hold messages so the main loop doesn't have to wait
-        # Max size 2 ensures we don't pile up old data if the connection is slow
-        self.out_queue = queue.Queue(maxsize=2)
+        self.io_thread = None
+        self.latency_budget = latency_budget
+        self.obstacle_cm = obstacle_cm
+        self.clock = clock
+        self.max_clients = max_clients
+        self.max_pending = max_pending
+        self.drop = drop
+
+        # replaced, never mutated, so send_data can iterate without the lock
+        self.clients = ()
+        self._lock = threading.Lock()
+        self._selector = None
+        self._wake_r = self._wake_w = None
+        self.packets_offered = 0
+        self.disconnects = 0
+
+        self.backlog = Backlog() if backlog is None else backlog
+        self.catchup = None      # the last finished replay
+        self._catchup_start = None
+
+    @property
+    def connected(self):
+        return bool(self.clients)
 
+    # ---------------------------------------------------------
+    # SERVER
+    # ---------------------------------------------------------
     def start(self):
-        """Starts the Bluetooth server and sender in background threads."""
+        """Starts listening on every transport in a background thread."""
         self.running = True
-        
-        # Thread 1: Accepts new connections
-        self.accept_thread = threading.Thread(target=self._accept_connections)
-        self.accept_thread.daemon = True
-        self.accept_thread.start()
-        
-        # Thread 2: Handles the slow sending process
-        self.send_thread = threading.Thread(target=self._process_queue)
-        self.send_thread.daemon = True
-        self.send_thread.start()
-
-    def _accept_connections(self):
-        try:
-            self.server_sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-            self.server_sock.bind(("", bluetooth.PORT_ANY))
-            self.server_sock.listen(1)
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, "wake")
 
-            port = self.server_sock.getsockname()[1]
-            print(f"[BT] Waiting for connection on RFCOMM channel {port}...")
+        # evaluated only when a metrics snapshot is taken
+        metrics.gauge("bt.clients", lambda: len(self.clients))
+        metrics.gauge("bt.queued", lambda: sum(len(c.pending) + len(c.priority) for c in self.clients))
+        metrics.gauge("bt.unsent_bytes", lambda: sum(len(c.out) for c in self.clients))
+        metrics.gauge("bt.backlog", lambda: len(self.backlog))
 
-            bluetooth.advertise_service(self.server_sock, "PathPalPi",
-                                        service_id="00001101-0000-1000-8000-00805F9B34FB",
-                                        service_classes=[bluetooth.SERIAL_PORT_CLASS],
-                                        profiles=[bluetooth.SERIAL_PORT_PROFILE])
-        except Exception as e:
-            print(f"[BT] Init failed: {e}")
+        self.io_thread = threading.Thread(target=self._serve)
+        self.io_thread.daemon = True
+        self.io_thread.start()
+
+    def _serve(self):
+        for transport in self.transports:
+            try:
+                sock = transport.listen(self.max_clients)
+                sock.setblocking(False)
+                self._selector.register(sock, selectors.EVENT_READ, transport)
+                self.server_socks.append(sock)
+            except Exception as e:
+                print(f"[BT] Init failed for {transport.url}: {e}")
+        if not self.server_socks:
             return
 
         while self.running:
             try:
-                # This blocks until a phone connects
-                client, client_info = self.server_sock.accept()
-                print(f"[BT] Accepted connection from {client_info}")
-                self.client_sock = client
-                self.connected = True
-                
-                # Monitor connection
-                while self.connected and self.running:
-                    time.sleep(1)
-                    
+                for key, mask in self._selector.select(self._timeout()):
+                    if isinstance(key.data, Transport):
+                        self._accept(key.fileobj, key.data)
+                    elif key.data == "wake":
+                        try: self._wake_r.recv(4096)
+                        except BlockingIOError: pass
+                    else:
+                        self._service(key.data, mask)
+                self._flush_due()
+                self.backlog.spill()
             except Exception as e:
-                print(f"[BT] Connection reset/error: {e}")
-            finally:
-                self.connected = False
-                if self.client_sock:
-                    try: self.client_sock.close()
-                    except: pass
-                self.client_sock = None
-                # Clear queue so old data doesn't get sent on reconnect
-                with self.out_queue.mutex:
-                    self.out_queue.queue.clear()
-
-    def _process_queue(self):
-        """Constantly checks the mailbox and sends data if connected."""
-        while self.running:
+                print(f"[BT] Loop error: {e}")
+
+    def _timeout(self):
+        now = self.clock()
+        timeout = 1.0  # wake up now and then to check self.running
+        with self._lock:
+            for client in self.clients:
+                due = client.due(now, self.latency_budget)
+                if due is not None:
+                    timeout = min(timeout, due)
+        return timeout
+
+    def _wake(self):
+        try: self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError): pass
+
+    def _accept(self, server_sock, transport):
+        try:
+            client, client_info = server_sock.accept()
+        except (BlockingIOError, OSError):
+            return
+        # Unix sockets have no peer address
+        client_info = client_info or transport.url
+        if len(self.clients) >= self.max_clients:
+            print(f"[BT] Refused {client_info}: {self.max_clients} clients connected")
+            try: client.close()
+            except: pass
+            return
+        print(f"[BT] Accepted connection from {client_info}")
+        try:
+            transport.accepted(client)
+        except OSError as e:
+            print(f"[BT] Setting up {client_info} failed: {e}")
+        self.add_client(client, client_info)
+
+    def add_client(self, sock, address=None):
+        """Adds a connected socket (also used by replay and benchmarks with a socket stand-in)."""
+        client = Subscriber(sock, address, self.clock, self.max_pending, self.drop)
+        if self._selector is not None:
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ, client)
+        with self._lock:
+            if len(self.backlog) and all(c.backlog is None for c in self.clients):
+                client.backlog = self.backlog
+                self._catchup_start = (self.clock(), len(self.backlog))
+                print(f"[BT] Replaying {len(self.backlog)} backlog packets to {address}")
+            self.clients = self.clients + (client,)
+        if self._wake_w is not None:
+            self._wake()
+        return client
+
+    def _remove(self, client, reason):
+        print(f"[BT] {client.address} disconnected: {reason}")
+        with self._lock:
+            self.clients = tuple(c for c in self.clients if c is not client)
+            if client.backlog is not None and self.clients:
+                # another phone takes over the replay
+                self.clients[0].backlog = self.backlog
+            if not self.clients:
+                # keep what this phone never got for the next one
+                for t, packet in sorted(client.priority + client.pending, key=lambda item: item[0]):
+                    self.backlog.append(packet, t)
+        self.disconnects += 1
+        if self._selector is not None:
+            try: self._selector.unregister(client.sock)
+            except (KeyError, ValueError): pass
+        try: client.sock.close()
+        except: pass
+
+    def _service(self, client, mask):
+        try:
+            if mask & selectors.EVENT_READ:
+                encoding = client.read()
+                if encoding is not None:
+                    with self._lock:
+                        client.set_encoding(encoding)
+                    print(f"[BT] {client.address} encoding: {encoding}")
+            if mask & selectors.EVENT_WRITE:
+                client.write()
+        except OSError as e:
+            self._remove(client, e)
+
+    def _flush_due(self, everything=False):
+        now = self.clock()
+        for client in self.clients:
+            replay = ()
+            if client.replaying() and not client.out:
+                # read back outside the lock, it may load a segment from disk
+                replay = self.backlog.take(client.chunk)
+            with self._lock:
+                client.take(now, self.latency_budget, everything, replay)
             try:
-                # Get message from queue (waits 1 sec then loops to check self.running)
-                msg = self.out_queue.get(timeout=1)
-                
-                if self.connected and self.client_sock:
-                    try:
-                        self.client_sock.send(msg)
-                    except Exception as e:
-                        print(f"[BT] Send Error: {e}")
-                        self.connected = False
-                        try: self.client_sock.close()
-                        except: pass
-                        self.client_sock = None
-            except queue.Empty:
+                client.write()
+            except OSError as e:
+                self._remove(client, e)
                 continue
-            except Exception as e:
-                print(f"[BT] Queue Error: {e}")
+            if client.backlog is not None and not len(self.backlog) and not client.out:
+                self._caught_up(client, self.clock())
+            if self._selector is not None:
+                # wait for room in the socket only while something is left
+                events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.out else 0)
+                try: self._selector.modify(client.sock, events, client)
+                except (KeyError, ValueError): pass
+
+    def _caught_up(self, client, now):
+        client.backlog = None
+        start, packets = self._catchup_start
+        seconds = max(now - start, 1e-9)
+        self.catchup = {"packets": packets, "seconds": seconds, "per_s": packets / seconds}
+        print(f"[BT] Backlog: {packets} packets replayed in {seconds:.1f} s ({packets / seconds:.0f}/s)")
+
+    # ---------------------------------------------------------
+    # MAIN LOOP SIDE
+    # ---------------------------------------------------------
+    def flush(self):
+        """Sends everything queued from the calling thread (used by trace replay)."""
+        self._flush_due(everything=True)
+        self.backlog.spill()
+
+    def is_urgent(self, data_dict):
+        """Priority lane: an obstacle is in range."""
+        dist = data_dict.get("dist_cm") or 0
+        return 0 < dist < self.obstacle_cm
 
     def send_data(self, data_dict):
-        """NON-BLOCKING: Puts data in queue and returns immediately."""
-        if not self.connected:
+        """NON-BLOCKING: Queues the packet for every client and returns immediately."""
+        clients = self.clients
+        if not clients:
+            # nobody listening: keep it for the next phone
+            self.packets_offered += 1
+            self.backlog.append(data_dict, self.clock())
             return
 
         try:
-            message = json.dumps(data_dict) + "\n"
-            
-            # If queue is full (Bluetooth is too slow), remove oldest item
-            # This ensures we always send the NEWEST data
-            if self.out_queue.full():
-                try: self.out_queue.get_nowait()
-                except queue.Empty: pass
-            
-            self.out_queue.put_nowait(message)
-            
+            urgent = self.is_urgent(data_dict)
+            now = self.clock()
+            wake = urgent
+            with self._lock:
+                self.packets_offered += 1
+                for client in clients:
+                    # first packet of a batch starts the latency budget timer
+                    wake = wake or not client.pending
+                    client.offer(data_dict, urgent, now, self.latency_budget)
+            if wake and self._wake_w is not None:
+                self._wake()
         except Exception as e:
             # If this fails, it just means queue issues, doesn't crash main loop
             pass
 
+    def stats(self):
+        clients = [client.stats() for client in self.clients]
+        return {
+            "clients": len(clients),
+            "packets_offered": self.packets_offered,
+            "disconnects": self.disconnects,
+            "backlog": self.backlog.stats(),
+            "catchup": self.catchup,
+            "per_client": clients,
+        }
+
     def stop(self):
         self.running = False
-        if self.server_sock:
-            try: self.server_sock.close()
-            except: pass
\ No newline at end of file
+        if self._wake_w is not None:
+            self._wake()
+        if self.io_thread is not None:
+            self.io_thread.join(2.0)
+        for client in self.clients:
+            try: client.sock.close()
+            except: pass
+        self.clients = ()
+        for sock in self.server_socks:
+            try: sock.close()
+            except: pass
+        self.server_socks = []
+        for transport in self.transports:
+            transport.close()
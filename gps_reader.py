@@ -1,58 +1,469 @@
+import collections
+import struct
+import threading
 import serial
-import pynmea2
 import time
 
+import metrics
+
+# The serial port may vary. '/dev/serial0' is common for Raspberry Pi hardware UART.
+# 9600 is a common baud rate for GPS modules.
+SERIAL_PORT = "/dev/serial0"
+BAUD_RATE = 9600
+
+# sentence types we take fields from, everything else is skipped unparsed
+WANTED = (b"GGA", b"RMC", b"VTG")
+
+KNOTS_TO_MS = 0.514444
+KMH_TO_MS = 1 / 3.6
+
+# TIME is time.monotonic() when the last GGA or RMC of the fix arrived
+# (VTG carries no position), UTC the "hhmmss.ss" string from the module
+Fix = collections.namedtuple(
+    "Fix", "time utc valid lat lon altitude sats quality hdop speed course")
+
+EMPTY_FIX = Fix(None, "", False, None, None, None, 0, 0, None, None, None)
+
+FIX_AGE_MS = metrics.histogram("gps.fix_age_ms", metrics.BUCKETS_MS)
+
+
+# ---------------------------------------------------------------
+# NMEA PARSING
+# ---------------------------------------------------------------
+
+def checksum_ok(line):
+    """
+    True if the XOR of the bytes between '$' and '*' matches the two hex
+    digits after the '*'. LINE is bytes without the line ending.
+    """
+    star = line.rfind(b"*")
+    if star < 0 or len(line) < star + 3:
+        return False
+    checksum = 0
+    for c in line[1:star]:
+        checksum ^= c
+    try:
+        return checksum == int(line[star + 1:star + 3], 16)
+    except ValueError:
+        return False
+
+
+def _degrees(value, hemisphere, digits):
+    # "4807.038", "N" -> 48.1173; DIGITS is 2 for latitude, 3 for longitude
+    if not value:
+        return None
+    degrees = int(value[:digits]) + float(value[digits:]) / 60.0
+    return -degrees if hemisphere in (b"S", b"W") else degrees
+
+
+def _float(value):
+    return float(value) if value else None
+
+
+class NmeaParser(object):
+    """
+    Selective NMEA parser. Lines that are not GGA, RMC or VTG are
+    dropped after looking at three bytes; the others are checksummed,
+    split once and only the fields of the fix are converted.
+    """
+
+    def __init__(self):
+        self.fix = EMPTY_FIX
+        self.sentences = 0
+        self.skipped = 0
+        self.bad_checksums = 0
+        self.errors = 0
+
+    def feed_line(self, line, now=None):
+        """
+        Parse one sentence (bytes). Returns the updated Fix, or None if
+        the line was skipped or invalid.
+        """
+        line = line.rstrip(b"\r\n")
+        if line[:1] != b"$" or line[3:6] not in WANTED:
+            self.skipped += 1
+            return None
+        if not checksum_ok(line):
+            self.bad_checksums += 1
+            return None
+        fields = line[:line.rfind(b"*")].split(b",")
+        kind = line[3:6]
+        fix = self.fix
+        try:
+            if kind == b"GGA":
+                quality = int(fields[6] or 0)
+                fix = fix._replace(
+                    utc=fields[1].decode(),
+                    lat=_degrees(fields[2], fields[3], 2),
+                    lon=_degrees(fields[4], fields[5], 3),
+                    quality=quality,
+                    sats=int(fields[7] or 0),
+                    hdop=_float(fields[8]),
+                    altitude=_float(fields[9]),
+                    valid=quality > 0)
+            elif kind == b"RMC":
+                speed = _float(fields[7])
+                fix = fix._replace(
+                    utc=fields[1].decode(),
+                    valid=fields[2] == b"A",
+                    lat=_degrees(fields[3], fields[4], 2),
+                    lon=_degrees(fields[5], fields[6], 3),
+                    speed=speed * KNOTS_TO_MS if speed is not None else None,
+                    course=_float(fields[8]))
+            else:  # VTG
+                speed = _float(fields[7])
+                fix = fix._replace(
+                    course=_float(fields[1]),
+                    speed=speed * KMH_TO_MS if speed is not None else fix.speed)
+        except (IndexError, ValueError):
+            self.errors += 1
+            return None
+        self.sentences += 1
+        if kind != b"VTG":
+            fix = fix._replace(time=time.monotonic() if now is None else now)
+        self.fix = fix
+        return fix
+
+
+# ---------------------------------------------------------------
+# HIGH RATE CONFIGURATION
+# ---------------------------------------------------------------
+
+HIGH_RATE_HZ = 10
+HIGH_RATE_BAUD = 115200
+
+ConfigResult = collections.namedtuple(
+    "ConfigResult", "ok chip baud rate_hz measured_hz message")
+
+
+def nmea_command(body):
+    """
+    '$BODY*CS\\r\\n' for a command like 'PMTK220,100'.
+    """
+    data = body.encode("ascii")
+    checksum = 0
+    for c in data:
+        checksum ^= c
+    return b"$" + data + b"*%02X\r\n" % checksum
+
+
+def ubx_command(msg_class, msg_id, payload=b""):
+    """
+    UBX frame: sync, class, id, length, payload, Fletcher checksum.
+    """
+    body = struct.pack("<BBH", msg_class, msg_id, len(payload)) + payload
+    ck_a = ck_b = 0
+    for c in body:
+        ck_a = (ck_a + c) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return b"\xb5\x62" + body + bytes([ck_a, ck_b])
+
+
+# MTK (PMTK) chips: GLL, RMC, VTG, GGA, GSA, GSV, ... output every Nth fix
+PMTK_OUTPUT = "PMTK314,0,1,1,1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0"
+
+# u-blox NMEA message ids (class 0xF0) and whether we keep them
+UBX_NMEA = {0x00: 1, 0x01: 0, 0x02: 0, 0x03: 0, 0x04: 1, 0x05: 1}  # GGA GLL GSA GSV RMC VTG
+UBX_CFG = 0x06
+UBX_CFG_PRT, UBX_CFG_MSG, UBX_CFG_RATE = 0x00, 0x01, 0x08
+
+
+def pmtk_ack(command):
+    # "$PMTK001,<command>,3" is "valid command, succeeded"
+    return b"$PMTK001,%d,3" % command
+
+
+def ubx_ack(msg_class, msg_id):
+    return b"\xb5\x62\x05\x01\x02\x00" + bytes([msg_class, msg_id])
+
+
+class GpsConfigurator(object):
+    """
+    Switches an MTK or u-blox module to a higher fix rate and baud at
+    startup, and keeps the current settings if the switch does not work.
+
+        result = GpsConfigurator(ser).configure(10, 115200)
+
+    Every step is checked: commands must be acknowledged, and at the end
+    the fix rate is measured from the sentences that arrive. CLOCK and
+    SLEEP can be a SimClock's, for the scripted fake module.
+    """
+
+    def __init__(self, ser, clock=time.monotonic, sleep=time.sleep):
+        self.ser = ser
+        self.clock = clock
+        self.sleep = sleep
+        self._rx = bytearray()
+
+    def _send(self, data):
+        self.ser.write(data)
+
+    def _wait_for(self, pattern, timeout=1.0):
+        end = self.clock() + timeout
+        while True:
+            self._rx += self.ser.read(self.ser.in_waiting or 1)
+            found = self._rx.find(pattern)
+            if found >= 0:
+                del self._rx[:found + len(pattern)]
+                return True
+            del self._rx[:-len(pattern)]
+            if self.clock() >= end:
+                return False
+            self.sleep(0.02)
+
+    def detect(self):
+        """
+        'mtk', 'ublox' or None. Sends the sentence filter as the probe,
+        so a detected module already only outputs GGA, RMC and VTG.
+        """
+        self._send(nmea_command(PMTK_OUTPUT))
+        if self._wait_for(pmtk_ack(314)):
+            return "mtk"
+        if self._ubx_messages():
+            return "ublox"
+        return None
+
+    def _ubx_messages(self):
+        for msg_id, rate in sorted(UBX_NMEA.items()):
+            self._send(ubx_command(UBX_CFG, UBX_CFG_MSG, bytes([0xF0, msg_id, rate])))
+            if not self._wait_for(ubx_ack(UBX_CFG, UBX_CFG_MSG)):
+                return False
+        return True
+
+    def _set_baud(self, chip, baud):
+        if chip == "mtk":
+            self._send(nmea_command("PMTK251,%d" % baud))
+        else:
+            # UART1, 8N1, UBX+NMEA in, UBX+NMEA out
+            payload = struct.pack("<BBHIIHHHH", 1, 0, 0, 0x08D0, baud, 0x0003, 0x0003, 0, 0)
+            self._send(ubx_command(UBX_CFG, UBX_CFG_PRT, payload))
+        # let the module finish sending at the old baud before switching
+        self.sleep(0.1)
+        self.ser.baudrate = baud
+        self.ser.reset_input_buffer()
+        self._rx = bytearray()
+
+    def _set_rate(self, chip, rate_hz):
+        period = int(round(1000.0 / rate_hz))
+        if chip == "mtk":
+            self._send(nmea_command("PMTK220,%d" % period))
+            return self._wait_for(pmtk_ack(220))
+        self._send(ubx_command(UBX_CFG, UBX_CFG_RATE, struct.pack("<HHH", period, 1, 1)))
+        return self._wait_for(ubx_ack(UBX_CFG, UBX_CFG_RATE))
+
+    def measure_rate(self, seconds=2.0):
+        """
+        Fixes per second: distinct GGA/RMC times seen in SECONDS.
+        """
+        parser = NmeaParser()
+        epochs = set()
+        buf = bytearray()
+        end = self.clock() + seconds
+        while self.clock() < end:
+            buf += self.ser.read(self.ser.in_waiting or 1)
+            lines = buf.split(b"\n")
+            buf = lines.pop()
+            for line in lines:
+                fix = parser.feed_line(bytes(line))
+                if fix is not None and fix.utc:
+                    epochs.add(fix.utc)
+            self.sleep(0.02)
+        return len(epochs) / seconds
+
+    def configure(self, rate_hz=HIGH_RATE_HZ, baud=HIGH_RATE_BAUD, verify_seconds=2.0):
+        original_baud = self.ser.baudrate
+        chip = self.detect()
+        if chip is None and baud != original_baud:
+            # still at the high baud from a previous run (battery backed config)?
+            self.ser.baudrate = baud
+            chip = self.detect()
+            if chip is None:
+                self.ser.baudrate = original_baud
+            else:
+                original_baud = baud
+        if chip is None:
+            return ConfigResult(False, None, original_baud, None, None,
+                                "no PMTK or UBX acknowledgement, module left as is")
+
+        # faster link first, so the higher rate fits
+        if baud != original_baud:
+            self._set_baud(chip, baud)
+        if self._set_rate(chip, rate_hz):
+            measured = self.measure_rate(verify_seconds)
+            if measured >= 0.8 * rate_hz:
+                return ConfigResult(True, chip, baud, rate_hz, measured, "ok")
+            message = "measured {0:.1f} Hz".format(measured)
+        else:
+            message = "rate change not acknowledged at {0} baud".format(self.ser.baudrate)
+
+        self.fallback(chip, original_baud)
+        measured = self.measure_rate(verify_seconds)
+        return ConfigResult(False, chip, original_baud, 1, measured,
+                            message + ", back to {0} baud 1 Hz".format(original_baud))
+
+    def fallback(self, chip, original_baud):
+        """
+        Back to 1 Hz at ORIGINAL_BAUD, whatever baud the module is at now.
+        """
+        bauds = [self.ser.baudrate]
+        if original_baud not in bauds:
+            bauds.append(original_baud)
+        for baud in bauds:
+            self.ser.baudrate = baud
+            self._set_rate(chip, 1)
+            if baud != original_baud:
+                self._set_baud(chip, original_baud)
+        self.ser.baudrate = original_baud
+        self.ser.reset_input_buffer()
+
+
+# ---------------------------------------------------------------
+# SERVICE
+# ---------------------------------------------------------------
+
+class GpsService(object):
+    """
+    Reads a GPS serial port and keeps the latest fix.
+
+    start() runs the reader in a background thread. Without it, fix()
+    parses whatever is waiting on the port first, so the same object
+    works inline (trace replay) and threaded (device).
+
+    With HIGH_RATE the thread first switches the module to
+    HIGH_RATE_HZ / HIGH_RATE_BAUD (see GpsConfigurator); the outcome
+    is kept in `config`.
+    """
+
+    def __init__(self, ser=None, port=SERIAL_PORT, baud=BAUD_RATE, clock=time.monotonic,
+                 high_rate=False):
+        if ser is None:
+            ser = serial.Serial(port, baudrate=baud, timeout=1)
+        self.ser = ser
+        self.clock = clock
+        self.high_rate = high_rate
+        self.config = None
+        self.parser = NmeaParser()
+        self._buffer = bytearray()
+        self._thread = None
+        self._stop = False
+
+    def poll(self, block=False):
+        """
+        Parse every complete line on the port. With BLOCK, wait for data
+        (up to the port timeout) if nothing is waiting.
+        """
+        waiting = self.ser.in_waiting
+        if waiting == 0 and not block:
+            return
+        data = self.ser.read(waiting or 1)
+        if not data:
+            return
+        buf = self._buffer
+        buf += data
+        end = buf.rfind(b"\n")
+        if end < 0:
+            if len(buf) > 4096:
+                del buf[:]  # no line ending in sight, garbage
+            return
+        now = self.clock()
+        for line in buf[:end].split(b"\n"):
+            self.parser.feed_line(bytes(line), now)
+        del buf[:end + 1]
+
+    def fix(self):
+        """
+        The latest Fix (EMPTY_FIX before the first sentence).
+        """
+        if self._thread is None:
+            self.poll()
+        return self.parser.fix
+
+    def age(self):
+        """
+        Seconds since the last fix sentence, None if there was none.
+        """
+        fix = self.parser.fix
+        return None if fix.time is None else self.clock() - fix.time
+
+    def as_dict(self):
+        """
+        The latest valid fix for the packet, or None.
+        """
+        fix = self.fix()
+        if not fix.valid or fix.lat is None:
+            return None
+        age_ms = int((self.clock() - fix.time) * 1000)
+        if metrics.enabled:
+            FIX_AGE_MS.observe(age_ms)
+        return {
+            "lat": round(fix.lat, 7),
+            "lon": round(fix.lon, 7),
+            "speed": round(fix.speed, 2) if fix.speed is not None else None,
+            "age_ms": age_ms,
+        }
+
+    def start(self):
+        self._stop = False
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run(self):
+        if self.high_rate:
+            try:
+                self.config = GpsConfigurator(self.ser).configure()
+                print(f"[GPS] high rate: {self.config.message} "
+                      f"({self.config.baud} baud, {self.config.measured_hz} Hz)")
+            except serial.SerialException as e:
+                print(f"[GPS] high rate setup failed: {e}")
+        while not self._stop:
+            try:
+                self.poll(block=True)
+            except serial.SerialException as e:
+                print(f"[GPS] serial error: {e}")
+                time.sleep(1.0)
+
+    def close(self):
+        self.stop()
+        self.ser.close()
+
+
 # Function to read and parse data from the GPS module
 def read_gps_data():
-    # The serial port may vary. '/dev/serial0' is common for Raspberry Pi hardware UART.
-    # 9600 is a common baud rate for GPS modules.
-    serial_port = "/dev/serial0"
-    baud_rate = 9600
-
     try:
         # Open the serial port
-        ser = serial.Serial(serial_port, baudrate=baud_rate, timeout=1)
-        print(f"Serial port {serial_port} opened successfully.")
-        
+        gps = GpsService().start()
+        print(f"Serial port {SERIAL_PORT} opened successfully.")
+
+        last = None
         while True:
-            try:
-                # Read a line of data from the serial port
-                line = ser.readline().decode('utf-8', errors='ignore')
-
-                # Check if the line contains NMEA data
-                if line.startswith('$'):
-                    # Parse the NMEA sentence
-                    msg = pynmea2.parse(line)
-                    
-                    # We are interested in GGA messages, which contain fix data
-                    if isinstance(msg, pynmea2.types.talker.GGA):
-                        if msg.is_valid:
-                            print(f"Timestamp: {msg.timestamp}")
-                            print(f"Latitude: {msg.latitude:.6f} {msg.lat_dir}")
-                            print(f"Longitude: {msg.longitude:.6f} {msg.lon_dir}")
-                            print(f"Satellites: {msg.num_sats}")
-                            print(f"Altitude: {msg.altitude} {msg.altitude_units}")
-                            print("-" * 20)
-                        else:
-                            print("Waiting for a valid satellite fix...")
-                
-                time.sleep(0.5)
-
-            except pynmea2.ParseError as e:
-                # Handle cases where the NMEA sentence is malformed
-                # print(f"Parse error: {e}")
-                pass
-            except UnicodeDecodeError:
-                # Handle potential garbled data
-                pass
+            fix = gps.fix()
+            if fix.time != last:
+                last = fix.time
+                if fix.valid:
+                    print(f"Timestamp: {fix.utc}")
+                    print(f"Latitude: {fix.lat:.6f}")
+                    print(f"Longitude: {fix.lon:.6f}")
+                    print(f"Satellites: {fix.sats}")
+                    print(f"Altitude: {fix.altitude} M")
+                    print("-" * 20)
+                else:
+                    print("Waiting for a valid satellite fix...")
+            time.sleep(0.1)
 
     except serial.SerialException as e:
-        print(f"Error: Could not open serial port {serial_port}. {e}")
+        print(f"Error: Could not open serial port {SERIAL_PORT}. {e}")
     except KeyboardInterrupt:
         print("Program stopped by user.")
     finally:
-        if 'ser' in locals() and ser.is_open:
-            ser.close()
+        if 'gps' in locals():
+            gps.close()
             print("Serial port closed.")
 
 if __name__ == "__main__":
@@ -1,9 +1,12 @@
-from max30102 import MAX30102
+from max30102 import MAX30102, FifoPoller
 import hrcalc
+import metrics
 import threading
 import time
 import numpy as np
 
+CALC_US = metrics.histogram("hr.calc_us")
+
 
 class HeartRateMonitor(object):
     """
@@ -13,101 +16,185 @@ class HeartRateMonitor(object):
       - Auto-reset on Errno 5
       - Finger detection
       - Stable rolling buffer
+      - Selectable hrcalc engine ("python" or "numpy")
+      - Optional streaming estimator (O(1) work per sample)
+      - Burst FIFO drain (one pointer read + block reads per poll)
+      - Wakes on the INT pin, or sleeps until the FIFO has filled up
     """
 
-    LOOP_TIME = 0.01  # ~100Hz sampling
+    LOOP_TIME = 0.01  # shortest sleep between two FIFO reads
 
-    def __init__(self, print_raw=False, print_result=False):
+    def __init__(self, print_raw=False, print_result=False, engine="python",
+                 streaming=False, int_pin=None, sensor_factory=MAX30102,
+                 on_result=None, recorder=None):
         self.bpm = 0
+        self.spo2 = -999
         self.print_raw = print_raw
         self.print_result = print_result
+        self.streaming = streaming
+        # e.g. max30102.GpioInterruptPin(4), None = adaptive polling
+        self.int_pin = int_pin
+        # called in the sensor thread to open the device (recording, replay...)
+        self.sensor_factory = sensor_factory
+        # called from the sensor thread with (bpm, spo2) after every update
+        self.on_result = on_result
+        # TraceWriter or sample_log.SampleLog that keeps every result
+        self.recorder = recorder
+        self._calc_hr_and_spo2 = hrcalc.get_engine(engine)
         self._thread = None
+        # I2C errors in a row, the sensor thread resets the chip after 3
+        self.consecutive_errors = 0
+        self.reset_buffers()
+
+    def reset_buffers(self):
+        self._ir_data = []
+        self._red_data = []
+        self._estimator = hrcalc.StreamingEstimator() if self.streaming else None
 
     # ---------------------------------------------------------
     # MAIN SENSOR LOOP WITH FULL ERROR RECOVERY
     # ---------------------------------------------------------
     def run_sensor(self):
-        sensor = MAX30102()
+        sensor = self.sensor_factory()
+        poller = self._make_poller(sensor)
 
-        ir_data = []
-        red_data = []
-
-        consecutive_errors = 0
+        self.consecutive_errors = 0
 
         while not getattr(self._thread, "stopped", False):
 
             try:
-                num_bytes = sensor.get_data_present()
+                # sleeps until enough samples are queued, then drains the FIFO
+                red_new, ir_new = poller.read()
 
             except OSError as e:
-                print("I2C read error (get_data_present):", e)
-                consecutive_errors += 1
-                if consecutive_errors > 3:
+                print("I2C read error (drain):", e)
+                self.consecutive_errors += 1
+                if self.consecutive_errors > 3:
                     print("Resetting MAX30102...")
                     try:
                         sensor.reset()
                         time.sleep(0.1)
                         sensor.setup()
                         time.sleep(0.3)
-                        consecutive_errors = 0
+                        poller = self._make_poller(sensor)
+                        self.consecutive_errors = 0
                     except:
                         pass
                 time.sleep(0.1)
                 continue
 
-            if num_bytes > 0:
+            self.consecutive_errors = 0
+            self.process(red_new, ir_new)
 
-                while num_bytes > 0:
-                    try:
-                        red, ir = sensor.read_fifo()
-                    except OSError as e:
-                        print("I2C FIFO read error:", e)
-                        consecutive_errors += 1
-                        break
-
-                    num_bytes -= 1
+        # shutdown on exit
+        try:
+            sensor.shutdown()
+        except:
+            pass
 
-                    ir_data.append(ir)
-                    red_data.append(red)
+    # ---------------------------------------------------------
+    def process(self, red_new, ir_new):
+        """
+        Update bpm from newly read samples (numpy arrays from drain()).
+        Called by the sensor thread, or directly when replaying a trace.
+        """
+        if len(ir_new) == 0:
+            return
 
-                    if self.print_raw:
-                        print(f"{ir}, {red}")
+        if self._estimator is not None:
+            self._update_streaming(self._estimator, red_new, ir_new)
+            return
 
-                # trim rolling buffer
-                if len(ir_data) > 100:
-                    ir_data = ir_data[-100:]
-                    red_data = red_data[-100:]
+        self._ir_data.extend(ir_new.tolist())
+        self._red_data.extend(red_new.tolist())
+
+        if self.print_raw:
+            for ir, red in zip(ir_new, red_new):
+                print(f"{ir}, {red}")
+
+        # trim rolling buffer
+        if len(self._ir_data) > 100:
+            self._ir_data = self._ir_data[-100:]
+            self._red_data = self._red_data[-100:]
+
+        # enough samples for HR calculation
+        if len(self._ir_data) == 100:
+
+            # detect finger removed → very low IR & RED
+            if np.mean(self._ir_data) < 50000:
+                self.bpm = 0
+                if self.print_result:
+                    print("No finger detected")
+                self._notify()
+                return
+
+            # run heart rate algorithm
+            start = time.perf_counter()
+            bpm, valid_bpm, spo2, valid_spo2 = self._calc_hr_and_spo2(
+                self._ir_data, self._red_data
+            )
+            if metrics.enabled:
+                CALC_US.observe((time.perf_counter() - start) * 1e6)
+
+            if valid_bpm:
+                self.bpm = bpm
+            else:
+                self.bpm = 0
+            self.spo2 = spo2 if valid_spo2 else -999
+
+            if self.print_result:
+                print(f"BPM: {self.bpm:.1f} | SpO2: {spo2}")
+            self._notify()
 
-                # enough samples for HR calculation
-                if len(ir_data) == 100:
+    # ---------------------------------------------------------
+    def _notify(self):
+        if self.recorder is not None:
+            self.recorder.vitals(self.bpm, self.spo2)
+        if self.on_result is not None:
+            self.on_result(self.bpm, self.spo2)
 
-                    # detect finger removed → very low IR & RED
-                    if np.mean(ir_data) < 50000:
-                        self.bpm = 0
-                        if self.print_result:
-                            print("No finger detected")
-                        continue
+    # ---------------------------------------------------------
+    def _make_poller(self, sensor):
+        return FifoPoller(sensor, int_pin=self.int_pin, min_sleep=self.LOOP_TIME)
 
-                    # run heart rate algorithm
-                    bpm, valid_bpm, spo2, valid_spo2 = hrcalc.calc_hr_and_spo2(
-                        ir_data, red_data
-                    )
+    # ---------------------------------------------------------
+    def _update_streaming(self, estimator, red_new, ir_new):
+        """
+        Feed every new sample to the streaming estimator and only
+        update the result when a beat is confirmed.
+        """
+        start = time.perf_counter()
+        result = estimator.extend(ir_new, red_new)
+        if metrics.enabled:
+            CALC_US.observe((time.perf_counter() - start) * 1e6)
+
+        if self.print_raw:
+            for ir, red in zip(ir_new, red_new):
+                print(f"{ir}, {red}")
+
+        if not estimator.full:
+            return
 
-                    if valid_bpm:
-                        self.bpm = bpm
-                    else:
-                        self.bpm = 0
+        # detect finger removed → very low IR
+        if estimator.mean_ir < 50000:
+            # start over, the beats and ratios from before are stale
+            estimator.reset()
+            self.bpm = 0
+            if self.print_result:
+                print("No finger detected")
+            self._notify()
+            return
 
-                    if self.print_result:
-                        print(f"BPM: {self.bpm:.1f} | SpO2: {spo2}")
+        if result is None:
+            return
 
-            time.sleep(self.LOOP_TIME)
+        bpm, valid_bpm, spo2, valid_spo2 = result
+        self.bpm = bpm if valid_bpm else 0
+        self.spo2 = spo2 if valid_spo2 else -999
 
-        # shutdown on exit
-        try:
-            sensor.shutdown()
-        except:
-            pass
+        if self.print_result:
+            print(f"BPM: {self.bpm:.1f} | SpO2: {spo2}")
+        self._notify()
 
     # ---------------------------------------------------------
     def start_sensor(self):
@@ -117,6 +204,11 @@ class HeartRateMonitor(object):
         self._thread.stopped = False
         self._thread.start()
 
+    # ---------------------------------------------------------
+    @property
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
     # ---------------------------------------------------------
     def stop_sensor(self, timeout=2.0):
         if not self._thread:
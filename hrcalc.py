@@ -193,3 +193,428 @@ def remove_close_peaks(n_peaks, ir_valley_locs, x, min_dist):
     sorted_indices[:n_peaks] = sorted(sorted_indices[:n_peaks])
 
     return sorted_indices, n_peaks
+
+
+# ---------------------------------------------------------
+# vectorized engine
+# ---------------------------------------------------------
+
+def calc_hr_and_spo2_np(ir_data, red_data, exact=True):
+    """
+    NumPy version of calc_hr_and_spo2.
+    With exact=True the integer truncation of the Maxim port is kept and the
+    results are identical to calc_hr_and_spo2. With exact=False the moving
+    average and the AC interpolation are done in floating point.
+    """
+    ir = np.asarray(ir_data)
+    red = np.asarray(red_data)
+
+    ir_mean = int(np.mean(ir))
+    x = -1 * (ir - ir_mean)
+
+    # 4 point moving average, the last MA_SIZE samples are left untouched
+    n_ma = x.shape[0] - MA_SIZE
+    if n_ma > 0:
+        ma = np.convolve(x, np.ones(MA_SIZE, dtype=x.dtype), mode="valid")[:n_ma] / MA_SIZE
+        if exact:
+            x = x.copy()
+            x[:n_ma] = ma  # truncates toward zero like the element-wise loop
+        else:
+            x = x.astype(np.float64)
+            x[:n_ma] = ma
+
+    n_th = int(np.mean(x))
+    n_th = min(max(n_th, 30), 60)
+
+    # a walk over a 100 item list beats find_peaks_np: at most 15 peaks,
+    # the per-call overhead of the array operations outweighs the loop
+    ir_valley_locs, n_peaks = find_peaks(x.tolist(), BUFFER_SIZE, n_th, 4, 15)
+    ir_valley_locs = np.array(ir_valley_locs[:n_peaks], dtype=np.int64)
+
+    if n_peaks >= 2:
+        peak_interval_sum = int((ir_valley_locs[-1] - ir_valley_locs[0]) / (n_peaks - 1))
+        hr = int(SAMPLE_FREQ * 60 / peak_interval_sum)
+        hr_valid = True
+    else:
+        hr = -999
+        hr_valid = False
+
+    if np.any(ir_valley_locs > BUFFER_SIZE):
+        return hr, hr_valid, -999, False
+
+    ratio = _spo2_ratios_np(ir, red, ir_valley_locs, exact)
+
+    ratio = sorted(ratio)
+    i_ratio_count = len(ratio)
+    mid_index = int(i_ratio_count / 2)
+
+    ratio_ave = 0
+    if mid_index > 1:
+        ratio_ave = int((ratio[mid_index-1] + ratio[mid_index])/2)
+    else:
+        if len(ratio) != 0:
+            ratio_ave = ratio[mid_index]
+
+    if ratio_ave > 2 and ratio_ave < 184:
+        spo2 = -45.060 * (ratio_ave**2) / 10000.0 + 30.054 * ratio_ave / 100.0 + 94.845
+        spo2_valid = True
+    else:
+        spo2 = -999
+        spo2_valid = False
+
+    return hr, hr_valid, spo2, spo2_valid
+
+
+def _spo2_ratios_np(ir, red, valley_locs, exact=True):
+    """
+    Compute the AC/DC ratio of every beat between two valleys at once.
+    Returns at most 5 ratios as python ints, in beat order.
+    """
+    if valley_locs.shape[0] < 2:
+        return []
+
+    start = valley_locs[:-1]
+    end = valley_locs[1:]
+    keep = (end - start) > 3
+    start = start[keep]
+    end = end[keep]
+    if start.shape[0] == 0:
+        return []
+
+    # mask every sample outside [start, end) of each beat, then take the
+    # row-wise argmax (first occurrence, like the strict ">" of the loop)
+    idx = np.arange(ir.shape[0])
+    inside = (idx >= start[:, None]) & (idx < end[:, None])
+    ir_rows = np.where(inside, ir, np.iinfo(np.int64).min)
+    red_rows = np.where(inside, red, np.iinfo(np.int64).min)
+    ir_dc_max_index = np.argmax(ir_rows, axis=1)
+    red_dc_max_index = np.argmax(red_rows, axis=1)
+    ir_dc_max = ir[ir_dc_max_index].astype(np.int64)
+    red_dc_max = red[red_dc_max_index].astype(np.int64)
+
+    width = end - start
+    red_ac = _linear_ac(red, start, end, width, red_dc_max_index, exact)
+    ir_ac = _linear_ac(ir, start, end, width, ir_dc_max_index, exact)
+
+    nume = red_ac * ir_dc_max
+    denom = ir_ac * red_dc_max
+    valid = (denom > 0) & (nume != 0)
+    nume = nume[valid][:5]
+    denom = denom[valid][:5]
+
+    # same 32-bit overflow emulation as the reference implementation
+    ratio = np.trunc(((nume * 100).astype(np.int64) & 0xffffffff) / denom)
+    return [int(r) for r in ratio]
+
+
+def _linear_ac(data, start, end, width, max_index, exact):
+    """
+    Subtract the straight line between two valleys from the maximum in between.
+    """
+    data = np.asarray(data, dtype=np.int64)
+    rise = (data[end] - data[start]) * (max_index - start)
+    if exact:
+        dc = data[start] + np.trunc(rise / width).astype(np.int64)
+        return data[max_index] - dc
+    return data[max_index] - (data[start] + rise / width)
+
+
+def find_peaks_np(x, size, min_height, min_dist, max_num):
+    """
+    NumPy version of find_peaks, returns the same peak locations. Slower
+    than find_peaks on a list at BUFFER_SIZE, calc_hr_and_spo2_np does
+    not use it.
+    """
+    ir_valley_locs, n_peaks = find_peaks_above_min_height_np(x, size, min_height, max_num)
+    ir_valley_locs, n_peaks = remove_close_peaks_np(n_peaks, ir_valley_locs, x, min_dist)
+
+    n_peaks = min([n_peaks, max_num])
+
+    return ir_valley_locs, n_peaks
+
+
+def find_peaks_above_min_height_np(x, size, min_height, max_num):
+    """
+    Find all peaks above MIN_HEIGHT without walking the signal.
+    """
+    x = np.asarray(x)
+    if size < 2:
+        return np.zeros(0, dtype=np.int64), 0
+
+    y = x[:size]
+    # left edge: above threshold and rising, x[-1] wraps around like the loop
+    prev = np.roll(x, 1)[:size - 1]
+    edges = np.flatnonzero((y[:-1] > min_height) & (y[:-1] > prev))
+
+    # right edge: first following sample with a different value, capped at size - 1
+    changes = np.flatnonzero(y[1:] != y[:-1])
+    pos = np.searchsorted(changes, edges)
+    right = np.full(edges.shape[0], size - 1, dtype=np.int64)
+    has_change = pos < changes.shape[0]
+    right[has_change] = np.minimum(changes[pos[has_change]] + 1, size - 1)
+
+    ir_valley_locs = edges[y[edges] > y[right]][:max_num].astype(np.int64)
+    return ir_valley_locs, int(ir_valley_locs.shape[0])
+
+
+def remove_close_peaks_np(n_peaks, ir_valley_locs, x, min_dist):
+    """
+    Remove peaks separated by less than MIN_DISTANCE, largest peaks win.
+    """
+    locs = np.asarray(ir_valley_locs[:n_peaks], dtype=np.int64)
+    x = np.asarray(x)
+
+    # stable ascending sort then reverse, same order as sorted(...).reverse()
+    locs = locs[np.argsort(x[locs], kind="stable")][::-1]
+    # lag-zero peak of autocorr is at index -1
+    locs = locs[locs + 1 > min_dist]
+
+    i = 0
+    while i < locs.shape[0]:
+        rest = locs[i+1:]
+        locs = np.concatenate((locs[:i+1], rest[np.abs(rest - locs[i]) > min_dist]))
+        i += 1
+
+    locs = np.sort(locs)
+    return locs, int(locs.shape[0])
+
+
+# engines selectable by name, e.g. HeartRateMonitor(engine="numpy")
+ENGINES = {
+    "python": calc_hr_and_spo2,
+    "numpy": calc_hr_and_spo2_np,
+    "numpy-float": lambda ir_data, red_data: calc_hr_and_spo2_np(ir_data, red_data, exact=False),
+}
+
+
+def get_engine(name):
+    """
+    Return the calc_hr_and_spo2 implementation registered as NAME.
+    """
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError("unknown hrcalc engine: {0}".format(name))
+
+
+# ---------------------------------------------------------
+# streaming engine
+# ---------------------------------------------------------
+
+class StreamingEstimator(object):
+    """
+    Incremental HR/SpO2 estimator fed one sample at a time.
+
+    It keeps fixed-size ring buffers of the last BUFFER_SIZE samples and
+    running sums for the DC mean and the 4 point moving average, detects
+    valleys as the samples arrive, and only does per-beat work (max search,
+    AC/DC ratio) when a new beat is confirmed.
+    """
+
+    MAX_PEAKS = 15
+    MIN_DIST = 4
+    MAX_RATIOS = 5
+
+    def __init__(self, size=BUFFER_SIZE):
+        self.size = size
+        self.ir = np.zeros(size, dtype=np.int64)
+        self.red = np.zeros(size, dtype=np.int64)
+        self.ma = np.zeros(size, dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget every sample, e.g. after the finger was removed.
+        """
+        self.count = 0  # total number of samples seen
+        self._ir_sum = 0
+        self._red_sum = 0
+        self._ma_window_sum = 0
+        self._ma_sum = 0.0
+        self._ma_count = 0
+        self._ma_prev = None
+        self._candidate = None  # (index, ma value) of a potential valley
+        self._valleys = np.full(self.MAX_PEAKS, -1, dtype=np.int64)
+        self._n_valleys = 0
+        self._ratios = np.zeros(self.MAX_RATIOS, dtype=np.int64)
+        self._ratio_ends = np.zeros(self.MAX_RATIOS, dtype=np.int64)  # end valley of each ratio
+        self._n_ratios = 0
+        self.hr = -999
+        self.hr_valid = False
+        self.spo2 = -999
+        self.spo2_valid = False
+
+    @property
+    def full(self):
+        return self.count >= self.size
+
+    @property
+    def mean_ir(self):
+        return self._ir_sum / min(self.count, self.size) if self.count else 0.0
+
+    @property
+    def mean_red(self):
+        return self._red_sum / min(self.count, self.size) if self.count else 0.0
+
+    def update(self, ir, red):
+        """
+        Add one sample. Returns (hr, hr_valid, spo2, spo2_valid) when the
+        sample confirmed a new beat, None otherwise.
+        """
+        n = self.count
+        pos = n % self.size
+        if n >= self.size:
+            self._ir_sum -= int(self.ir[pos])
+            self._red_sum -= int(self.red[pos])
+        self.ir[pos] = ir
+        self.red[pos] = red
+        self._ir_sum += ir
+        self._red_sum += red
+        self._ma_window_sum += ir
+        if n >= MA_SIZE:
+            self._ma_window_sum -= int(self.ir[(n - MA_SIZE) % self.size])
+        self.count = n + 1
+
+        # the moving average of sample i needs samples i..i+MA_SIZE-1
+        if self.count < MA_SIZE:
+            return None
+        i = self.count - MA_SIZE
+        ma = self._ma_window_sum / MA_SIZE
+
+        ma_pos = i % self.size
+        if self._ma_count >= self.size:
+            self._ma_sum -= self.ma[ma_pos]
+        else:
+            self._ma_count += 1
+        self.ma[ma_pos] = ma
+        self._ma_sum += ma
+
+        return self._detect(i, ma)
+
+    def extend(self, ir_data, red_data):
+        """
+        Add several samples, returns the result of the last confirmed beat or None.
+        """
+        result = None
+        for ir, red in zip(ir_data, red_data):
+            beat = self.update(int(ir), int(red))
+            if beat is not None:
+                result = beat
+        return result
+
+    def _detect(self, i, ma):
+        # signal is inverted, so a valley of IR is a falling moving average
+        prev = self._ma_prev
+        self._ma_prev = ma
+        if prev is None:
+            return None
+
+        mean_ir = self.mean_ir
+        # threshold on the inverted, DC removed signal, like calc_hr_and_spo2
+        n_th = int(mean_ir - self._ma_sum / self._ma_count)
+        n_th = min(max(n_th, 30), 60)
+
+        if ma < prev:
+            if mean_ir - ma > n_th:
+                self._candidate = (i, ma)
+            else:
+                self._candidate = None
+        elif ma > prev and self._candidate is not None:
+            loc, value = self._candidate
+            self._candidate = None
+            return self._add_valley(loc, value)
+        return None
+
+    def _add_valley(self, loc, value):
+        # drop valleys that left the window
+        valleys = self._valleys[:self._n_valleys]
+        oldest = self.count - self.size
+        keep = valleys[valleys >= oldest]
+        n = keep.shape[0]
+        self._valleys[:n] = keep
+        self._n_valleys = n
+        # and the ratios that ended on them
+        self._drop_ratios(self._ratio_ends[:self._n_ratios] >= oldest)
+
+        if n > 0 and loc - self._valleys[n - 1] <= self.MIN_DIST:
+            # too close to the last valley: the deeper one wins
+            last = self._valleys[n - 1]
+            if value >= self.ma[last % self.size]:
+                return None
+            self._n_valleys = n = n - 1
+            # the ratio that ended on it, if that pair gave one
+            self._drop_ratios(self._ratio_ends[:self._n_ratios] != last)
+
+        if n == self.MAX_PEAKS:
+            self._valleys[:-1] = self._valleys[1:]
+            n -= 1
+        self._valleys[n] = loc
+        self._n_valleys = n + 1
+
+        if self._n_valleys >= 2:
+            self._add_ratio(self._valleys[n - 1], loc)
+        return self._result()
+
+    def _add_ratio(self, start, end):
+        if end - start <= 3:
+            return
+        idx = np.arange(start, end) % self.size
+        ir = self.ir[idx]
+        red = self.red[idx]
+        ir_max_index = int(np.argmax(ir))
+        red_max_index = int(np.argmax(red))
+        ir_dc_max = int(ir[ir_max_index])
+        red_dc_max = int(red[red_max_index])
+        width = end - start
+
+        ir_start, ir_end = int(ir[0]), int(self.ir[end % self.size])
+        red_start, red_end = int(red[0]), int(self.red[end % self.size])
+        red_ac = red_dc_max - (red_start + int((red_end - red_start) * red_max_index / width))
+        ir_ac = ir_dc_max - (ir_start + int((ir_end - ir_start) * ir_max_index / width))
+
+        nume = red_ac * ir_dc_max
+        denom = ir_ac * red_dc_max
+        if denom > 0 and nume != 0:
+            # same 32-bit overflow emulation as calc_hr_and_spo2
+            ratio = int(((nume * 100) & 0xffffffff) / denom)
+            if self._n_ratios == self.MAX_RATIOS:
+                self._ratios[:-1] = self._ratios[1:]
+                self._ratio_ends[:-1] = self._ratio_ends[1:]
+                self._n_ratios -= 1
+            self._ratios[self._n_ratios] = ratio
+            self._ratio_ends[self._n_ratios] = end
+            self._n_ratios += 1
+
+    def _drop_ratios(self, keep):
+        n = int(np.count_nonzero(keep))
+        if n < self._n_ratios:
+            self._ratios[:n] = self._ratios[:self._n_ratios][keep]
+            self._ratio_ends[:n] = self._ratio_ends[:self._n_ratios][keep]
+            self._n_ratios = n
+
+    def _result(self):
+        n = self._n_valleys
+        if n >= 2:
+            interval = int((self._valleys[n - 1] - self._valleys[0]) / (n - 1))
+            self.hr = int(SAMPLE_FREQ * 60 / interval)
+            self.hr_valid = True
+        else:
+            self.hr = -999
+            self.hr_valid = False
+
+        ratio = sorted(int(r) for r in self._ratios[:self._n_ratios])
+        mid_index = int(len(ratio) / 2)
+        ratio_ave = 0
+        if mid_index > 1:
+            ratio_ave = int((ratio[mid_index-1] + ratio[mid_index])/2)
+        elif ratio:
+            ratio_ave = ratio[mid_index]
+
+        if ratio_ave > 2 and ratio_ave < 184:
+            self.spo2 = -45.060 * (ratio_ave**2) / 10000.0 + 30.054 * ratio_ave / 100.0 + 94.845
+            self.spo2_valid = True
+        else:
+            self.spo2 = -999
+            self.spo2_valid = False
+
+        return self.hr, self.hr_valid, self.spo2, self.spo2_valid
@@ -0,0 +1,292 @@
+"""
+Shared I2C bus manager.
+
+One BusManager owns the bus (smbus.SMBus or sim_i2c.SimBus) and every
+driver talks to it through its own BusClient, which has the same methods
+as smbus.SMBus. Transactions from all threads are serialized; when
+several are waiting, the client with the best (lowest) priority goes
+first, and a client with a pending alert goes before everyone.
+
+    manager = shared_bus(1)
+    lidar = TfLunaI2C(i2cbus=manager.client("tfluna", PRIORITY_LIDAR))
+    sensor = MAX30102(bus=manager.client("max30102", PRIORITY_HR))
+
+Per client it records transactions, errors, time spent on the bus and
+time spent waiting for it, and with metrics enabled a histogram of
+both per client (i2c.NAME.bus_us, i2c.NAME.wait_us).
+"""
+import heapq
+import itertools
+import threading
+import time
+
+import metrics
+
+# lower goes first
+PRIORITY_ALERT = 0
+PRIORITY_LIDAR = 10
+PRIORITY_IMU = 20
+PRIORITY_HR = 30  # the MAX30102 FIFO holds 1.3 s of samples, it can wait
+
+# SMBus block transfer limit
+BLOCK_MAX = 32
+
+
+class ClientStats(object):
+    def __init__(self):
+        self.transactions = 0
+        self.errors = 0
+        self.bus_time = 0.0
+        self.wait_time = 0.0
+        self.wait_max = 0.0
+
+    def as_dict(self):
+        n = max(self.transactions, 1)
+        return {
+            "transactions": self.transactions,
+            "errors": self.errors,
+            "bus_ms": self.bus_time * 1e3,
+            "wait_ms": self.wait_time * 1e3,
+            "wait_mean_us": self.wait_time / n * 1e6,
+            "wait_max_us": self.wait_max * 1e6,
+        }
+
+
+class BusManager(object):
+    """
+    Serializes and prioritizes access to one I2C bus.
+    """
+
+    def __init__(self, bus, clock=time.perf_counter):
+        self.bus = bus
+        self.clock = clock
+        self.clients = {}
+        self._lock = threading.Lock()
+        self._busy = False
+        self._waiters = []  # heap of (priority, seq, event)
+        self._seq = itertools.count()
+
+    def client(self, name, priority=PRIORITY_HR):
+        """
+        SMBus-like handle for one driver. The same NAME gives the same client.
+        """
+        if name not in self.clients:
+            self.clients[name] = BusClient(self, name, priority)
+        return self.clients[name]
+
+    def acquire(self, client):
+        start = self.clock()
+        event = None
+        with self._lock:
+            if not self._busy:
+                self._busy = True
+            else:
+                event = threading.Event()
+                heapq.heappush(self._waiters, (client.effective_priority, next(self._seq), event))
+        if event is not None:
+            # the releasing thread hands the bus over directly
+            event.wait()
+        waited = self.clock() - start
+        client.stats.wait_time += waited
+        client.stats.wait_max = max(client.stats.wait_max, waited)
+        if metrics.enabled:
+            client.wait_us.observe(waited * 1e6)
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                _, _, event = heapq.heappop(self._waiters)
+                event.set()
+            else:
+                self._busy = False
+
+    def transaction(self, client, method, *args):
+        """
+        Run one bus METHOD for CLIENT while holding the bus.
+        """
+        self.acquire(client)
+        start = self.clock()
+        try:
+            return getattr(self.bus, method)(*args)
+        except OSError:
+            client.stats.errors += 1
+            if metrics.enabled:
+                client.errors.inc()
+            raise
+        finally:
+            duration = self.clock() - start
+            client.stats.bus_time += duration
+            client.stats.transactions += 1
+            if metrics.enabled:
+                client.bus_us.observe(duration * 1e6)
+            self.release()
+
+    def report(self):
+        return {name: client.stats.as_dict() for name, client in self.clients.items()}
+
+    def close(self):
+        self.bus.close()
+
+
+def _forward(method):
+    def call(self, *args):
+        return self.manager.transaction(self, method, *args)
+    call.__name__ = method
+    return call
+
+
+class BusClient(object):
+    """
+    What a driver gets instead of smbus.SMBus.
+    """
+
+    def __init__(self, manager, name, priority):
+        self.manager = manager
+        self.name = name
+        self.priority = priority
+        # set while the device has something urgent (e.g. an obstacle)
+        self.alert = False
+        self.stats = ClientStats()
+        self.bus_us = metrics.histogram(f"i2c.{name}.bus_us")
+        self.wait_us = metrics.histogram(f"i2c.{name}.wait_us")
+        self.errors = metrics.counter(f"i2c.{name}.errors")
+
+    @property
+    def effective_priority(self):
+        return PRIORITY_ALERT if self.alert else self.priority
+
+    read_byte = _forward("read_byte")
+    write_byte = _forward("write_byte")
+    write_quick = _forward("write_quick")
+    read_byte_data = _forward("read_byte_data")
+    write_byte_data = _forward("write_byte_data")
+    read_word_data = _forward("read_word_data")
+    write_word_data = _forward("write_word_data")
+    read_i2c_block_data = _forward("read_i2c_block_data")
+    write_i2c_block_data = _forward("write_i2c_block_data")
+
+    def read_batch(self, address, ranges):
+        """
+        Read several (register, length) ranges. Adjacent or overlapping
+        ranges are merged into block reads of at most BLOCK_MAX bytes and all of
+        them run in one bus hold. Only for auto-incrementing registers
+        (not FIFO data registers). Returns one list of bytes per range.
+        """
+        blocks = merge_ranges(ranges)
+        self.manager.acquire(self)
+        start = self.manager.clock()
+        data = {}
+        try:
+            for register, length in blocks:
+                values = self.manager.bus.read_i2c_block_data(address, register, length)
+                self.stats.transactions += 1
+                for i, value in enumerate(values):
+                    data[register + i] = value
+        except OSError:
+            self.stats.errors += 1
+            if metrics.enabled:
+                self.errors.inc()
+            raise
+        finally:
+            duration = self.manager.clock() - start
+            self.stats.bus_time += duration
+            if metrics.enabled:
+                self.bus_us.observe(duration * 1e6)
+            self.manager.release()
+        return [[data[r] for r in range(register, register + length)]
+                for register, length in ranges]
+
+    def close(self):
+        pass
+
+
+def merge_ranges(ranges, block_max=BLOCK_MAX):
+    """
+    Merge (register, length) ranges that touch or overlap into as few
+    block reads as possible, none longer than BLOCK_MAX: a merged span
+    longer than that is split at every BLOCK_MAX bytes.
+    """
+    spans = []
+    for register, length in sorted(ranges):
+        if spans and register <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], register + length)
+        else:
+            spans.append([register, register + length])
+    return [(register, min(block_max, end - register))
+            for start, end in spans
+            for register in range(start, end, block_max)]
+
+
+class BusioAdapter(object):
+    """
+    busio.I2C look-alike on a BusClient, so Adafruit drivers
+    (adafruit_mpu6050) share the managed bus:
+
+        mpu = adafruit_mpu6050.MPU6050(BusioAdapter(manager.client("mpu6050", PRIORITY_IMU)))
+
+    Register access (write the register, then read) maps to SMBus block
+    transfers.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._lock = threading.Lock()
+
+    def try_lock(self):
+        return self._lock.acquire(False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def scan(self):
+        return []
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        data = bytes(buffer[start:end])
+        if not data:
+            self.client.write_quick(address)
+        elif len(data) == 1:
+            self.client.write_byte(address, data[0])
+        else:
+            self.client.write_i2c_block_data(address, data[0], list(data[1:]))
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        for i in range(start, end):
+            buffer[i] = self.client.read_byte(address)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *, out_start=0,
+                              out_end=None, in_start=0, in_end=None):
+        register = bytes(buffer_out[out_start:out_end])
+        in_end = len(buffer_in) if in_end is None else in_end
+        length = in_end - in_start
+        if len(register) != 1:
+            raise OSError(22, "only single byte register addresses are supported")
+        values = self.client.read_i2c_block_data(address, register[0], length)
+        buffer_in[in_start:in_end] = bytes(values)
+
+    def deinit(self):
+        pass
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_bus(channel=1):
+    """
+    The process-wide BusManager for an I2C channel, opened on first use.
+    """
+    with _shared_lock:
+        if channel not in _shared:
+            import smbus
+            _shared[channel] = BusManager(smbus.SMBus(channel))
+        return _shared[channel]
+
+
+def open_buses():
+    """
+    The BusManagers shared_bus() has opened so far.
+    """
+    with _shared_lock:
+        return list(_shared.values())
@@ -1,14 +1,145 @@
+import collections
 import serial
 import struct
 import time
 
-ser = serial.Serial('/dev/serial0',115200,timeout=1)
+FRAME_SIZE = 9
+HEADER = b'YY'
+# distance (cm), strength, temperature after the header
+PAYLOAD = struct.Struct('<HHH')
 
-while True:
+Frame = collections.namedtuple('Frame', 'distance strength temp')
+
+
+def checksum_ok(buf, pos):
+    """
+    Low byte of the sum of the first 8 bytes must match the 9th.
+    """
+    return sum(buf[pos:pos + 8]) & 0xFF == buf[pos + 8]
+
+
+def read_frame(ser):
+    """
+    Read one TF-Luna UART frame, returns (distance, strength) or None
+    if the header was not found or the checksum is wrong.
+    Byte at a time, LidarUart is the fast reader.
+    """
     if ser.read() == b'Y' and ser.read() == b'Y':
         frame=ser.read(7)
-        if len(frame) == 7:
+        if len(frame) == 7 and (0xB2 + sum(frame[:6])) & 0xFF == frame[6]:  # 0xB2 = 'Y' + 'Y'
             distance = frame[0] + frame[1]*256
             strength = frame[2] + frame[3]*256
-            print(f"Distance: {distance} cm | Strength: {strength}")
-    time.sleep(0.05)
\ No newline at end of file
+            return distance, strength
+    return None
+
+
+class FrameParser(object):
+    """
+    Finds checksummed 9-byte frames in a stream of bytes.
+
+    feed() appends whatever the port returned to one bytearray and
+    frames are decoded in place (memoryview slices and unpack_from,
+    no copies). A bad header or checksum costs one byte: the search for
+    the next 'YY' starts right after it, so sync comes back after
+    corrupted or dropped bytes.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.frames = 0
+        self.bad_checksums = 0
+        self.skipped_bytes = 0
+
+    def _frame(self, view, pos):
+        distance, strength, temp = PAYLOAD.unpack_from(view, pos + 2)
+        return Frame(distance, strength, temp / 8.0 - 256)
+
+    def feed(self, data):
+        """
+        Add DATA, return every complete valid frame in it, oldest first.
+        """
+        buf = self.buffer
+        buf += data
+        frames = []
+        pos = 0
+        last = len(buf) - FRAME_SIZE  # last offset a whole frame fits at
+        with memoryview(buf) as view:
+            while pos <= last:
+                start = buf.find(HEADER, pos, last + 2)
+                if start < 0:
+                    break
+                if checksum_ok(view, start):
+                    frames.append(self._frame(view, start))
+                    self.skipped_bytes += start - pos
+                    pos = start + FRAME_SIZE
+                else:
+                    self.bad_checksums += 1
+                    self.skipped_bytes += start + 1 - pos
+                    pos = start + 1
+        # no frame can start before LAST + 1 any more, the tail may be one
+        drop = max(pos, last + 1)
+        self.skipped_bytes += drop - pos
+        del buf[:drop]
+        self.frames += len(frames)
+        return frames
+
+    def feed_newest(self, data):
+        """
+        Add DATA, return only the newest valid frame (or None). Searches
+        backwards from the end of the buffer, so a backlog costs the same
+        as one frame. Everything older is dropped.
+        """
+        buf = self.buffer
+        buf += data
+        newest = None
+        last = len(buf) - FRAME_SIZE
+        start = buf.rfind(HEADER, 0, last + 2) if last >= 0 else -1
+        with memoryview(buf) as view:
+            while start >= 0:
+                if checksum_ok(view, start):
+                    newest = self._frame(view, start)
+                    break
+                self.bad_checksums += 1
+                start = buf.rfind(HEADER, 0, start + 1)
+        if newest is None:
+            drop = max(last + 1, 0)
+        else:
+            drop = start + FRAME_SIZE
+            self.frames += 1
+        del buf[:drop]
+        return newest
+
+
+class LidarUart(object):
+    """
+    TF-Luna on a serial port, read in bulk.
+
+    mode="newest": read() returns the latest Frame or None.
+    mode="every":  read() returns the list of every Frame received.
+    """
+
+    def __init__(self, ser, mode="newest"):
+        if mode not in ("newest", "every"):
+            raise ValueError("mode must be 'newest' or 'every', not {0!r}".format(mode))
+        self.ser = ser
+        self.mode = mode
+        self.parser = FrameParser()
+
+    def read(self):
+        waiting = self.ser.in_waiting
+        # nothing queued: block for one frame (up to the port timeout)
+        data = self.ser.read(waiting if waiting else FRAME_SIZE)
+        if self.mode == "newest":
+            return self.parser.feed_newest(data)
+        return self.parser.feed(data)
+
+
+if __name__ == "__main__":
+    ser = serial.Serial('/dev/serial0',115200,timeout=1)
+    uart = LidarUart(ser)
+
+    while True:
+        frame = uart.read()
+        if frame is not None:
+            print(f"Distance: {frame.distance} cm | Strength: {frame.strength}")
+        time.sleep(0.05)
@@ -0,0 +1,216 @@
+"""
+Load generator for the BluetoothSender streaming path, no radio needed.
+
+Runs a sender on a TCP or Unix socket transport, feeds it synthetic
+packets at --rate and connects --clients readers that decode the stream
+and measure what arrives:
+
+    python loadgen.py --listen tcp://127.0.0.1:0 --clients 3 --rate 100
+    python loadgen.py --listen unix:///tmp/load.sock --rate 0 --binary
+
+--rate 0 offers packets as fast as the sender drains its queues
+(sustained throughput). With --connect the readers attach to a sender that is
+already running, e.g. the device over Wi-Fi:
+
+    python loadgen.py --connect tcp://pathpal.local:8765 --seconds 30
+
+Latency is end to end, from send_data() to the reader decoding the
+packet, for JSON streams from the built-in sender (packets carry a
+wall-clock "t"). Otherwise (binary frames, or someone else's sender)
+it is the latency above the fastest packet seen, from the frame
+timestamps.
+"""
+import argparse
+import json
+import threading
+import time
+
+import transport
+import wire
+
+
+def synthetic_packet(i):
+    return {
+        "bpm": 72,
+        "dist_cm": 150 + i % 50,
+        "accel": [0.12, -0.05, 9.81],
+        "gyro": [0.012, -0.003, 0.057],
+        "gps": {"lat": 45.4215296, "lon": -75.6971931, "speed": 1.28, "age_ms": 40},
+        "t": time.time(),
+    }
+
+
+class LoadClient(object):
+    """
+    One reader: connects, optionally asks for binary frames, decodes
+    everything in a thread and keeps counters and latencies.
+    """
+
+    def __init__(self, link, binary=False):
+        self.sock = link.connect()
+        self.binary = binary
+        self.packets = 0
+        self.bytes = 0
+        self.errors = 0
+        self.latency = []   # seconds, end to end
+        self.offsets = []   # receive time - frame timestamp, binary
+        self.first = self.last = None
+        self.running = True
+        if binary:
+            self.sock.sendall(wire.hello((wire.BINARY,)))
+        self.thread = threading.Thread(target=self._loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _loop(self):
+        self.sock.settimeout(0.2)
+        rest = b""
+        framed = False  # after the sender's {"proto": "bin1"} reply
+        while self.running:
+            try:
+                data = self.sock.recv(65536)
+            except OSError as e:
+                if "timed out" in str(e):
+                    continue
+                break
+            if not data:
+                break
+            now = time.time()
+            self.bytes += len(data)
+            rest += data
+            while not framed and b"\n" in rest:
+                line, rest = rest.split(b"\n", 1)
+                if line.startswith(b'{"proto"'):
+                    framed = json.loads(line)["proto"] == wire.BINARY
+                    continue
+                self._json(line, now)
+            if framed:
+                # damaged frames are skipped, the stream resyncs on its own
+                frames, rest = wire.split_frames(rest)
+                for frame in frames:
+                    self._frame(frame, now)
+
+    def _count(self, now):
+        self.packets += 1
+        if self.first is None:
+            self.first = now
+        self.last = now
+
+    def _json(self, line, now):
+        try:
+            packet = json.loads(line)
+        except ValueError:
+            self.errors += 1
+            return
+        if "proto" in packet:
+            return
+        self._count(now)
+        if "t" in packet and "backlog_ms" not in packet:
+            self.latency.append(now - packet["t"])
+
+    def _frame(self, frame, now):
+        try:
+            packet = wire.decode(frame)
+        except wire.WireError:
+            self.errors += 1
+            return
+        self._count(now)
+        if not packet["backlog"]:
+            self.offsets.append(now - packet["t_ms"] / 1000.0)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+    def results(self):
+        seconds = (self.last - self.first) if self.packets > 1 else 0.0
+        latency = sorted(self.latency)
+        if not latency and self.offsets:
+            best = min(self.offsets)
+            latency = sorted(offset - best for offset in self.offsets)
+        latency = latency or [0.0]
+        return {
+            "packets": self.packets,
+            "errors": self.errors,
+            "packets_per_s": self.packets / seconds if seconds else 0.0,
+            "bytes_per_s": self.bytes / seconds if seconds else 0.0,
+            "latency_p50_ms": latency[len(latency) // 2] * 1e3,
+            "latency_p99_ms": latency[int(len(latency) * 0.99)] * 1e3,
+            "latency_max_ms": latency[-1] * 1e3,
+            "end_to_end": bool(self.latency),
+        }
+
+
+def run(url, clients=2, rate=100.0, seconds=5.0, binary=False, connect=False):
+    """
+    Stream for SECONDS and return the sender's stats (None with CONNECT)
+    and one results() dict per client.
+    """
+    from bt_sender import BluetoothSender
+
+    link = transport.from_url(url)
+    bt = None
+    if not connect:
+        bt = BluetoothSender(transports=[link])
+        bt.start()
+        while not bt.server_socks:
+            time.sleep(0.001)
+    readers = [LoadClient(link, binary) for _ in range(clients)]
+    if bt is not None:
+        while len(bt.clients) < clients:
+            time.sleep(0.001)
+    # let the hello go through before timing
+    time.sleep(0.05)
+
+    start = time.monotonic()
+    i = 0
+    while time.monotonic() - start < seconds:
+        if bt is None:
+            time.sleep(0.1)
+            continue
+        bt.send_data(synthetic_packet(i))
+        i += 1
+        if rate:
+            time.sleep(max(start + i / rate - time.monotonic(), 0))
+        elif any(len(client.pending) >= bt.max_pending // 2 for client in bt.clients):
+            # saturating: back off while the queues are half full so the
+            # sender thread gets the CPU instead of dropping everything
+            time.sleep(0.0005)
+    time.sleep(0.2)
+
+    stats = None
+    if bt is not None:
+        stats = bt.stats()
+        stats["offered_per_s"] = i / seconds
+        bt.stop()
+    for reader in readers:
+        reader.stop()
+    return stats, [reader.results() for reader in readers]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PathPal stream load generator")
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument("--listen", default="tcp://127.0.0.1:0",
+                       help="run a sender on this transport url (default %(default)s)")
+    where.add_argument("--connect", metavar="URL", help="read from a sender already running at URL")
+    parser.add_argument("--clients", type=int, default=2)
+    parser.add_argument("--rate", type=float, default=100.0, help="packets/s offered, 0 = as fast as possible")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--binary", action="store_true", help="ask for binary frames")
+    args = parser.parse_args()
+
+    stats, results = run(args.connect or args.listen, args.clients, args.rate, args.seconds,
+                         args.binary, connect=args.connect is not None)
+    if stats is not None:
+        print(f"[LOAD] sender: offered {stats['offered_per_s']:.0f}/s")
+        for client in stats["per_client"]:
+            print(f"[LOAD]   {client['address']}: sent {client['packets_sent']} "
+                  f"dropped {client['packets_dropped']} decimate {client['decimate']}")
+    for n, result in enumerate(results):
+        kind = "end-to-end" if result["end_to_end"] else "above min"
+        print(f"[LOAD] client {n}: {result['packets_per_s']:.0f} packets/s, "
+              f"{result['bytes_per_s'] / 1024:.1f} KiB/s, latency ({kind}) "
+              f"p50 {result['latency_p50_ms']:.2f} ms p99 {result['latency_p99_ms']:.2f} ms "
+              f"max {result['latency_max_ms']:.2f} ms, errors {result['errors']}")
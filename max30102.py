@@ -3,6 +3,8 @@
 # this code is currently for python 2.7
 from __future__ import print_function
 from time import sleep
+import time
+import numpy as np
 import smbus
 
 # register addresses
@@ -35,17 +37,44 @@ REG_REV_ID = 0xFE
 REG_PART_ID = 0xFF
 
 
+# FIFO geometry
+FIFO_DEPTH = 32
+# FIFO_A_FULL holds the free slots (0-15): fewest samples A_FULL can wait for
+A_FULL_MIN = FIFO_DEPTH - 0xF
+BYTES_PER_SAMPLE = 6  # 3 bytes red + 3 bytes ir in SpO2 mode
+# SMBus block transfers are limited to 32 bytes, 5 samples fit in one read
+SAMPLES_PER_BLOCK = 32 // BYTES_PER_SAMPLE
+
+# 100 Hz ADC rate with 4x sample averaging (see setup())
+SAMPLE_RATE = 25
+
+# INTR_ENABLE_1 bits
+INTR_A_FULL = 0x80
+INTR_PPG_RDY = 0x40
+
+
+def decode_fifo(data):
+    """
+    Decode raw FIFO bytes (6 per sample) into red and ir arrays.
+    """
+    raw = np.frombuffer(bytes(data), dtype=np.uint8).reshape(-1, 3).astype(np.uint32)
+    values = ((raw[:, 0] << 16) | (raw[:, 1] << 8) | raw[:, 2]) & 0x03FFFF
+    return values[0::2], values[1::2]
+
+
 class MAX30102():
     # by default, this assumes that the device is at 0x57 on channel 1
-    def __init__(self, channel=1, address=0x57):
+    # pass an already opened bus (e.g. a simulated one) to skip smbus
+    def __init__(self, channel=1, address=0x57, bus=None):
         #print("Channel: {0}, address: {1}".format(channel, address))
         self.address = address
         self.channel = channel
-        self.bus = smbus.SMBus(self.channel)
+        self.bus = bus if bus is not None else smbus.SMBus(self.channel)
+        # samples lost to FIFO overflow since the driver was created
+        self.overflow_count = 0
 
         self.reset()
-
-        sleep(1)  # wait 1 sec
+        self.wait_reset()
 
         # read & clear interrupt register (read 1 byte)
         reg_data = self.bus.read_i2c_block_data(self.address, REG_INTR_STATUS_1, 1)
@@ -66,6 +95,17 @@ class MAX30102():
         """
         self.bus.write_i2c_block_data(self.address, REG_MODE_CONFIG, [0x40])
 
+    def wait_reset(self, timeout=1.0):
+        """
+        Poll until the reset bit clears, instead of a fixed 1 s sleep.
+        TIMEOUT is that old worst case.
+        """
+        deadline = time.monotonic() + timeout
+        while self.bus.read_i2c_block_data(self.address, REG_MODE_CONFIG, 1)[0] & 0x40:
+            if time.monotonic() > deadline:
+                raise OSError("MAX30102 reset did not complete")
+            sleep(0.001)
+
     def setup(self, led_mode=0x03):
         """
         This will setup the device with the values written in sample Arduino code.
@@ -137,6 +177,61 @@ class MAX30102():
 
         return red_led, ir_led
 
+    def read_fifo_pointers(self):
+        """
+        Read FIFO_WR_PTR, OVF_COUNTER and FIFO_RD_PTR in one transaction.
+        """
+        write_ptr, ovf, read_ptr = self.bus.read_i2c_block_data(self.address, REG_FIFO_WR_PTR, 3)
+        return write_ptr & 0x1F, ovf & 0x1F, read_ptr & 0x1F
+
+    def clear_interrupts(self):
+        """
+        Read (and so clear) both interrupt status registers in one transaction.
+        Only needed when the INT pin is used, reading the FIFO does not need it.
+        """
+        return self.bus.read_i2c_block_data(self.address, REG_INTR_STATUS_1, 2)
+
+    def read_fifo_burst(self, n):
+        """
+        Read N samples from the FIFO with as few block reads as possible,
+        returns red and ir as numpy arrays.
+        """
+        data = []
+        while n > 0:
+            count = min(n, SAMPLES_PER_BLOCK)
+            data += self.bus.read_i2c_block_data(self.address, REG_FIFO_DATA, count * BYTES_PER_SAMPLE)
+            n -= count
+        return decode_fifo(data)
+
+    def drain(self, clear_interrupts=False):
+        """
+        Read every pending sample, returns red and ir as numpy arrays.
+        """
+        write_ptr, ovf, read_ptr = self.read_fifo_pointers()
+        num_samples = (write_ptr - read_ptr) % FIFO_DEPTH
+        # full FIFO: pointers are equal and the overflow counter runs
+        if num_samples == 0 and ovf > 0:
+            num_samples = FIFO_DEPTH
+        self.overflow_count += ovf
+        if clear_interrupts:
+            self.clear_interrupts()
+        return self.read_fifo_burst(num_samples)
+
+    def set_interrupts(self, a_full=True, ppg_rdy=True):
+        """
+        Choose which FIFO events drive the INT pin.
+        """
+        value = (INTR_A_FULL if a_full else 0) | (INTR_PPG_RDY if ppg_rdy else 0)
+        self.bus.write_i2c_block_data(self.address, REG_INTR_ENABLE_1, [value])
+
+    def set_almost_full(self, samples):
+        """
+        Fire the A_FULL interrupt once SAMPLES (17 to 32) are in the FIFO.
+        Keeps sample avg = 4 and fifo rollover = false as in setup().
+        """
+        samples = min(max(samples, A_FULL_MIN), FIFO_DEPTH)
+        self.bus.write_i2c_block_data(self.address, REG_FIFO_CONFIG, [0x40 | (FIFO_DEPTH - samples)])
+
     def read_sequential(self, amount=100):
         """
         This function will read the red-led and ir-led `amount` times.
@@ -144,15 +239,113 @@ class MAX30102():
         """
         red_buf = []
         ir_buf = []
-        count = amount
-        while count > 0:
-            num_bytes = self.get_data_present()
-            while num_bytes > 0:
-                red, ir = self.read_fifo()
-
-                red_buf.append(red)
-                ir_buf.append(ir)
-                num_bytes -= 1
-                count -= 1
+        poller = FifoPoller(self)
+        while len(ir_buf) < amount:
+            red, ir = poller.read()
+            red_buf.extend(red.tolist())
+            ir_buf.extend(ir.tolist())
 
         return red_buf, ir_buf
+
+
+class GpioInterruptPin(object):
+    """
+    The MAX30102 INT line on a GPIO pin (open drain, active low).
+    Anything with the same is_active / wait_for_active() can replace it.
+    """
+
+    def __init__(self, pin):
+        from gpiozero import DigitalInputDevice
+        self._device = DigitalInputDevice(pin, pull_up=True)
+
+    @property
+    def is_active(self):
+        return self._device.is_active
+
+    def wait_for_active(self, timeout=None):
+        return self._device.wait_for_active(timeout)
+
+    def close(self):
+        self._device.close()
+
+
+class FifoPoller(object):
+    """
+    Wait until about TARGET samples are in the FIFO, then drain it.
+
+    With an interrupt pin the A_FULL interrupt is set to TARGET and the
+    thread sleeps on the INT line. Without one it sleeps for the time the
+    FIFO needs to fill up to TARGET, using the measured sample rate.
+    Overflows (OVF_COUNTER) halve the target so the next read comes sooner;
+    A_FULL follows it down to A_FULL_MIN, below that the wait for the
+    interrupt times out after TARGET samples instead.
+    """
+
+    def __init__(self, sensor, int_pin=None, target=A_FULL_MIN,
+                 sample_rate=SAMPLE_RATE, min_sleep=0.01,
+                 clock=time.monotonic, sleep=sleep):
+        self.sensor = sensor
+        self.int_pin = int_pin
+        self.target = target
+        self.sample_rate = float(sample_rate)
+        self.min_sleep = min_sleep
+        self.clock = clock
+        self.sleep = sleep
+        self.wakeups = 0
+        self.overflows = 0
+        self._last_read = None
+        self._a_full = None  # samples A_FULL is programmed for
+
+        if int_pin is not None:
+            # only A_FULL, PPG_RDY would wake us for every sample
+            self._program_a_full()
+            sensor.set_interrupts(a_full=True, ppg_rdy=False)
+            sensor.clear_interrupts()
+
+    def _program_a_full(self):
+        a_full = min(max(self.target, A_FULL_MIN), FIFO_DEPTH)
+        if a_full != self._a_full:
+            self.sensor.set_almost_full(a_full)
+            self._a_full = a_full
+
+    def wait(self):
+        """
+        Block until the FIFO is expected to hold TARGET samples.
+        """
+        if self.int_pin is not None:
+            if self.target < A_FULL_MIN:
+                # sooner than A_FULL can fire: the timeout wakes us
+                timeout = self.target / self.sample_rate
+            else:
+                # a missed edge still gets the data after the timeout
+                timeout = 2.0 * self.target / self.sample_rate
+            self.int_pin.wait_for_active(timeout)
+            return
+
+        # the FIFO is empty after every drain
+        delay = self.target / self.sample_rate
+        if self._last_read is not None:
+            delay -= self.clock() - self._last_read
+        self.sleep(max(delay, self.min_sleep))
+
+    def read(self):
+        """
+        Wait for data and drain the FIFO, returns red and ir as numpy arrays.
+        """
+        self.wait()
+        self.wakeups += 1
+        overflow_before = self.sensor.overflow_count
+        red, ir = self.sensor.drain(clear_interrupts=self.int_pin is not None)
+        now = self.clock()
+
+        if self.sensor.overflow_count > overflow_before:
+            self.overflows += 1
+            self.target = max(self.target // 2, 1)
+            if self.int_pin is not None:
+                self._program_a_full()
+        elif self._last_read is not None and len(ir) > 0 and self.int_pin is None:
+            # follow the real sample rate of the device (oscillator tolerance)
+            measured = len(ir) / max(now - self._last_read, 1e-3)
+            self.sample_rate += 0.1 * (measured - self.sample_rate)
+        self._last_read = now
+        return red, ir
@@ -0,0 +1,337 @@
+"""
+Runtime metrics: counters, gauges and fixed-bucket histograms shared by
+every subsystem, cheap enough to leave on in the field.
+
+Instruments are created once at import time and looked up by name:
+
+    BUS_US = metrics.histogram("i2c.tfluna.bus_us")
+    ...
+    if metrics.enabled:
+        BUS_US.observe(duration * 1e6)
+
+Every call site checks the module flag first, so with metrics disabled
+(the default, metrics.enable() turns them on) a hot path pays one
+attribute lookup. observe() is a bisect into a tuple and three updates,
+no allocation. Updates from several threads are not locked, a count can
+be lost under contention; that is the price of not taking a lock.
+
+Gauges can be given a function instead of a value; it is only called
+when a snapshot is taken (queue depths, backlog size).
+
+Snapshots come out two ways:
+    MetricsServer("/tmp/pathpal-metrics.sock").start()   # JSON per connection
+    print(reporter.line())                               # one compact line,
+                                                         # histograms since the last line
+
+The socket doubles as a control socket: a client that sends a line
+"NAME ARG..." gets the JSON result of the handler registered with
+command(NAME, fn) instead of a snapshot.
+
+    python metrics.py [--socket PATH]                    # print a snapshot
+    python metrics.py [--socket PATH] profile 30         # run a command
+"""
+import bisect
+import json
+import os
+import socket
+import threading
+
+enabled = False
+
+# upper bounds, 1-2-5 steps; the last bucket counts everything above
+BUCKETS_US = (10, 20, 50, 100, 200, 500, 1e3, 2e3, 5e3, 1e4, 2e4, 5e4, 1e5, 2e5, 5e5, 1e6)
+BUCKETS_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1e3, 2e3, 5e3, 1e4)
+
+SOCKET_PATH = "/tmp/pathpal-metrics.sock"
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+class Counter(object):
+    __slots__ = ("name", "value")
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def snapshot(self):
+        return self.value
+
+    def reset(self):
+        self.value = 0
+
+
+class Gauge(object):
+    __slots__ = ("name", "value", "fn")
+
+    def __init__(self, name, fn=None):
+        self.name = name
+        self.value = None
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        if self.fn is not None:
+            try: return self.fn()
+            except Exception: return None
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class Histogram(object):
+    """
+    Counts per bucket plus count, sum and max. Percentiles are bucket
+    upper bounds: "p99 <= 5000 us".
+    """
+
+    __slots__ = ("name", "bounds", "counts", "count", "total", "max")
+
+    def __init__(self, name, bounds=BUCKETS_US):
+        self.name = name
+        self.bounds = tuple(bounds)
+        self.reset()
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def percentile(self, q, counts=None):
+        counts = counts or self.counts
+        n = sum(counts)
+        if not n:
+            return 0.0
+        rank = q * n
+        seen = 0
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= rank:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": dict(zip([str(b) for b in self.bounds] + ["inf"], self.counts)),
+        }
+
+
+REGISTRY = {}
+_lock = threading.Lock()
+
+
+def _get(kind, name, *args):
+    with _lock:
+        instrument = REGISTRY.get(name)
+        if instrument is None or type(instrument) is not kind:
+            instrument = REGISTRY[name] = kind(name, *args)
+        return instrument
+
+
+def counter(name):
+    return _get(Counter, name)
+
+
+def histogram(name, bounds=BUCKETS_US):
+    return _get(Histogram, name, bounds)
+
+
+def gauge(name, fn=None):
+    g = _get(Gauge, name)
+    if fn is not None:
+        g.fn = fn  # the newest owner reports
+    return g
+
+
+def snapshot():
+    with _lock:
+        instruments = list(REGISTRY.values())
+    return {instrument.name: instrument.snapshot() for instrument in instruments}
+
+
+def reset():
+    with _lock:
+        for instrument in REGISTRY.values():
+            instrument.reset()
+
+
+COMMANDS = {}
+
+
+def command(name, fn):
+    """
+    Let socket clients call FN(*args) with "NAME ARG...".
+    """
+    COMMANDS[name] = fn
+
+
+# ---------------------------------------------------------------
+# LOG LINE
+# ---------------------------------------------------------------
+
+class Reporter(object):
+    """
+    Compact one-line summaries. Histograms cover the time since the
+    previous line: "loop.work_us 200/1000/1733" is p50/p99/max (max over
+    the whole run), counters show their increase.
+    """
+
+    def __init__(self, prefix="[MET]"):
+        self.prefix = prefix
+        self._last = {}
+
+    def line(self):
+        with _lock:
+            instruments = sorted(REGISTRY.values(), key=lambda instrument: instrument.name)
+        parts = []
+        for instrument in instruments:
+            if isinstance(instrument, Histogram):
+                last = self._last.get(instrument.name) or [0] * len(instrument.counts)
+                counts = list(instrument.counts)
+                delta = [c - l for c, l in zip(counts, last)]
+                self._last[instrument.name] = counts
+                if not sum(delta):
+                    continue
+                parts.append(f"{instrument.name} {_short(instrument.percentile(0.5, delta))}/"
+                             f"{_short(instrument.percentile(0.99, delta))}/{_short(instrument.max)}")
+            elif isinstance(instrument, Counter):
+                value = instrument.value
+                delta = value - self._last.get(instrument.name, 0)
+                self._last[instrument.name] = value
+                if delta:
+                    parts.append(f"{instrument.name}+{delta}")
+            else:
+                value = instrument.snapshot()
+                if value is not None:
+                    parts.append(f"{instrument.name}={_short(value)}")
+        return f"{self.prefix} " + " ".join(parts)
+
+
+def _short(value):
+    if isinstance(value, float):
+        return f"{value:.3g}"
+    return str(value)
+
+
+# ---------------------------------------------------------------
+# UNIX SOCKET
+# ---------------------------------------------------------------
+
+class MetricsServer(object):
+    """
+    Answers every connection on a Unix socket with one JSON snapshot, or
+    the result of the command the client sent before shutting down its
+    side. Clients that send nothing get the snapshot after TIMEOUT.
+    """
+
+    TIMEOUT = 0.5
+
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+        self.sock = None
+        self._thread = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        self.sock.listen(4)
+        self._thread = threading.Thread(target=self._serve, name="metrics", daemon=True)
+        self._thread.start()
+        return self
+
+    def _serve(self):
+        sock = self.sock  # stop() clears the attribute
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                return  # closed by stop()
+            try:
+                conn.settimeout(self.TIMEOUT)
+                conn.sendall(json.dumps(self._answer(_recv_all(conn))).encode() + b"\n")
+            except OSError:
+                pass
+            finally:
+                conn.close()
+
+    def _answer(self, request):
+        words = request.decode(errors="replace").split()
+        if not words:
+            return snapshot()
+        fn = COMMANDS.get(words[0])
+        if fn is None:
+            return {"error": f"unknown command {words[0]}", "commands": sorted(COMMANDS)}
+        try:
+            return fn(*words[1:])
+        except Exception as e:
+            return {"error": str(e)}
+
+    def stop(self):
+        if self.sock is not None:
+            try: self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+            self.sock.close()
+            self.sock = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def _recv_all(sock):
+    data = b""
+    try:
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    except socket.timeout:
+        pass
+    return data
+
+
+def fetch(path=SOCKET_PATH, request=""):
+    """
+    A snapshot, or the result of REQUEST ("profile 30").
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    if request:
+        sock.sendall(request.encode() + b"\n")
+    sock.shutdown(socket.SHUT_WR)
+    data = _recv_all(sock)
+    sock.close()
+    return json.loads(data)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="metrics snapshot or control command")
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    parser.add_argument("command", nargs="*", help="e.g. profile 30")
+    args = parser.parse_args()
+    print(json.dumps(fetch(args.socket, " ".join(args.command)), indent=2))
@@ -0,0 +1,235 @@
+"""
+MPU6050 driver on an SMBus-like bus (smbus.SMBus, i2c_bus.BusClient or
+sim_i2c.SimBus), replacing adafruit_mpu6050.
+
+read() gets accel, temperature and gyro in one 14-byte burst instead of
+one transaction per property. For continuous data the hardware FIFO
+samples at 200-1000 Hz on its own and drain() empties it in 32-byte
+block reads, decoded with NumPy:
+
+    mpu = MPU6050(bus=manager.client("mpu6050", PRIORITY_IMU), sample_rate=500)
+    mpu.enable_fifo()
+    block = mpu.drain()        # ImuBlock: t (n,), accel (n, 3), gyro (n, 3)
+
+Units match adafruit_mpu6050: m/s^2, rad/s, degrees C.
+"""
+import collections
+import math
+import struct
+import time
+
+import numpy as np
+
+# register addresses
+REG_SMPLRT_DIV = 0x19
+REG_CONFIG = 0x1A
+REG_GYRO_CONFIG = 0x1B
+REG_ACCEL_CONFIG = 0x1C
+REG_FIFO_EN = 0x23
+REG_INT_STATUS = 0x3A
+REG_ACCEL_XOUT_H = 0x3B
+REG_USER_CTRL = 0x6A
+REG_PWR_MGMT_1 = 0x6B
+REG_FIFO_COUNT_H = 0x72
+REG_FIFO_R_W = 0x74
+REG_WHO_AM_I = 0x75
+
+# PWR_MGMT_1 bits
+DEVICE_RESET = 0x80
+SLEEP = 0x40
+CLOCK_PLL_XGYRO = 0x01
+
+# USER_CTRL bits
+FIFO_ENABLE = 0x40
+FIFO_RESET = 0x04
+
+# FIFO_EN: gyro x, y, z and accel; no temperature
+FIFO_ACCEL_GYRO = 0x78
+FIFO_SIZE = 1024
+BYTES_PER_SAMPLE = 12
+BLOCK_MAX = 32
+
+# full scale -> CONFIG bits
+ACCEL_RANGES = {2: 0x00, 4: 0x08, 8: 0x10, 16: 0x18}  # g
+GYRO_RANGES = {250: 0x00, 500: 0x08, 1000: 0x10, 2000: 0x18}  # deg/s
+
+# DLPF_CFG -> bandwidth in Hz; with any of them the gyro output rate is 1 kHz
+DLPF_BANDWIDTH = ((1, 188), (2, 98), (3, 42), (4, 20), (5, 10), (6, 5))
+BASE_RATE = 1000
+
+STANDARD_GRAVITY = 9.80665
+
+BURST = struct.Struct(">7h")
+
+Motion = collections.namedtuple("Motion", "accel temp gyro")
+ImuBlock = collections.namedtuple("ImuBlock", "t accel gyro")
+
+
+def empty_block():
+    return ImuBlock(np.empty(0), np.empty((0, 3)), np.empty((0, 3)))
+
+
+def decode_fifo(data, accel_scale, gyro_scale):
+    """
+    Decode FIFO bytes (12 per sample: accel x/y/z, gyro x/y/z, big-endian
+    int16) into scaled (n, 3) accel and gyro arrays.
+    """
+    raw = np.frombuffer(bytes(data), dtype=">i2").reshape(-1, 6)
+    return raw[:, :3] * accel_scale, raw[:, 3:] * gyro_scale
+
+
+class MPU6050(object):
+    # by default, this assumes that the device is at 0x68 on channel 1
+    # pass an already opened bus (e.g. a BusClient) to skip smbus
+    def __init__(self, channel=1, address=0x68, bus=None, sample_rate=200,
+                 accel_range=2, gyro_range=250, clock=time.monotonic, sleep=time.sleep):
+        if bus is None:
+            import smbus
+            bus = smbus.SMBus(channel)
+        self.address = address
+        self.bus = bus
+        self.clock = clock
+        self.sleep = sleep
+        self.fifo = False
+        # FIFO overflows since the driver was created, each loses the FIFO
+        self.overflow_count = 0
+        self.samples = 0
+        # newest (accel, gyro) lists and the last block read
+        self.latest = ([0.0, 0.0, 0.0], [0.0, 0.0, 0.0])
+        self.block = empty_block()
+
+        who = self.bus.read_byte_data(self.address, REG_WHO_AM_I)
+        if who != 0x68:
+            raise RuntimeError(f"no MPU6050 at 0x{address:02x} (WHO_AM_I 0x{who:02x})")
+        self.reset()
+        self.setup(sample_rate, accel_range, gyro_range)
+
+    def reset(self, timeout=0.1):
+        """
+        Reset every register, waits for the reset bit to clear.
+        """
+        self.bus.write_byte_data(self.address, REG_PWR_MGMT_1, DEVICE_RESET)
+        deadline = self.clock() + timeout
+        while self.bus.read_byte_data(self.address, REG_PWR_MGMT_1) & DEVICE_RESET:
+            if self.clock() > deadline:
+                raise OSError("MPU6050 reset did not complete")
+            self.sleep(0.001)
+        self.fifo = False
+
+    def setup(self, sample_rate=200, accel_range=2, gyro_range=250):
+        """
+        Wake up on the gyro PLL, pick the low pass filter for SAMPLE_RATE
+        (Hz, 4 to 1000) and set the full scale ranges.
+        """
+        if accel_range not in ACCEL_RANGES:
+            raise ValueError(f"accel_range must be one of {sorted(ACCEL_RANGES)}, not {accel_range!r}")
+        if gyro_range not in GYRO_RANGES:
+            raise ValueError(f"gyro_range must be one of {sorted(GYRO_RANGES)}, not {gyro_range!r}")
+        divider = min(max(round(BASE_RATE / sample_rate) - 1, 0), 255)
+        self.sample_rate = BASE_RATE / (divider + 1.0)
+        # widest bandwidth below Nyquist
+        dlpf = next((cfg for cfg, bw in DLPF_BANDWIDTH if bw <= self.sample_rate / 2), 6)
+
+        self.bus.write_byte_data(self.address, REG_PWR_MGMT_1, CLOCK_PLL_XGYRO)
+        self.bus.write_i2c_block_data(self.address, REG_SMPLRT_DIV,
+                                      [divider, dlpf, GYRO_RANGES[gyro_range], ACCEL_RANGES[accel_range]])
+        self.accel_scale = accel_range * STANDARD_GRAVITY / 32768.0
+        self.gyro_scale = math.radians(gyro_range) / 32768.0
+
+    # ---------------------------------------------------------
+    # ONE SAMPLE
+    # ---------------------------------------------------------
+    def read(self):
+        """
+        Accel, temperature and gyro from one 14-byte burst, so all three
+        come from the same sample.
+        """
+        ax, ay, az, temp, gx, gy, gz = BURST.unpack(
+            bytes(self.bus.read_i2c_block_data(self.address, REG_ACCEL_XOUT_H, 14)))
+        a, g = self.accel_scale, self.gyro_scale
+        return Motion((ax * a, ay * a, az * a), temp / 340.0 + 36.53, (gx * g, gy * g, gz * g))
+
+    @property
+    def acceleration(self):
+        return self.read().accel
+
+    @property
+    def gyro(self):
+        return self.read().gyro
+
+    @property
+    def temperature(self):
+        return self.read().temp
+
+    # ---------------------------------------------------------
+    # FIFO
+    # ---------------------------------------------------------
+    def enable_fifo(self):
+        """
+        Start filling the FIFO with accel and gyro at the sample rate.
+        """
+        self.bus.write_byte_data(self.address, REG_USER_CTRL, FIFO_RESET)
+        self.bus.write_byte_data(self.address, REG_FIFO_EN, FIFO_ACCEL_GYRO)
+        self.bus.write_byte_data(self.address, REG_USER_CTRL, FIFO_ENABLE)
+        self.fifo = True
+
+    def disable_fifo(self):
+        self.bus.write_byte_data(self.address, REG_FIFO_EN, 0)
+        self.bus.write_byte_data(self.address, REG_USER_CTRL, FIFO_RESET)
+        self.fifo = False
+
+    def fifo_count(self):
+        high, low = self.bus.read_i2c_block_data(self.address, REG_FIFO_COUNT_H, 2)
+        return high << 8 | low
+
+    def drain(self):
+        """
+        Read every complete sample in the FIFO, oldest first, as an ImuBlock.
+        Times are spread back from now at the sample rate. An overflowed
+        FIFO is out of step with the sample boundaries: it is reset and
+        counted, and the block is empty.
+        """
+        count = self.fifo_count()
+        now = self.clock()
+        if count >= FIFO_SIZE:
+            self.overflow_count += 1
+            # reset with FIFO_EN cleared, then enable, like enable_fifo()
+            self.bus.write_byte_data(self.address, REG_USER_CTRL, FIFO_RESET)
+            self.bus.write_byte_data(self.address, REG_USER_CTRL, FIFO_ENABLE)
+            self.block = empty_block()
+            return self.block
+        n = count // BYTES_PER_SAMPLE
+        remaining = n * BYTES_PER_SAMPLE
+        data = []
+        while remaining > 0:
+            # FIFO_R_W does not auto-increment, every byte comes from the FIFO
+            length = min(remaining, BLOCK_MAX)
+            data += self.bus.read_i2c_block_data(self.address, REG_FIFO_R_W, length)
+            remaining -= length
+        accel, gyro = decode_fifo(data, self.accel_scale, self.gyro_scale)
+        t = now - np.arange(n - 1, -1, -1) / self.sample_rate
+        self.samples += n
+        self.block = ImuBlock(t, accel, gyro)
+        return self.block
+
+    def motion(self):
+        """
+        Newest (accel, gyro) as lists: drains the FIFO when it is on (the
+        whole block stays in .block) or does one burst read. Keeps the
+        previous values when the FIFO had nothing new.
+        """
+        if self.fifo:
+            block = self.drain()
+            if len(block.t):
+                self.latest = (block.accel[-1].tolist(), block.gyro[-1].tolist())
+        else:
+            sample = self.read()
+            self.latest = (list(sample.accel), list(sample.gyro))
+            self.block = ImuBlock(np.array([self.clock()]), np.array([sample.accel]),
+                                  np.array([sample.gyro]))
+        return self.latest
+
+    def close(self):
+        if self.fifo:
+            self.disable_fifo()
+        self.bus.write_byte_data(self.address, REG_PWR_MGMT_1, SLEEP)
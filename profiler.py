@@ -0,0 +1,177 @@
+"""
+On-demand sampling profiler for the running process: no restart under
+cProfile, no change to the timing we are trying to catch.
+
+A plain daemon thread looks at sys._current_frames() every INTERVAL
+for DURATION seconds and counts the stack of every other thread (main
+loop, HR thread, BT accept/send threads, supervisors). Nothing is
+interrupted: no timer signals land in an I2C ioctl or a serial read,
+the sampler only takes the GIL between two bytecodes like any other
+thread. When a sample costs more than MAX_OVERHEAD of the time between
+samples the interval is stretched, so the overhead stays bounded.
+
+The result is a collapsed-stack file, one line per distinct stack:
+
+    thread;file.py:outer;file.py:inner 42
+
+which flamegraph.pl, speedscope and inferno read directly.
+
+    profiler.install()                        # kill -USR1 <pid> profiles 10 s
+    python metrics.py profile 30              # same, through the metrics socket
+    profiler.start(duration=5.0)              # or from code
+"""
+import os
+import signal
+import sys
+import threading
+import time
+
+import metrics
+
+DURATION = 10.0
+MAX_DURATION = 300.0   # longest profile the metrics socket may ask for
+INTERVAL = 0.005       # 200 Hz
+MAX_OVERHEAD = 0.02    # share of one core the sampler may use
+MAX_DEPTH = 64
+OUT_DIR = "/tmp"
+
+# reentrant: the SIGUSR1 handler runs in the main thread, maybe inside start()
+_lock = threading.RLock()
+_active = None
+
+
+class SamplingProfiler(object):
+
+    def __init__(self, duration=DURATION, interval=INTERVAL, path=None,
+                 max_overhead=MAX_OVERHEAD, max_depth=MAX_DEPTH, verbose=True):
+        self.duration = duration
+        self.interval = interval
+        self.path = path or os.path.join(
+            OUT_DIR, f"pathpal-profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        self.max_overhead = max_overhead
+        self.max_depth = max_depth
+        self.verbose = verbose
+        self.stacks = {}    # collapsed stack -> samples
+        self.samples = 0
+        self.busy = 0.0     # seconds spent sampling
+        self.elapsed = 0.0
+        self._labels = {}   # code object -> "file.py:func"
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def overhead(self):
+        return self.busy / self.elapsed if self.elapsed else 0.0
+
+    def _run(self):
+        # announced from here, not from start(): print() in a signal
+        # handler can hit "reentrant call" on a busy stdout
+        self._log(f"[PROF] sampling all threads for {self.duration:.0f} s")
+        start = time.perf_counter()
+        end = start + self.duration
+        delay = self.interval
+        try:
+            while not self._stop.wait(delay):
+                t = time.perf_counter()
+                if t >= end:
+                    break
+                self.sample()
+                cost = time.perf_counter() - t
+                self.busy += cost
+                delay = max(self.interval, cost / self.max_overhead)
+        finally:
+            self.elapsed = time.perf_counter() - start
+            self.write()
+            _finished(self)
+
+    def sample(self):
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                label = self._labels.get(code)
+                if label is None:
+                    label = self._labels[code] = \
+                        f"{os.path.basename(code.co_filename)}:{code.co_name}"
+                stack.append(label)
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            key = ";".join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def write(self):
+        try:
+            with open(self.path, "w") as f:
+                for stack, count in sorted(self.stacks.items()):
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            self._log(f"[PROF] could not write {self.path}: {e}")
+            return
+        self._log(f"[PROF] {self.samples} samples in {self.elapsed:.1f} s "
+                  f"(overhead {self.overhead * 100:.1f}%) -> {self.path}")
+
+    def _log(self, message):
+        if self.verbose:
+            print(message)
+
+
+def _finished(profiler):
+    global _active
+    with _lock:
+        if _active is profiler:
+            _active = None
+
+
+def start(duration=DURATION, interval=INTERVAL, path=None, verbose=True):
+    """
+    Start a profile unless one is running. Returns it, or None.
+    """
+    global _active
+    with _lock:
+        if _active is not None:
+            return None
+        _active = SamplingProfiler(duration, interval, path, verbose=verbose)
+        return _active.start()
+
+
+def active():
+    return _active
+
+
+def _profile_command(seconds=None):
+    seconds = DURATION if seconds is None else float(seconds)
+    if not seconds > 0:
+        raise ValueError(f"seconds must be > 0, not {seconds:g}")
+    profiler = start(min(seconds, MAX_DURATION))
+    if profiler is None:
+        return {"error": "profile already running", "path": _active and _active.path}
+    return {"path": profiler.path, "seconds": profiler.duration}
+
+
+def install(signum=signal.SIGUSR1, duration=DURATION):
+    """
+    Profile on SIGNUM and on "profile [seconds]" through the metrics
+    socket. Call from the main thread.
+    """
+    # the handler runs in the main thread between bytecodes; an
+    # interrupted sleep or read is resumed by Python (PEP 475). It only
+    # starts the sampler thread, which does all the printing
+    signal.signal(signum, lambda signo, frame: start(duration))
+    metrics.command("profile", _profile_command)
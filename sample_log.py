@@ -0,0 +1,461 @@
+"""
+On-device sample log: every raw and derived sample (PPG, lidar, IMU,
+GPS sentences, BPM/SpO2) in a ring of fixed-size, preallocated segment
+files, written so the SD card sees few, whole-page writes.
+
+It has the TraceWriter interface, so the Recording* wrappers of
+sensor_trace feed it, and the records are sensor_trace records:
+
+    log = SampleLog("/var/tmp/pathpal-samples").start()
+    sensor = RecordingMax30102(MAX30102(), log)
+    log.vitals(bpm, spo2)                  # any thread, never blocks
+    ...
+    log.close()
+
+    reader = SampleLogReader("/var/tmp/pathpal-samples")
+    data = reader.load(t0, t0 + 60)        # {kind: (times, values)} like read_trace
+    for kind, t, value in reader.read(t0, t0 + 1): ...
+
+Writers only pack the record and queue it. A background thread moves the
+queue into 4 KiB blocks every FLUSH_INTERVAL and appends the full ones
+with one pwrite at a page offset; every page is written once. The block
+that is not full yet stays in memory until it is, MAX_BLOCK_AGE has
+passed (it then goes out padded) or the log is closed. When more than
+MAX_PENDING bytes are waiting, samples are dropped and counted; the
+sensors never wait on flash.
+
+Segment layout, SEGMENT_BYTES each:
+    page 0      two header slots; the one with the highest
+                (generation, commit) and a good CRC is current, so a torn
+                header write leaves the previous header readable
+    pages 1..   blocks: BLOCK header (CRC, generation, bytes, records,
+                first/last time) and records
+
+A segment is opened with a new generation and sealed with an fdatasync
+when it is full, then the oldest segment is reused. Blocks are only
+trusted with the segment's generation and a good CRC, so a crash loses
+at most the blocks that had not reached the card and the block still in
+memory. Times are time.time(): with no RTC they are only as good as the
+clock at boot.
+"""
+import collections
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+import metrics
+from sensor_trace import (GPS, IMU, IMU_PAYLOAD, LIDAR, LIDAR_PAYLOAD, PPG, RECORD, VITALS,
+                          VITALS_PAYLOAD, decode_record, encode_ppg)
+
+MAGIC = b"PPSL"
+VERSION = 1
+
+PAGE = 4096
+SEGMENT_BYTES = 4 * 1024 * 1024     # ~7 min of everything at full rate
+SEGMENTS = 64
+FLUSH_INTERVAL = 2.0
+MAX_BLOCK_AGE = 30.0
+MAX_PENDING = 1024 * 1024
+
+# segment states
+EMPTY = 0
+OPEN = 1
+SEALED = 2
+
+# magic, version, state, generation, commit, blocks, records, first/last time; then CRC32
+HEADER = struct.Struct("<4sBBxxQQIIdd")
+HEADER_SLOT = 512
+# CRC32, generation, payload bytes, records, first/last time
+BLOCK = struct.Struct("<IQHHdd")
+BLOCK_PAYLOAD = PAGE - BLOCK.size
+CRC = struct.Struct("<I")
+
+WRITE_MS = metrics.histogram("log.write_ms", metrics.BUCKETS_MS)
+BYTES = metrics.counter("log.bytes")
+DROPPED = metrics.counter("log.dropped")
+
+
+def _segment_name(index):
+    return f"segment-{index:04d}.log"
+
+
+def _pack_header(state, generation, commit, blocks=0, records=0, t_first=0.0, t_last=0.0):
+    header = HEADER.pack(MAGIC, VERSION, state, generation, commit, blocks, records,
+                         t_first, t_last)
+    return header + CRC.pack(zlib.crc32(header))
+
+
+def _read_header(buf):
+    """
+    (state, generation, commit, blocks, records, t_first, t_last) of the
+    current header slot, or None.
+    """
+    best = None
+    for slot in (0, HEADER_SLOT):
+        raw = bytes(buf[slot:slot + HEADER.size + CRC.size])
+        if len(raw) < HEADER.size + CRC.size:
+            continue
+        if CRC.unpack_from(raw, HEADER.size)[0] != zlib.crc32(raw[:HEADER.size]):
+            continue
+        magic, version, *fields = HEADER.unpack_from(raw)
+        if magic != MAGIC or version != VERSION:
+            continue
+        if best is None or (fields[1], fields[2]) > (best[1], best[2]):
+            best = tuple(fields)
+    return best
+
+
+def _pack_block(generation, payload, records, t_first, t_last):
+    fields = BLOCK.pack(0, generation, len(payload), records, t_first, t_last)[CRC.size:]
+    crc = zlib.crc32(payload, zlib.crc32(fields))
+    block = CRC.pack(crc) + fields + payload
+    return block + bytes(PAGE - len(block))
+
+
+# ---------------------------------------------------------------
+# WRITER
+# ---------------------------------------------------------------
+
+class SampleLog(object):
+
+    def __init__(self, path, segments=SEGMENTS, segment_bytes=SEGMENT_BYTES,
+                 flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING,
+                 max_block_age=MAX_BLOCK_AGE, clock=time.time):
+        if segment_bytes % PAGE or segment_bytes < 2 * PAGE:
+            raise ValueError("segment_bytes must be a multiple of the page size")
+        self.path = path
+        self.segments = segments
+        self.segment_bytes = segment_bytes
+        self.blocks_per_segment = segment_bytes // PAGE - 1
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_block_age = max_block_age
+        # times are clock() - t0, like TraceWriter (RecordingMpu6050 uses both)
+        self.clock = clock
+        self.t0 = 0.0
+        self.records = 0
+        self.dropped = 0
+        self.writes = 0
+        self.pages_written = 0
+        self._pending = collections.deque()
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._fd = None
+        os.makedirs(path, exist_ok=True)
+
+        # carry on after the newest segment of the previous run
+        newest, generation = -1, 0
+        for index in range(segments):
+            header = self._peek(index)
+            if header is not None and header[1] > generation:
+                newest, generation = index, header[1]
+        self._generation = generation
+        # sized down since the last run: the segments past the end go
+        for name in os.listdir(path):
+            if (name.startswith("segment-") and name.endswith(".log")
+                    and name[8:-4].isdigit() and int(name[8:-4]) >= segments):
+                os.remove(os.path.join(path, name))
+        self._open_segment((newest + 1) % segments)
+
+    def _peek(self, index):
+        try:
+            with open(os.path.join(self.path, _segment_name(index)), "rb") as f:
+                return _read_header(f.read(HEADER_SLOT + HEADER.size + CRC.size))
+        except OSError:
+            return None
+
+    # ---------------------------------------------------------
+    # producers, any thread
+    # ---------------------------------------------------------
+    def _write(self, kind, payload, t=None):
+        if t is None:
+            t = self.clock() - self.t0
+        record = RECORD.pack(kind, t, len(payload)) + payload
+        with self._lock:
+            # a record never spans blocks
+            if (self._pending_bytes + len(record) > self.max_pending
+                    or len(record) > BLOCK_PAYLOAD):
+                self.dropped += 1
+                if metrics.enabled:
+                    DROPPED.inc()
+                return
+            self._pending.append((t, record))
+            self._pending_bytes += len(record)
+            self.records += 1
+
+    def ppg(self, red, ir, t=None):
+        self._write(PPG, encode_ppg(red, ir), t)
+
+    def lidar(self, dist, amp, t=None):
+        self._write(LIDAR, LIDAR_PAYLOAD.pack(int(dist) & 0xFFFF, int(amp) & 0xFFFF), t)
+
+    def imu(self, accel, gyro, t=None):
+        self._write(IMU, IMU_PAYLOAD.pack(*(tuple(accel) + tuple(gyro))), t)
+
+    def gps(self, sentence, t=None):
+        if isinstance(sentence, str):
+            sentence = sentence.encode("ascii", "replace")
+        self._write(GPS, sentence, t)
+
+    def vitals(self, bpm, spo2, t=None):
+        self._write(VITALS, VITALS_PAYLOAD.pack(bpm, spo2), t)
+
+    # ---------------------------------------------------------
+    # writer thread
+    # ---------------------------------------------------------
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sample-log", daemon=True)
+        self._thread.start()
+        metrics.gauge("log.pending_bytes", lambda: self._pending_bytes)
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"[ERR] Sample log write failed: {e}")
+
+    def flush(self, final=False):
+        """
+        Pack everything queued into blocks and write the full ones (with
+        FINAL, or once it is MAX_BLOCK_AGE old, the last one too). Writer
+        thread (or the caller of close()) only.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, collections.deque()
+            self._pending_bytes = 0
+        if not pending and not self._buf_records:
+            return
+        start = time.perf_counter()
+        for t, record in pending:
+            if len(self._buf) + len(record) > BLOCK_PAYLOAD:
+                self._close_block()
+            if not self._buf_records:
+                self._buf_first = self._buf_last = t
+                self._buf_opened = self.clock()
+            else:
+                self._buf_first = min(self._buf_first, t)
+                self._buf_last = max(self._buf_last, t)
+            self._buf += record
+            self._buf_records += 1
+        if self._buf_records and (final or self.clock() - self._buf_opened >= self.max_block_age):
+            self._close_block()
+        self._write_batch()
+        if metrics.enabled:
+            WRITE_MS.observe((time.perf_counter() - start) * 1e3)
+
+    def _close_block(self):
+        self._batch.append(_pack_block(self._generation, bytes(self._buf), self._buf_records,
+                                       self._buf_first, self._buf_last))
+        self._seg_records += self._buf_records
+        if self._seg_first is None:
+            self._seg_first = self._buf_first
+        self._seg_last = self._buf_last
+        self._buf = bytearray()
+        self._buf_records = 0
+        if self._block + len(self._batch) > self.blocks_per_segment:
+            self._write_batch()
+            self._seal_segment()
+            self._open_segment((self._index + 1) % self.segments)
+
+    def _write_batch(self):
+        data = b"".join(self._batch)
+        if data:
+            os.pwrite(self._fd, data, self._block * PAGE)
+            self.writes += 1
+            self.pages_written += len(data) // PAGE
+            if metrics.enabled:
+                BYTES.inc(len(data))
+        self._block += len(self._batch)
+        self._batch = []
+
+    def _write_header(self, header):
+        os.pwrite(self._fd, header, (self._commit % 2) * HEADER_SLOT)
+        os.fdatasync(self._fd)
+        self._commit += 1
+
+    def _open_segment(self, index):
+        if self._fd is not None:
+            os.close(self._fd)
+        name = os.path.join(self.path, _segment_name(index))
+        self._fd = os.open(name, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size != self.segment_bytes:
+            os.ftruncate(self._fd, 0)
+            try:
+                os.posix_fallocate(self._fd, 0, self.segment_bytes)
+            except OSError:
+                os.ftruncate(self._fd, self.segment_bytes)  # no fallocate on this filesystem
+        self._index = index
+        self._generation += 1
+        self._commit = 0
+        self._block = 1
+        self._batch = []
+        self._buf = bytearray()
+        self._buf_records = 0
+        self._buf_first = self._buf_last = self._buf_opened = 0.0
+        self._seg_records = 0
+        self._seg_first = self._seg_last = None
+        # old blocks stay until overwritten; their generation gives them away
+        self._write_header(_pack_header(OPEN, self._generation, self._commit))
+
+    def _seal_segment(self):
+        os.fdatasync(self._fd)
+        self._write_header(_pack_header(SEALED, self._generation, self._commit,
+                                        self._block - 1, self._seg_records,
+                                        self._seg_first or 0.0, self._seg_last or 0.0))
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._fd is not None:
+            self.flush(final=True)
+            os.fdatasync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+
+# ---------------------------------------------------------------
+# READER
+# ---------------------------------------------------------------
+
+def _first(lo, hi, pred):
+    """
+    First index in [lo, hi) where PRED turns true, hi if never.
+    """
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if pred(mid):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+class _Segment(object):
+    """
+    One mmapped segment file and its valid blocks.
+    """
+
+    def __init__(self, path):
+        self.map = None
+        self.generation, self.blocks = 0, 0
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < 2 * PAGE:
+                return
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = _read_header(self.map)
+        if header is None:
+            return
+        self.generation = header[1]
+        last = len(self.map) // PAGE
+        # written in order, so the good blocks are a prefix
+        self.blocks = _first(1, last, lambda i: not self._good(i)) - 1
+
+    def _block(self, index):
+        crc, generation, used, records, t_first, t_last = BLOCK.unpack_from(self.map, index * PAGE)
+        return generation, used, records, t_first, t_last
+
+    def _good(self, index):
+        offset = index * PAGE
+        crc, generation, used = BLOCK.unpack_from(self.map, offset)[:3]
+        if generation != self.generation or used > BLOCK_PAYLOAD:
+            return False
+        body = self.map[offset + CRC.size:offset + BLOCK.size + used]
+        return zlib.crc32(body) == crc
+
+    def first_time(self, index):
+        return self._block(index)[3]
+
+    def range(self):
+        if not self.blocks:
+            return None
+        return self.first_time(1), self._block(self.blocks)[4]
+
+    def records(self, t_start, t_end):
+        end = self.blocks + 1
+        # blocks are roughly in time order; step back over a few that
+        # still reach into the range (IMU blocks are back-dated)
+        index = max(_first(1, end, lambda i: self.first_time(i) > t_start) - 1, 1)
+        while index > 1 and self._block(index - 1)[4] >= t_start:
+            index -= 1
+        for index in range(index, end):
+            generation, used, records, t_first, t_last = self._block(index)
+            if t_first > t_end:
+                break
+            if t_last < t_start:
+                continue
+            pos = index * PAGE + BLOCK.size
+            stop = pos + used
+            while pos < stop:
+                kind, t, length = RECORD.unpack_from(self.map, pos)
+                pos += RECORD.size
+                if t_start <= t <= t_end:
+                    yield kind, t, self.map[pos:pos + length]
+                pos += length
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+
+
+class SampleLogReader(object):
+    """
+    Random access by time range over the segment files of a SampleLog,
+    also while it is being written.
+    """
+
+    def __init__(self, path):
+        self.segments = []
+        for name in sorted(os.listdir(path)):
+            if name.startswith("segment-") and name.endswith(".log"):
+                segment = _Segment(os.path.join(path, name))
+                if segment.blocks:
+                    self.segments.append(segment)
+                else:
+                    segment.close()
+        self.segments.sort(key=lambda segment: segment.generation)
+
+    def range(self):
+        """
+        (first, last) sample time in the log, or None when it is empty.
+        """
+        if not self.segments:
+            return None
+        return self.segments[0].range()[0], max(s.range()[1] for s in self.segments)
+
+    def read(self, t_start=float("-inf"), t_end=float("inf"), kinds=None):
+        """
+        (kind, t, value) for every record in [T_START, T_END], in the
+        order they were logged. Values are decoded like read_trace.
+        """
+        for segment in self.segments:
+            first, last = segment.range()
+            if last < t_start or first > t_end:
+                continue
+            for kind, t, payload in segment.records(t_start, t_end):
+                if kinds is None or kind in kinds:
+                    yield kind, t, decode_record(kind, payload)
+
+    def load(self, t_start=float("-inf"), t_end=float("inf")):
+        """
+        {kind: (times, values)} like sensor_trace.read_trace.
+        """
+        import numpy as np
+        records = collections.defaultdict(lambda: ([], []))
+        for kind, t, value in self.read(t_start, t_end):
+            records[kind][0].append(t)
+            records[kind][1].append(value)
+        return {kind: (np.array(times, dtype=np.float64), values)
+                for kind, (times, values) in records.items()}
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
@@ -0,0 +1,197 @@
+"""
+Multi-rate asyncio scheduler for the sensor tasks.
+
+Every periodic task has its own rate and deadline. Release times are
+computed from a monotonic clock (start + k * period), so the work done
+in a task does not make the following releases drift. A task that
+misses its deadline is counted as an overrun and the releases it missed
+are skipped instead of being run back to back.
+
+    sched = Scheduler()
+    sched.every("lidar", 100, read_lidar)
+    sched.every("publish", 10, publish)
+    sched.on_event("hr", hr_event, handle_hr)
+    asyncio.run(sched.run())
+"""
+import asyncio
+import math
+import time
+
+import metrics
+
+
+class TaskStats(object):
+    """
+    Lateness (start - release) and execution time of one task, in seconds.
+    With metrics enabled both also go to sched.NAME.late_us / exec_us.
+    """
+
+    def __init__(self, name=None):
+        self.runs = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.errors = 0
+        self._late_sum = 0.0
+        self._late_sq = 0.0
+        self.late_max = 0.0
+        self._exec_sum = 0.0
+        self.exec_max = 0.0
+        self.started = None
+        self.last = None
+        self.late_us = self.exec_us = None
+        if name is not None:
+            self.late_us = metrics.histogram(f"sched.{name}.late_us")
+            self.exec_us = metrics.histogram(f"sched.{name}.exec_us")
+
+    def record(self, release, start, end, deadline):
+        self.runs += 1
+        late = max(start - release, 0.0)
+        self._late_sum += late
+        self._late_sq += late * late
+        self.late_max = max(self.late_max, late)
+        duration = end - start
+        self._exec_sum += duration
+        self.exec_max = max(self.exec_max, duration)
+        if end > release + deadline:
+            self.overruns += 1
+        if self.started is None:
+            self.started = start
+        self.last = start
+        if metrics.enabled and self.late_us is not None:
+            self.late_us.observe(late * 1e6)
+            self.exec_us.observe(duration * 1e6)
+
+    @property
+    def jitter(self):
+        """
+        Standard deviation of the start lateness.
+        """
+        if self.runs < 2:
+            return 0.0
+        mean = self._late_sum / self.runs
+        return math.sqrt(max(self._late_sq / self.runs - mean * mean, 0.0))
+
+    @property
+    def rate(self):
+        """
+        Achieved runs per second.
+        """
+        if self.runs < 2 or self.last == self.started:
+            return 0.0
+        return (self.runs - 1) / (self.last - self.started)
+
+    def as_dict(self):
+        runs = max(self.runs, 1)
+        return {
+            "runs": self.runs,
+            "rate_hz": self.rate,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "late_mean_us": self._late_sum / runs * 1e6,
+            "late_max_us": self.late_max * 1e6,
+            "jitter_us": self.jitter * 1e6,
+            "exec_mean_us": self._exec_sum / runs * 1e6,
+            "exec_max_us": self.exec_max * 1e6,
+        }
+
+
+class Scheduler(object):
+    """
+    Runs periodic and event-driven tasks on one asyncio loop.
+
+    Task functions are plain callables (short, non-blocking or quick I2C
+    reads); a coroutine function is awaited instead.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.stats = {}
+        self._periodic = []
+        self._events = []
+        self._running = False
+
+    def every(self, name, rate, func, deadline=None):
+        """
+        Run FUNC() RATE times per second. DEADLINE (seconds after release,
+        default one period) is what counts as an overrun.
+        """
+        period = 1.0 / rate
+        self._periodic.append((name, period, deadline or period, func))
+        self.stats[name] = TaskStats(name)
+
+    def on_event(self, name, event, func):
+        """
+        Run FUNC() every time the asyncio.Event EVENT is set. Other threads
+        should set it with loop.call_soon_threadsafe(event.set).
+        """
+        self._events.append((name, event, func))
+        self.stats[name] = TaskStats(name)
+
+    def stop(self):
+        self._running = False
+
+    async def run(self, duration=None):
+        """
+        Run every task until stop() is called or DURATION seconds passed.
+        """
+        self._running = True
+        start = self.clock()
+        tasks = [asyncio.ensure_future(self._run_periodic(start, *task)) for task in self._periodic]
+        tasks += [asyncio.ensure_future(self._run_event(*task)) for task in self._events]
+        try:
+            while self._running:
+                if duration is not None and self.clock() - start >= duration:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            self._running = False
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _call(self, name, func):
+        try:
+            result = func()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            self.stats[name].errors += 1
+            print(f"[SCHED] {name} failed: {e}")
+
+    async def _run_periodic(self, start, name, period, deadline, func):
+        stats = self.stats[name]
+        release = start
+        while self._running:
+            delay = release - self.clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            begin = self.clock()
+            await self._call(name, func)
+            end = self.clock()
+            stats.record(release, begin, end, deadline)
+
+            release += period
+            if end > release:
+                # missed one or more releases: skip them, keep the phase
+                missed = int((end - release) / period) + 1
+                stats.skipped += missed
+                release += missed * period
+            else:
+                # let the other tasks run even when this one is always due
+                await asyncio.sleep(0)
+
+    async def _run_event(self, name, event, func):
+        stats = self.stats[name]
+        while self._running:
+            await event.wait()
+            event.clear()
+            release = begin = self.clock()
+            await self._call(name, func)
+            stats.record(release, begin, self.clock(), float("inf"))
+
+    def report(self):
+        """
+        {task name: stats dict} for every task.
+        """
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
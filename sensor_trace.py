@@ -0,0 +1,495 @@
+"""
+Record and replay sensor sessions.
+
+A trace is a compact binary file of timestamped raw readings: MAX30102
+FIFO samples, TF-Luna reads, MPU6050 accel/gyro and GPS sentences, plus
+the BPM/SpO2 the heart rate monitor computed from them.
+
+Recording wraps the live drivers:
+
+    recorder = TraceWriter("walk.trace")
+    sensor = RecordingMax30102(MAX30102(), recorder)
+
+Replay hands out stand-in drivers that return what was recorded, either
+in real time or as fast as possible (a virtual clock that only advances
+when the pipeline sleeps):
+
+    replay = TraceReplay("walk.trace")
+    lidar = replay.lidar()
+"""
+import struct
+import threading
+import time
+
+import numpy as np
+
+MAGIC = b"PPTR"
+VERSION = 1
+
+# record kinds
+PPG = 1
+LIDAR = 2
+IMU = 3
+GPS = 4
+VITALS = 5  # derived: bpm, spo2
+
+# kind, timestamp (s since start of recording), payload length
+RECORD = struct.Struct("<BdH")
+LIDAR_PAYLOAD = struct.Struct("<HH")
+IMU_PAYLOAD = struct.Struct("<6f")
+VITALS_PAYLOAD = struct.Struct("<ff")
+
+
+# ---------------------------------------------------------------
+# FILE FORMAT
+# ---------------------------------------------------------------
+
+class TraceWriter(object):
+    """
+    Append records to a trace file. Safe to call from several threads.
+    """
+
+    def __init__(self, path, clock=time.monotonic):
+        self.clock = clock
+        self.t0 = clock()
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = open(path, "wb")
+        self._file.write(MAGIC + bytes([VERSION]))
+
+    def _write(self, kind, payload, t=None):
+        if t is None:
+            t = self.clock() - self.t0
+        with self._lock:
+            self._file.write(RECORD.pack(kind, t, len(payload)))
+            self._file.write(payload)
+            self.records += 1
+
+    def ppg(self, red, ir, t=None):
+        self._write(PPG, encode_ppg(red, ir), t)
+
+    def lidar(self, dist, amp, t=None):
+        self._write(LIDAR, LIDAR_PAYLOAD.pack(int(dist) & 0xFFFF, int(amp) & 0xFFFF), t)
+
+    def imu(self, accel, gyro, t=None):
+        self._write(IMU, IMU_PAYLOAD.pack(*(tuple(accel) + tuple(gyro))), t)
+
+    def gps(self, sentence, t=None):
+        if isinstance(sentence, str):
+            sentence = sentence.encode("ascii", "replace")
+        self._write(GPS, sentence, t)
+
+    def vitals(self, bpm, spo2, t=None):
+        self._write(VITALS, VITALS_PAYLOAD.pack(bpm, spo2), t)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def encode_ppg(red, ir):
+    return np.asarray(red, dtype="<u4").tobytes() + np.asarray(ir, dtype="<u4").tobytes()
+
+
+def decode_record(kind, payload):
+    """
+    The value of one record, None for unknown kinds. PPG is (red, ir).
+    """
+    if kind == PPG:
+        values = np.frombuffer(payload, dtype="<u4").astype(np.int64)
+        return values[:len(payload) // 8], values[len(payload) // 8:]
+    if kind == LIDAR:
+        return LIDAR_PAYLOAD.unpack(payload)
+    if kind == IMU:
+        return IMU_PAYLOAD.unpack(payload)
+    if kind == GPS:
+        return bytes(payload)
+    if kind == VITALS:
+        return VITALS_PAYLOAD.unpack(payload)
+    return None
+
+
+def read_trace(path):
+    """
+    Load a trace, returns {kind: (times, values)} with times as a numpy array.
+    PPG values are (red, ir) arrays with one row per record.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != MAGIC:
+        raise ValueError("not a PathPal trace: {0}".format(path))
+    if data[4] != VERSION:
+        raise ValueError("unsupported trace version {0}".format(data[4]))
+
+    records = {PPG: ([], []), LIDAR: ([], []), IMU: ([], []), GPS: ([], []), VITALS: ([], [])}
+    pos = 5
+    while pos + RECORD.size <= len(data):
+        kind, t, length = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        payload = data[pos:pos + length]
+        pos += length
+        if len(payload) < length:
+            break  # truncated by a crash, keep what is complete
+
+        value = decode_record(kind, payload)
+        if value is None:
+            continue
+        records[kind][0].append(t)
+        records[kind][1].append(value)
+
+    return {kind: (np.array(times, dtype=np.float64), values)
+            for kind, (times, values) in records.items()}
+
+
+# ---------------------------------------------------------------
+# RECORDING
+# ---------------------------------------------------------------
+
+class _Wrapper(object):
+    def __init__(self, device, recorder):
+        self._device = device
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+
+class RecordingMax30102(_Wrapper):
+    """
+    MAX30102 driver that records every drained sample.
+    """
+
+    def drain(self, *args, **kwargs):
+        red, ir = self._device.drain(*args, **kwargs)
+        if len(ir) > 0:
+            self._recorder.ppg(red, ir)
+        return red, ir
+
+
+class RecordingTfLuna(_Wrapper):
+    """
+    TfLunaI2C driver that records every read_data().
+    """
+
+    def read_data(self):
+        dist, amp = self._device.read_data()
+        self._recorder.lidar(dist, amp)
+        return [dist, amp]
+
+
+class RecordingMpu6050(_Wrapper):
+    """
+    mpu6050.MPU6050 (or adafruit_mpu6050.MPU6050) that records accel/gyro.
+    motion() records every sample of the block it read, at its own time;
+    with the properties a record is written on every gyro read with the
+    latest acceleration.
+    """
+
+    _accel = (0.0, 0.0, 0.0)
+
+    def motion(self):
+        latest = self._device.motion()
+        block = self._device.block
+        if len(block.t):
+            # sample times are on the driver's clock, the newest is now
+            base = self._recorder.clock() - self._recorder.t0 - block.t[-1]
+            for t, accel, gyro in zip(block.t, block.accel, block.gyro):
+                self._recorder.imu(accel, gyro, t + base)
+        return latest
+
+    @property
+    def acceleration(self):
+        self._accel = self._device.acceleration
+        return self._accel
+
+    @property
+    def gyro(self):
+        gyro = self._device.gyro
+        self._recorder.imu(self._accel, gyro)
+        return gyro
+
+
+class RecordingSerial(_Wrapper):
+    """
+    GPS serial port that records every sentence read, by readline() or
+    by bulk read().
+    """
+
+    def __init__(self, device, recorder):
+        _Wrapper.__init__(self, device, recorder)
+        self._partial = bytearray()
+
+    # set by the GPS high rate setup, must reach the real port
+    @property
+    def baudrate(self):
+        return self._device.baudrate
+
+    @baudrate.setter
+    def baudrate(self, value):
+        self._device.baudrate = value
+
+    def readline(self, *args, **kwargs):
+        line = self._device.readline(*args, **kwargs)
+        if line:
+            self._recorder.gps(line)
+        return line
+
+    def read(self, *args, **kwargs):
+        data = self._device.read(*args, **kwargs)
+        self._partial += data
+        end = self._partial.rfind(b"\n")
+        if end >= 0:
+            for line in self._partial[:end + 1].splitlines(keepends=True):
+                self._recorder.gps(bytes(line))
+            del self._partial[:end + 1]
+        return data
+
+
+# ---------------------------------------------------------------
+# REPLAY
+# ---------------------------------------------------------------
+
+class TraceReplay(object):
+    """
+    Clock and stand-in drivers for a recorded trace.
+
+    realtime=False: time only moves when sleep() is called, so the
+    pipeline runs as fast as possible and the result is deterministic.
+    realtime=True: trace time follows the wall clock times SPEED.
+    """
+
+    def __init__(self, path, realtime=False, speed=1.0):
+        self.records = read_trace(path)
+        self.realtime = realtime
+        self.speed = speed
+        ends = [times[-1] for times, _ in self.records.values() if len(times)]
+        self.duration = max(ends) if ends else 0.0
+        self._now = 0.0
+        self._wall0 = time.monotonic()
+
+    def time(self):
+        if self.realtime:
+            return (time.monotonic() - self._wall0) * self.speed
+        return self._now
+
+    def sleep(self, seconds):
+        if self.realtime:
+            time.sleep(max(seconds, 0.0) / self.speed)
+        else:
+            self._now += max(seconds, 0.0)
+
+    def finished(self):
+        return self.time() > self.duration
+
+    def count(self, kind):
+        return len(self.records[kind][0])
+
+    def latest(self, kind):
+        """
+        Newest value of KIND recorded at or before the current time, or None.
+        """
+        times, values = self.records[kind]
+        i = np.searchsorted(times, self.time(), side="right")
+        return values[i - 1] if i > 0 else None
+
+    def since(self, kind, start):
+        """
+        Values of KIND recorded after START up to the current time.
+        Returns (values, end) where END is the index to pass next time.
+        """
+        times, values = self.records[kind]
+        end = int(np.searchsorted(times, self.time(), side="right"))
+        return values[start:end], end
+
+    def max30102(self):
+        return ReplayMax30102(self)
+
+    def lidar(self):
+        return ReplayTfLuna(self)
+
+    def mpu6050(self):
+        return ReplayMpu6050(self)
+
+    def gps_serial(self):
+        return ReplaySerial(self)
+
+
+class ReplayMax30102(object):
+    """
+    Stand-in for max30102.MAX30102, drain() returns the recorded samples
+    that are due.
+    """
+
+    def __init__(self, replay):
+        self.replay = replay
+        self.overflow_count = 0
+        self._next = 0
+
+    def drain(self, clear_interrupts=False):
+        records, self._next = self.replay.since(PPG, self._next)
+        if not records:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        red = np.concatenate([r for r, _ in records])
+        ir = np.concatenate([i for _, i in records])
+        return red, ir
+
+    # configuration calls are accepted and ignored
+    def reset(self):
+        pass
+
+    def setup(self, led_mode=0x03):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def clear_interrupts(self):
+        return [0, 0]
+
+    def set_interrupts(self, a_full=True, ppg_rdy=True):
+        pass
+
+    def set_almost_full(self, samples):
+        pass
+
+
+class ReplayTfLuna(object):
+    """
+    Stand-in for TfLunaI2C returning the latest recorded distance.
+    """
+
+    def __init__(self, replay):
+        self.replay = replay
+        self.dist = 0
+        self.amp = 0
+
+    def read_data(self):
+        value = self.replay.latest(LIDAR)
+        if value is not None:
+            self.dist, self.amp = value
+        return [self.dist, self.amp]
+
+    @property
+    def distance(self):
+        return self.dist
+
+
+class ReplayMpu6050(object):
+    """
+    Stand-in for mpu6050.MPU6050 returning the latest recorded sample.
+    """
+
+    def __init__(self, replay):
+        self.replay = replay
+
+    def motion(self):
+        latest = self._latest()
+        return tuple(latest[:3]), tuple(latest[3:])
+
+    def _latest(self):
+        value = self.replay.latest(IMU)
+        return value if value is not None else (0.0,) * 6
+
+    @property
+    def acceleration(self):
+        return tuple(self._latest()[:3])
+
+    @property
+    def gyro(self):
+        return tuple(self._latest()[3:])
+
+
+class ReplaySerial(object):
+    """
+    Stand-in for the GPS serial.Serial. The recorded sentences that are
+    due can be read with readline() or read(); both return b"" when there
+    is nothing (like a read timeout).
+    """
+
+    def __init__(self, replay):
+        self.replay = replay
+        self.is_open = True
+        self._bytes = bytearray()
+        self._next = 0
+
+    def _fetch(self):
+        lines, self._next = self.replay.since(GPS, self._next)
+        for line in lines:
+            self._bytes += line
+
+    @property
+    def in_waiting(self):
+        self._fetch()
+        return len(self._bytes)
+
+    def read(self, size=1):
+        self._fetch()
+        out = bytes(self._bytes[:size])
+        del self._bytes[:size]
+        return out
+
+    def readline(self):
+        self._fetch()
+        end = self._bytes.find(b"\n")
+        end = len(self._bytes) if end < 0 else end + 1
+        out = bytes(self._bytes[:end])
+        del self._bytes[:end]
+        return out
+
+    def close(self):
+        self.is_open = False
+
+
+class TraceSink(object):
+    """
+    Socket stand-in for a BluetoothSender client that keeps what was sent.
+    """
+
+    def __init__(self, keep=True):
+        self.keep = keep
+        self.sent = []
+        self.bytes = 0
+        self.calls = 0
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.calls += 1
+        self.bytes += len(data)
+        if self.keep:
+            self.sent.append(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+class ReplayHeartRateMonitor(object):
+    """
+    Runs a hr2.HeartRateMonitor inline instead of in its thread: every
+    read of bpm first processes the samples that are due. Keeps the time
+    spent in the HR algorithm.
+    """
+
+    def __init__(self, monitor, sensor):
+        self.monitor = monitor
+        self.sensor = sensor
+        self.calc_time = 0.0
+        self.calc_calls = 0
+
+    @property
+    def bpm(self):
+        red, ir = self.sensor.drain()
+        if len(ir) > 0:
+            start = time.perf_counter()
+            self.monitor.process(red, ir)
+            self.calc_time += time.perf_counter() - start
+            self.calc_calls += 1
+        return self.monitor.bpm
+
+    def start_sensor(self):
+        pass
+
+    def stop_sensor(self, timeout=2.0):
+        pass
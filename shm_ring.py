@@ -0,0 +1,155 @@
+"""
+Single-writer, multi-reader ring buffers of timestamped samples in
+multiprocessing.shared_memory, so an acquisition process can hand
+samples to the fusion loop without pickling, pipes or the GIL.
+
+Every row is [t, value, value, ...] as float64. The writer announces the
+rows it is about to fill in `writing`, fills them and then bumps the
+sequence counter `head` (rows ever written). Readers never lock: they
+look at head, read rows through NumPy views on the shared block and
+check afterwards against `writing` that the writer has not come round
+to those rows again, the same way TfLunaReader.history() does.
+
+    ring = SampleRing.create("pathpal-lidar", width=2, capacity=1024)   # owner
+    ring.write(time.monotonic(), (dist, amp))                          # writer process
+
+    ring = SampleRing.attach("pathpal-lidar")                          # reader
+    seq, row = ring.latest()          # view: row[0] is t, row[1:] the values
+    if ring.valid(seq): ...           # not overwritten while we used it
+    seq, rows = ring.since(seq)       # copies of everything newer than seq
+
+Times are time.monotonic(), which is the same clock in every process.
+"""
+import numpy as np
+from multiprocessing import shared_memory
+
+MAGIC = 0x50505231  # "PPR1"
+# header: int64 slots, padded to a cache line so rows start aligned
+HEADER_SLOTS = 8
+_MAGIC, _CAPACITY, _WIDTH, _HEAD, _WRITING = range(5)
+
+
+class SampleRing(object):
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self._meta = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=shm.buf)
+        if self._meta[_MAGIC] != MAGIC:
+            raise ValueError(f"{shm.name} is not a SampleRing")
+        self.capacity = int(self._meta[_CAPACITY])
+        self.width = int(self._meta[_WIDTH])
+        # (capacity, 1 + width) view of the shared rows
+        self.rows = np.ndarray((self.capacity, 1 + self.width), dtype=np.float64,
+                               buffer=shm.buf, offset=HEADER_SLOTS * 8)
+
+    @classmethod
+    def create(cls, name, width, capacity=1024):
+        size = HEADER_SLOTS * 8 + capacity * (1 + width) * 8
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # left behind by a process that was killed
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        meta = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=shm.buf)
+        meta[:] = 0
+        meta[_CAPACITY] = capacity
+        meta[_WIDTH] = width
+        meta[_MAGIC] = MAGIC
+        del meta
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        # processes started by the owner share its resource tracker, which
+        # then only unlinks the block if the owner dies without close()
+        return cls(shared_memory.SharedMemory(name))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def head(self):
+        """
+        Sequence number: rows written since the ring was created.
+        """
+        return int(self._meta[_HEAD])
+
+    # ---------------------------------------------------------
+    # writer
+    # ---------------------------------------------------------
+    def write(self, t, values):
+        head = int(self._meta[_HEAD])
+        self._meta[_WRITING] = head + 1
+        row = self.rows[head % self.capacity]
+        row[0] = t
+        row[1:] = values
+        self._meta[_HEAD] = head + 1
+
+    def write_block(self, t, values):
+        """
+        N rows at once: T (n,) and VALUES (n, width).
+        """
+        n = len(t)
+        if n == 0:
+            return
+        if n > self.capacity:
+            t, values = t[-self.capacity:], values[-self.capacity:]
+            n = self.capacity
+        head = int(self._meta[_HEAD])
+        self._meta[_WRITING] = head + n
+        start = head % self.capacity
+        first = min(n, self.capacity - start)
+        self.rows[start:start + first, 0] = t[:first]
+        self.rows[start:start + first, 1:] = values[:first]
+        if first < n:
+            self.rows[:n - first, 0] = t[first:]
+            self.rows[:n - first, 1:] = values[first:]
+        self._meta[_HEAD] = head + n
+
+    # ---------------------------------------------------------
+    # readers
+    # ---------------------------------------------------------
+    def valid(self, seq):
+        """
+        Row SEQ has not been overwritten (yet). Check after using a view.
+        """
+        return int(self._meta[_WRITING]) - seq <= self.capacity
+
+    def latest(self):
+        """
+        (seq, row view) of the newest row, or (None, None) before the
+        first write. The view is only good while valid(seq).
+        """
+        head = self.head
+        if head == 0:
+            return None, None
+        return head - 1, self.rows[(head - 1) % self.capacity]
+
+    def since(self, seq, limit=None):
+        """
+        Copies of the rows after SEQ (-1 for all), oldest first, and the
+        seq of the newest one. Rows the writer overwrote are skipped.
+        """
+        while True:
+            head = self.head
+            first = max(seq + 1, head - self.capacity)
+            if limit is not None:
+                first = max(first, head - limit)
+            if first >= head:
+                return head - 1, self.rows[:0].copy()
+            index = np.arange(first, head) % self.capacity
+            rows = self.rows[index]  # fancy indexing copies
+            if self.valid(first):
+                return head - 1, rows
+
+    def close(self):
+        self._meta = self.rows = None
+        self.shm.close()
+        if self.owner:
+            try: self.shm.unlink()
+            except FileNotFoundError: pass
@@ -0,0 +1,576 @@
+"""
+Simulated I2C bus and device models.
+
+SimBus has the same methods as smbus.SMBus, so it can be passed to the
+drivers instead of a real bus to benchmark them off the Pi:
+
+    bus = SimBus()
+    ppg = bus.attach(SimMax30102())
+    sensor = MAX30102(bus=bus)
+
+    lidar = bus.attach(SimTfLuna())
+    tf = TfLunaI2C(i2cbus=bus)
+
+Every driver that takes a `bus` (or `i2cbus`) argument only needs these
+SMBus methods: read/write_byte_data, read/write_word_data and
+read/write_i2c_block_data.
+"""
+import time
+
+import numpy as np
+
+import max30102
+from TfLunaI2C import TfLunaI2C
+
+
+# ---------------------------------------------------------------
+# SYNTHETIC SIGNALS
+# ---------------------------------------------------------------
+
+def synthetic_ppg(n=100, bpm=72, noise=200, seed=0, sample_freq=25):
+    """
+    Generate a raw IR/Red PPG window that looks like MAX30102 output.
+    Returns two lists of ints, like the ones HeartRateMonitor collects.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / sample_freq
+    phase = 2 * np.pi * bpm / 60.0 * t
+    # sharp systolic rise, slow diastolic decay
+    pulse = np.sin(phase) + 0.3 * np.sin(2 * phase + 0.8)
+    ir = 110000 + 2500 * pulse + rng.normal(0, noise, n)
+    red = 90000 + 1800 * pulse + rng.normal(0, noise, n)
+    ir = np.clip(ir, 0, 0x03FFFF).astype(np.int64)
+    red = np.clip(red, 0, 0x03FFFF).astype(np.int64)
+    return ir.tolist(), red.tolist()
+
+
+# ---------------------------------------------------------------
+# CLOCK
+# ---------------------------------------------------------------
+
+class SimClock(object):
+    """
+    Virtual monotonic clock, sleep() advances it instantly.
+    Pass clock.time and clock.sleep wherever time.monotonic/time.sleep are used.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self.sleeps = 0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps += 1
+        self.now += max(seconds, 0.0)
+
+
+# ---------------------------------------------------------------
+# BUS
+# ---------------------------------------------------------------
+
+# 100 kHz I2C: ~90 us per byte (8 bits + ack), ~3 bytes of overhead
+# (address, register, repeated start) per SMBus transaction
+I2C_BYTE_TIME = 9 / 100000.0
+I2C_TRANSACTION_TIME = 3 * I2C_BYTE_TIME
+
+
+class SimBus(object):
+    """
+    Drop-in replacement for smbus.SMBus that routes every transaction
+    to a device model and counts them.
+
+    Each transaction costs TRANSACTION_TIME + BYTE_TIME per data byte of
+    bus time. It is always added to bus_time, and also slept with SLEEP
+    when one is given (time.sleep or SimClock.sleep).
+    """
+
+    def __init__(self, transaction_time=0.0, byte_time=0.0, sleep=None):
+        self.devices = {}
+        self.transactions = 0
+        self.bytes = 0
+        self.bus_time = 0.0
+        self.transaction_time = transaction_time
+        self.byte_time = byte_time
+        self.sleep = sleep
+        self._pointer = {}
+
+    def attach(self, device):
+        self.devices[device.address] = device
+        return device
+
+    def _device(self, address):
+        try:
+            return self.devices[address]
+        except KeyError:
+            # same error a real bus gives for a missing device
+            raise OSError(121, "Remote I/O error")
+
+    def _account(self, length):
+        self.transactions += 1
+        self.bytes += length
+        duration = self.transaction_time + length * self.byte_time
+        self.bus_time += duration
+        if self.sleep is not None and duration > 0:
+            self.sleep(duration)
+
+    def _read(self, address, register, length):
+        device = self._device(address)
+        self._account(length)
+        return device.read(register, length)
+
+    def _write(self, address, register, data):
+        device = self._device(address)
+        self._account(len(data))
+        device.write(register, list(data))
+
+    def write_quick(self, address):
+        self._device(address)
+        self._account(0)
+
+    def write_byte(self, address, value):
+        # sets the register pointer for read_byte
+        self._device(address)
+        self._account(1)
+        self._pointer[address] = value & 0xFF
+
+    def read_byte(self, address):
+        register = self._pointer.get(address, 0)
+        self._pointer[address] = (register + 1) & 0xFF
+        return self._read(address, register, 1)[0]
+
+    def read_byte_data(self, address, register):
+        return self._read(address, register, 1)[0]
+
+    def write_byte_data(self, address, register, value):
+        self._write(address, register, [value & 0xFF])
+
+    def read_word_data(self, address, register):
+        lo, hi = self._read(address, register, 2)
+        return lo | (hi << 8)
+
+    def write_word_data(self, address, register, value):
+        self._write(address, register, [value & 0xFF, (value >> 8) & 0xFF])
+
+    def read_i2c_block_data(self, address, register, length=32):
+        if length > 32:
+            raise OSError(22, "Invalid argument")  # I2C_SMBUS_BLOCK_MAX
+        return self._read(address, register, length)
+
+    def write_i2c_block_data(self, address, register, data):
+        if len(data) > 32:
+            raise OSError(22, "Invalid argument")
+        self._write(address, register, data)
+
+    def close(self):
+        pass
+
+
+# ---------------------------------------------------------------
+# DEVICES
+# ---------------------------------------------------------------
+
+class SimDevice(object):
+    """
+    Base for device models that produce a new frame RATE times per second
+    of CLOCK. With rate None frames are only produced by calling produce().
+    """
+
+    def __init__(self, address, rate=None, clock=time.monotonic):
+        self.address = address
+        self.clock = clock
+        self._rate = rate
+        self._t0 = clock()
+        self._produced = 0
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate):
+        # frames already due are produced at the old rate
+        self.advance()
+        self._rate = rate
+        self._t0 = self.clock()
+        self._produced = 0
+
+    def advance(self):
+        """
+        Produce the frames due since the last call.
+        """
+        if not self._rate:
+            return
+        due = int((self.clock() - self._t0) * self._rate)
+        if due > self._produced:
+            self.produce(due - self._produced)
+            self._produced = due
+
+    def time_until(self, frames):
+        """
+        Seconds until FRAMES more frames have been produced, None without a rate.
+        """
+        if not self._rate:
+            return None
+        due = (self._produced + frames) / float(self._rate)
+        return due - (self.clock() - self._t0)
+
+    def produce(self, n):
+        raise NotImplementedError
+
+    def read(self, register, length):
+        raise NotImplementedError
+
+    def write(self, register, data):
+        raise NotImplementedError
+
+
+class SimMax30102(SimDevice):
+    """
+    Register model of the MAX30102 with a 32 sample FIFO fed by a synthetic PPG.
+
+    Samples are added with push_samples(), or produced in real time at
+    SAMPLE_RATE when one is given (CLOCK can be a SimClock).
+    """
+
+    def __init__(self, address=0x57, bpm=72, noise=200, seed=0,
+                 sample_rate=None, clock=time.monotonic):
+        SimDevice.__init__(self, address, sample_rate, clock)
+        self._ir, self._red = synthetic_ppg(n=25 * 60, bpm=bpm, noise=noise, seed=seed)
+        self._next = 0
+        self.lost = 0  # samples dropped because the FIFO was full
+        self.reset()
+
+    @property
+    def sample_rate(self):
+        return self.rate
+
+    def reset(self):
+        self.regs = bytearray(256)
+        self.regs[max30102.REG_PART_ID] = 0x15
+        self.fifo = np.zeros((max30102.FIFO_DEPTH, max30102.BYTES_PER_SAMPLE), dtype=np.uint8)
+        self.write_ptr = 0
+        self.read_ptr = 0
+        self.ovf = 0
+        self.available = 0  # unread samples, the pointers alone are ambiguous when full
+        self._byte = 0  # byte position inside the current FIFO sample
+
+    @property
+    def int_active(self):
+        """
+        State of the (active low) INT line: an enabled status bit is set.
+        """
+        self.advance()
+        return bool(self.regs[max30102.REG_INTR_STATUS_1] & self.regs[max30102.REG_INTR_ENABLE_1])
+
+    def samples_until_interrupt(self):
+        """
+        Number of new samples before INT is asserted with the current config.
+        """
+        enable = self.regs[max30102.REG_INTR_ENABLE_1]
+        if enable & max30102.INTR_PPG_RDY:
+            return 1
+        if enable & max30102.INTR_A_FULL:
+            a_full = max30102.FIFO_DEPTH - (self.regs[max30102.REG_FIFO_CONFIG] & 0x0F)
+            return max(a_full - self.available, 1)
+        return None
+
+    def produce(self, n):
+        self.push_samples(n)
+
+    def push_samples(self, n):
+        """
+        Let the sensor produce N new samples.
+        """
+        for _ in range(n):
+            if self.available == max30102.FIFO_DEPTH:
+                # rollover disabled: the sample is lost
+                self.ovf = min(self.ovf + 1, 0x1F)
+                self.lost += 1
+                continue
+            i = self._next % len(self._ir)
+            self._next += 1
+            red, ir = self._red[i], self._ir[i]
+            self.fifo[self.write_ptr] = [(red >> 16) & 0x03, (red >> 8) & 0xFF, red & 0xFF,
+                                         (ir >> 16) & 0x03, (ir >> 8) & 0xFF, ir & 0xFF]
+            self.write_ptr = (self.write_ptr + 1) % max30102.FIFO_DEPTH
+            self.available += 1
+            # PPG_RDY on every sample, A_FULL once FIFO_A_FULL slots are left
+            status = max30102.INTR_PPG_RDY
+            a_full = self.regs[max30102.REG_FIFO_CONFIG] & 0x0F
+            if self.available >= max30102.FIFO_DEPTH - a_full:
+                status |= max30102.INTR_A_FULL
+            self.regs[max30102.REG_INTR_STATUS_1] |= status
+
+    def read(self, register, length):
+        self.advance()
+        out = []
+        for _ in range(length):
+            if register == max30102.REG_FIFO_DATA:
+                # the FIFO data register does not auto-increment
+                out.append(self._read_fifo_byte())
+                continue
+            if register == max30102.REG_FIFO_WR_PTR:
+                out.append(self.write_ptr)
+            elif register == max30102.REG_OVF_COUNTER:
+                out.append(self.ovf)
+            elif register == max30102.REG_FIFO_RD_PTR:
+                out.append(self.read_ptr)
+            else:
+                out.append(self.regs[register])
+                if register in (max30102.REG_INTR_STATUS_1, max30102.REG_INTR_STATUS_2):
+                    self.regs[register] = 0  # status bits clear on read
+            register = (register + 1) & 0xFF
+        return out
+
+    def _read_fifo_byte(self):
+        if self.available == 0:
+            return 0
+        value = int(self.fifo[self.read_ptr][self._byte])
+        self._byte += 1
+        if self._byte == max30102.BYTES_PER_SAMPLE:
+            self._byte = 0
+            self.read_ptr = (self.read_ptr + 1) % max30102.FIFO_DEPTH
+            self.available -= 1
+            self.ovf = 0
+        return value
+
+    def write(self, register, data):
+        self.advance()
+        for value in data:
+            if register == max30102.REG_MODE_CONFIG and value & 0x40:
+                self.reset()
+                value &= ~0x40  # reset bit clears itself
+            if register == max30102.REG_FIFO_WR_PTR:
+                self.write_ptr = value & 0x1F
+            elif register == max30102.REG_OVF_COUNTER:
+                self.ovf = value & 0x1F
+            elif register == max30102.REG_FIFO_RD_PTR:
+                self.read_ptr = value & 0x1F
+                self._byte = 0
+            if register in (max30102.REG_FIFO_WR_PTR, max30102.REG_FIFO_RD_PTR):
+                self.available = (self.write_ptr - self.read_ptr) % max30102.FIFO_DEPTH
+            self.regs[register] = value
+            register = (register + 1) & 0xFF
+
+
+class SimTfLuna(SimDevice):
+    """
+    Register model of the TF-Luna in I2C mode.
+
+    A new frame (distance, amplitude, temperature, tick) is produced FPS
+    times per second in continuous mode, or once per write to the trigger
+    register in trigger mode. DISTANCE is a function of the frame time in
+    seconds returning centimeters.
+    """
+
+    REG_MODE = TfLunaI2C.MODE
+    REG_TRIGGER = TfLunaI2C.TRIG_ONE_SHOT
+
+    def __init__(self, address=TfLunaI2C.DEFAULT_I2C_ADDR, fps=100, distance=None,
+                 clock=time.monotonic):
+        self.frames = 0
+        self.regs = bytearray(256)
+        self.regs[TfLunaI2C.VERSION_MAJOR:TfLunaI2C.VERSION_MAJOR + 3] = bytes([3, 2, 1])
+        self.distance = distance or (lambda t: 200 + 150 * np.sin(2 * np.pi * 0.2 * t))
+        SimDevice.__init__(self, address, None, clock)
+        self._set_word(TfLunaI2C.FPS_LO, fps)
+        self.rate = fps
+        self._frame()
+
+    def _set_word(self, register, value):
+        value = int(value) & 0xFFFF
+        self.regs[register] = value & 0xFF
+        self.regs[register + 1] = value >> 8
+
+    def _frame(self):
+        t = self.clock()
+        self.frames += 1
+        self._set_word(TfLunaI2C.DIST_LO, max(self.distance(t), 0))
+        self._set_word(TfLunaI2C.AMP_LO, 1000)
+        self._set_word(TfLunaI2C.TEMP_LO, 4500)  # 0.01 C
+        self._set_word(TfLunaI2C.TICK_LO, int(t * 1000))
+
+    def produce(self, n):
+        # only the newest frame is visible in the registers
+        self._frame()
+        self.frames += n - 1
+
+    def read(self, register, length):
+        self.advance()
+        out = []
+        for _ in range(length):
+            out.append(self.regs[register])
+            register = (register + 1) & 0xFF
+        return out
+
+    def write(self, register, data):
+        self.advance()
+        for value in data:
+            self.regs[register] = value
+            if register == self.REG_TRIGGER and self.regs[self.REG_MODE] == 1:
+                self._frame()
+            register = (register + 1) & 0xFF
+        fps = self.regs[TfLunaI2C.FPS_LO] | (self.regs[TfLunaI2C.FPS_LO + 1] << 8)
+        rate = fps if self.regs[self.REG_MODE] == 0 else None
+        if rate != self.rate:
+            self.rate = rate
+
+
+class SimMpu6050(SimDevice):
+    """
+    Register model of the MPU6050: accel/temp/gyro output registers and
+    the 1024 byte FIFO, fed by a synthetic walking motion.
+    """
+
+    REG_SMPLRT_DIV = 0x19
+    REG_CONFIG = 0x1A
+    REG_GYRO_CONFIG = 0x1B
+    REG_ACCEL_CONFIG = 0x1C
+    REG_FIFO_EN = 0x23
+    REG_INT_STATUS = 0x3A
+    REG_ACCEL_XOUT_H = 0x3B
+    REG_USER_CTRL = 0x6A
+    REG_PWR_MGMT_1 = 0x6B
+    REG_FIFO_COUNT_H = 0x72
+    REG_FIFO_R_W = 0x74
+    REG_WHO_AM_I = 0x75
+
+    FIFO_SIZE = 1024
+
+    def __init__(self, address=0x68, seed=0, clock=time.monotonic):
+        self.rng = np.random.default_rng(seed)
+        self.samples = 0
+        self.lost = 0  # FIFO bytes overwritten by an overflow
+        SimDevice.__init__(self, address, None, clock)
+        self.reset()
+
+    def reset(self):
+        self.regs = bytearray(256)
+        self.regs[self.REG_WHO_AM_I] = 0x68
+        self.regs[self.REG_PWR_MGMT_1] = 0x40  # sleeping after power up
+        self.fifo = bytearray()
+        self._update_rate()
+
+    def _update_rate(self):
+        if self.regs[self.REG_PWR_MGMT_1] & 0x40:
+            rate = None
+        else:
+            # 1 kHz gyro output rate with the DLPF on, 8 kHz without
+            base = 8000.0 if self.regs[self.REG_CONFIG] & 0x07 in (0, 7) else 1000.0
+            rate = base / (1 + self.regs[self.REG_SMPLRT_DIV])
+        if rate != self.rate:
+            self.rate = rate
+
+    def _sample(self, t):
+        accel_lsb = 16384 >> (self.regs[self.REG_ACCEL_CONFIG] >> 3 & 0x03)
+        gyro_lsb = 131.0 / (1 << (self.regs[self.REG_GYRO_CONFIG] >> 3 & 0x03))
+        step = np.sin(2 * np.pi * 1.8 * t)
+        accel = np.array([0.05 * step, 0.1 * np.cos(2 * np.pi * 0.9 * t), 1.0 + 0.2 * step])
+        gyro = np.array([5 * step, 2.0, -3 * step])  # deg/s
+        accel = accel + self.rng.normal(0, 0.01, 3)
+        gyro = gyro + self.rng.normal(0, 0.2, 3)
+        raw = np.concatenate([accel * accel_lsb, [(30.0 - 36.53) * 340], gyro * gyro_lsb])
+        return np.clip(np.round(raw), -32768, 32767).astype(">i2").tobytes()
+
+    def produce(self, n):
+        t0 = self.clock() - n / float(self.rate)
+        fifo_en = self.regs[self.REG_FIFO_EN]
+        use_fifo = self.regs[self.REG_USER_CTRL] & 0x40 and fifo_en
+        self.samples += n
+        # without the FIFO only the newest sample is visible
+        first = 0 if use_fifo else n - 1
+        for k in range(first, n):
+            data = self._sample(t0 + (k + 1) / float(self.rate))
+            if use_fifo:
+                # FIFO order follows the register map: accel, temp, gyro x/y/z
+                if fifo_en & 0x08:
+                    self.fifo += data[0:6]
+                if fifo_en & 0x80:
+                    self.fifo += data[6:8]
+                for bit, offset in ((0x40, 8), (0x20, 10), (0x10, 12)):
+                    if fifo_en & bit:
+                        self.fifo += data[offset:offset + 2]
+        if use_fifo and len(self.fifo) > self.FIFO_SIZE:
+            # the oldest data is overwritten
+            self.lost += len(self.fifo) - self.FIFO_SIZE
+            del self.fifo[:len(self.fifo) - self.FIFO_SIZE]
+            self.regs[self.REG_INT_STATUS] |= 0x10
+        if n > 0:
+            self.regs[self.REG_ACCEL_XOUT_H:self.REG_ACCEL_XOUT_H + 14] = data
+            self.regs[self.REG_INT_STATUS] |= 0x01  # DATA_RDY
+
+    def read(self, register, length):
+        self.advance()
+        out = []
+        for _ in range(length):
+            if register == self.REG_FIFO_R_W:
+                # the FIFO register does not auto-increment
+                remaining = length - len(out)
+                chunk = self.fifo[:remaining]
+                del self.fifo[:remaining]
+                out.extend(chunk)
+                out.extend([0] * (remaining - len(chunk)))
+                break
+            if register == self.REG_FIFO_COUNT_H:
+                out.append(len(self.fifo) >> 8)
+            elif register == self.REG_FIFO_COUNT_H + 1:
+                out.append(len(self.fifo) & 0xFF)
+            else:
+                out.append(self.regs[register])
+                if register == self.REG_INT_STATUS:
+                    self.regs[register] = 0
+            register = (register + 1) & 0xFF
+        return out
+
+    def write(self, register, data):
+        self.advance()
+        for value in data:
+            if register == self.REG_PWR_MGMT_1 and value & 0x80:
+                self.reset()
+                value &= 0x7F
+                value |= 0x40
+            if register == self.REG_USER_CTRL and value & 0x04:
+                # the FIFO is only reset while FIFO_EN is cleared
+                if not value & 0x40:
+                    self.fifo = bytearray()
+                value &= ~0x04  # FIFO_RESET clears itself
+            if register == self.REG_FIFO_R_W:
+                self.fifo.append(value)
+            else:
+                self.regs[register] = value
+            register = (register + 1) & 0xFF
+        self._update_rate()
+
+
+class SimInterruptPin(object):
+    """
+    INT line of a SimMax30102, same interface as max30102.GpioInterruptPin.
+    """
+
+    def __init__(self, device, sleep=time.sleep):
+        self.device = device
+        self.sleep = sleep
+        self.waits = 0
+
+    @property
+    def is_active(self):
+        return self.device.int_active
+
+    def wait_for_active(self, timeout=None):
+        self.waits += 1
+        if self.is_active:
+            return True
+        # sleep straight to the sample that will assert INT
+        samples = self.device.samples_until_interrupt()
+        delay = timeout
+        if samples is not None and self.device.rate:
+            delay = self.device.time_until(samples) + 1e-6
+            if timeout is not None:
+                delay = min(delay, timeout)
+        self.sleep(max(delay or 0.0, 0.0))
+        return self.is_active
+
+    def close(self):
+        pass
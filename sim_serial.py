@@ -0,0 +1,319 @@
+"""
+Serial port stand-ins and byte streams for the UART devices
+(TF-Luna in UART mode, GPS module).
+
+ByteStream has the parts of serial.Serial the readers use (read,
+readline, in_waiting), so it can replace a real port in benchmarks.
+"""
+import struct
+from functools import reduce
+
+
+# ---------------------------------------------------------------
+# FRAMES
+# ---------------------------------------------------------------
+
+def tfluna_frame(dist, amp=1000, temp=2256):
+    """
+    One 9-byte TF-Luna UART frame: 'YY', distance, amplitude, temperature
+    (C = temp / 8 - 256), checksum.
+    """
+    body = b"YY" + struct.pack("<HHH", dist, amp, temp)
+    return body + bytes([sum(body) & 0xFF])
+
+
+def nmea_sentence(body):
+    """
+    Wrap an NMEA body ('GPGGA,...') with '$', checksum and CRLF.
+    """
+    checksum = reduce(lambda a, c: a ^ c, body.encode("ascii"), 0)
+    return "${0}*{1:02X}\r\n".format(body, checksum).encode("ascii")
+
+
+def ubx_frame(msg_class, msg_id, payload=b""):
+    """
+    UBX frame: sync, class, id, length, payload, Fletcher checksum.
+    """
+    body = struct.pack("<BBH", msg_class, msg_id, len(payload)) + bytes(payload)
+    ck_a = ck_b = 0
+    for c in body:
+        ck_a = (ck_a + c) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return b"\xb5\x62" + body + bytes([ck_a, ck_b])
+
+
+def nmea_epoch(t, lat=45.4215, lon=-75.6972, speed_knots=2.5):
+    """
+    The sentences a typical module sends for one fix at T seconds:
+    GGA, GSA, 3 x GSV, RMC, VTG.
+    """
+    hhmmss = "{0:02d}{1:02d}{2:05.2f}".format(int(t // 3600) % 24, int(t // 60) % 60, t % 60)
+    lat = lat + 1e-5 * t
+    lat_s = "{0:02d}{1:07.4f}".format(int(abs(lat)), (abs(lat) % 1) * 60)
+    lon_s = "{0:03d}{1:07.4f}".format(int(abs(lon)), (abs(lon) % 1) * 60)
+    ns = "N" if lat >= 0 else "S"
+    ew = "E" if lon >= 0 else "W"
+    sentences = [
+        "GPGGA,{0},{1},{2},{3},{4},1,08,0.9,70.0,M,-34.0,M,,".format(hhmmss, lat_s, ns, lon_s, ew),
+        "GPGSA,A,3,04,05,09,12,24,25,29,31,,,,,1.8,0.9,1.5",
+    ]
+    for i in range(3):
+        sentences.append("GPGSV,3,{0},11,{1:02d},40,083,46,{2:02d},17,308,41,{3:02d},07,344,39,{4:02d},22,228,45"
+                         .format(i + 1, 4 * i + 1, 4 * i + 2, 4 * i + 3, 4 * i + 4))
+    sentences.append("GPRMC,{0},A,{1},{2},{3},{4},{5:.1f},054.7,191194,020.3,E".format(
+        hhmmss, lat_s, ns, lon_s, ew, speed_knots))
+    sentences.append("GPVTG,054.7,T,034.4,M,{0:.1f},N,{1:.1f},K".format(speed_knots, speed_knots * 1.852))
+    return b"".join(nmea_sentence(s) for s in sentences)
+
+
+# ---------------------------------------------------------------
+# PORTS
+# ---------------------------------------------------------------
+
+class ByteStream(object):
+    """
+    serial.Serial stand-in reading from a bytes buffer. With loop=True
+    the buffer repeats forever, otherwise reads return short at the end
+    (like a read timeout).
+    """
+
+    def __init__(self, data, loop=True):
+        self.data = bytes(data)
+        self.loop = loop
+        self.pos = 0
+        self.reads = 0
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        if self.loop:
+            return len(self.data)
+        return len(self.data) - self.pos
+
+    def read(self, size=1):
+        self.reads += 1
+        out = self.data[self.pos:self.pos + size]
+        self.pos += len(out)
+        if self.loop and len(out) < size:
+            self.pos = 0
+            out += self.read(size - len(out))
+        return out
+
+    def readline(self):
+        self.reads += 1
+        end = self.data.find(b"\n", self.pos)
+        if end < 0:
+            out = self.data[self.pos:]
+            self.pos = len(self.data)
+            if self.loop:
+                self.pos = 0
+                out += self.readline()
+            return out
+        out = self.data[self.pos:end + 1]
+        self.pos = end + 1
+        return out
+
+    def write(self, data):
+        return len(data)
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class PacedStream(ByteStream):
+    """
+    ByteStream whose bytes arrive at BYTE_RATE per second of CLOCK (a
+    UART at 115200 baud moves 11520 bytes/s). Reads never wait: they
+    return what has arrived, like a port with timeout=0.
+    """
+
+    def __init__(self, data, byte_rate=11520, clock=None, loop=True):
+        ByteStream.__init__(self, data, loop)
+        self.byte_rate = byte_rate
+        self.clock = clock
+        self.t0 = clock()
+        self.consumed = 0
+
+    @property
+    def in_waiting(self):
+        arrived = int((self.clock() - self.t0) * self.byte_rate)
+        if not self.loop:
+            arrived = min(arrived, len(self.data))
+        return arrived - self.consumed
+
+    def read(self, size=1):
+        size = min(size, self.in_waiting)
+        if size <= 0:
+            return b""
+        self.consumed += size
+        return ByteStream.read(self, size)
+
+    def readline(self):
+        raise NotImplementedError("PacedStream only supports read()")
+
+
+class FakeGpsModule(object):
+    """
+    Scripted GPS module behind a serial port, to test the startup
+    configuration without hardware.
+
+    chip="mtk" understands PMTK314/220/251, chip="ublox" UBX CFG-MSG,
+    CFG-RATE and CFG-PRT, chip=None ignores every command. Sentences
+    go out at the module baud (10 bits per byte); epochs that do not fit
+    are dropped like on a real module. When the host `baudrate` differs
+    from the module's, the host reads garbage and its commands are lost.
+    """
+
+    NAMES = ("GGA", "GLL", "GSA", "GSV", "RMC", "VTG")  # UBX NMEA ids 0-5
+    PMTK314_ORDER = ("GLL", "RMC", "VTG", "GGA", "GSA", "GSV")
+
+    def __init__(self, chip="mtk", baud=9600, rate=1, clock=None, max_baud=115200,
+                 max_rate=10):
+        self.chip = chip
+        self.baud = baud
+        self.rate = rate
+        self.max_baud = max_baud
+        self.max_rate = max_rate
+        self.baudrate = baud  # host side, like serial.Serial.baudrate
+        self.clock = clock
+        self.enabled = set(self.NAMES)
+        self.commands = []
+        self.dropped_epochs = 0
+        self.is_open = True
+        self._tx = bytearray()  # sentences not yet on the wire
+        self._rx = bytearray()  # on the wire, not yet read by the host
+        self._in = bytearray()
+        self._wire_time = clock()
+        self._next_epoch = clock()
+
+    # -----------------------------------------------------
+    # module side
+    # -----------------------------------------------------
+    def _advance(self):
+        now = self.clock()
+        while self._next_epoch <= now:
+            if len(self._tx) < 512:
+                for line in nmea_epoch(self._next_epoch).splitlines(keepends=True):
+                    if line[3:6].decode() in self.enabled:
+                        self._tx += line
+            else:
+                self.dropped_epochs += 1
+            self._next_epoch += 1.0 / self.rate
+        n = int((now - self._wire_time) * self.baud / 10)
+        if n > 0:
+            self._wire_time += n * 10.0 / self.baud
+            chunk = self._tx[:n]
+            del self._tx[:n]
+            self._rx += chunk if self.baudrate == self.baud else b"\xff" * len(chunk)
+
+    def _set_rate(self, rate):
+        self.rate = rate
+        self._next_epoch = min(self._next_epoch, self.clock() + 1.0 / rate)
+
+    def _reply(self, data):
+        # replies go out before the queued sentences
+        self._tx[0:0] = data
+
+    def _pmtk(self, line):
+        fields = line[1:line.rfind(b"*")].decode().split(",")
+        command = int(fields[0][4:])
+        if command == 314:
+            self.enabled = {name for name, flag in zip(self.PMTK314_ORDER, fields[1:]) if flag != "0"}
+        elif command == 220:
+            rate = 1000.0 / int(fields[1])
+            if rate > self.max_rate:
+                self._reply(nmea_sentence("PMTK001,220,2"))  # valid but failed
+                return
+            self._set_rate(rate)
+        elif command == 251:
+            if int(fields[1]) <= self.max_baud:
+                self.baud = int(fields[1])
+            return  # no acknowledgement for a baud change
+        self._reply(nmea_sentence("PMTK001,{0},3".format(command)))
+
+    def _ubx(self, msg_class, msg_id, payload):
+        if msg_class != 0x06:
+            return
+        if msg_id == 0x01:
+            if payload[0] == 0xF0 and payload[1] < len(self.NAMES):
+                name = self.NAMES[payload[1]]
+                if payload[2]:
+                    self.enabled.add(name)
+                else:
+                    self.enabled.discard(name)
+        elif msg_id == 0x08:
+            rate = 1000.0 / struct.unpack_from("<H", payload)[0]
+            if rate > self.max_rate:
+                self._reply(ubx_frame(0x05, 0x00, bytes([msg_class, msg_id])))  # NAK
+                return
+            self._set_rate(rate)
+        elif msg_id == 0x00:
+            baud = struct.unpack_from("<I", payload, 8)[0]
+            self._reply(ubx_frame(0x05, 0x01, bytes([msg_class, msg_id])))
+            if baud <= self.max_baud:
+                self.baud = baud
+            return
+        self._reply(ubx_frame(0x05, 0x01, bytes([msg_class, msg_id])))
+
+    def _parse_commands(self):
+        buf = self._in
+        while buf:
+            if buf[:1] == b"$":
+                end = buf.find(b"\n")
+                if end < 0:
+                    return
+                line = bytes(buf[:end + 1]).strip()
+                del buf[:end + 1]
+                self.commands.append(line)
+                if self.chip == "mtk" and line.startswith(b"$PMTK"):
+                    self._pmtk(line)
+            elif buf[:2] == b"\xb5\x62":
+                if len(buf) < 8:
+                    return
+                length = struct.unpack_from("<H", buf, 4)[0]
+                if len(buf) < 8 + length:
+                    return
+                frame = bytes(buf[:8 + length])
+                del buf[:8 + length]
+                self.commands.append(frame)
+                if self.chip == "ublox" and ubx_frame(frame[2], frame[3], frame[6:-2]) == frame:
+                    self._ubx(frame[2], frame[3], frame[6:-2])
+            else:
+                del buf[:1]
+
+    # -----------------------------------------------------
+    # serial.Serial side
+    # -----------------------------------------------------
+    @property
+    def in_waiting(self):
+        self._advance()
+        return len(self._rx)
+
+    def read(self, size=1):
+        self._advance()
+        out = bytes(self._rx[:size])
+        del self._rx[:size]
+        return out
+
+    def readline(self):
+        self._advance()
+        end = self._rx.find(b"\n")
+        end = len(self._rx) if end < 0 else end + 1
+        return self.read(end)
+
+    def write(self, data):
+        self._advance()
+        if self.baudrate == self.baud:
+            self._in += data
+            self._parse_commands()
+        return len(data)
+
+    def reset_input_buffer(self):
+        self._advance()
+        del self._rx[:]
+
+    def close(self):
+        self.is_open = False
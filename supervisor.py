@@ -0,0 +1,244 @@
+"""
+Sensor supervisor: initializes and reconnects drivers on background
+threads so the main loop never waits for hardware.
+
+Every sensor has its own thread. While the sensor has no driver the
+thread calls its init function; a failure (None or an exception) is
+retried after an exponential backoff with jitter, so a missing sensor
+costs a few attempts a minute and unplugged sensors do not retry in
+lockstep. A ready driver is handed over by a single reference swap:
+the loop just calls get() every iteration.
+
+    sup = Supervisor()
+    sup.add("lidar", init_lidar, close=lambda d: d.stop())
+    sup.start()
+    ...
+    lidar = sup.get("lidar")           # driver or None, never blocks
+    try:
+        lidar.read_data()
+    except Exception as e:
+        sup.failed("lidar", lidar, e)  # dropped now, closed and retried in the background
+
+An optional CHECK(driver) is polled every CHECK_INTERVAL on the thread,
+for drivers that fail inside their own threads. health() reports state,
+attempts, failures, last error and availability per sensor.
+"""
+import random
+import threading
+import time
+
+BASE_DELAY = 0.5
+MAX_DELAY = 30.0
+JITTER = 0.5          # a delay is shortened by up to half
+CHECK_INTERVAL = 1.0
+
+# states
+STARTING = "starting"
+UP = "up"
+BACKOFF = "backoff"
+STOPPED = "stopped"
+
+
+class Supervised(object):
+    """
+    One sensor: its driver slot, init/close/check functions and health.
+    """
+
+    def __init__(self, name, init, close=None, check=None, clock=time.monotonic):
+        self.name = name
+        self.init = init
+        self.close = close
+        self.check = check
+        self.clock = clock
+        self.driver = None
+        self.state = STARTING
+        self.attempts = 0
+        self.init_failures = 0
+        self.runtime_failures = 0
+        self.consecutive = 0
+        self.last_error = None
+        self.last_init_time = 0.0
+        self.next_attempt = None
+        self.created = clock()
+        self.first_attempt = None
+        self.first_up = None    # first handover, for the startup timeline
+        self.up_since = None
+        self.up_total = 0.0
+        self.wake = threading.Event()
+        self.closing = []   # failed drivers, closed by the thread
+        self.thread = None
+
+    def set_up(self, driver, now):
+        self.driver = driver  # the handover: one reference swap
+        self.state = UP
+        self.up_since = now
+        if self.first_up is None:
+            self.first_up = now
+        self.consecutive = 0
+        self.next_attempt = None
+
+    def set_down(self, error, now):
+        if self.up_since is not None:
+            self.up_total += now - self.up_since
+            self.up_since = None
+        self.driver = None
+        self.last_error = str(error) if error is not None else None
+
+    def health(self):
+        now = self.clock()
+        up = self.up_total + (now - self.up_since if self.up_since is not None else 0.0)
+        return {
+            "state": self.state,
+            "attempts": self.attempts,
+            "init_failures": self.init_failures,
+            "runtime_failures": self.runtime_failures,
+            "last_error": self.last_error,
+            "last_init_ms": self.last_init_time * 1e3,
+            "up_s": now - self.up_since if self.up_since is not None else 0.0,
+            "availability": up / max(now - self.created, 1e-9),
+            "retry_in_s": max(self.next_attempt - now, 0.0) if self.next_attempt else None,
+        }
+
+
+class Supervisor(object):
+    """
+    One thread per added sensor; start() after the last add().
+    """
+
+    def __init__(self, base_delay=BASE_DELAY, max_delay=MAX_DELAY, jitter=JITTER,
+                 check_interval=CHECK_INTERVAL, clock=time.monotonic, rng=None, verbose=True):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.check_interval = check_interval
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.verbose = verbose
+        self.sensors = {}
+        self.running = False
+
+    def add(self, name, init, close=None, check=None):
+        self.sensors[name] = Supervised(name, init, close, check, self.clock)
+        return self
+
+    def get(self, name):
+        """
+        The current driver for NAME, or None while it is (re)connecting.
+        """
+        return self.sensors[name].driver
+
+    def failed(self, name, driver=None, error=None):
+        """
+        The loop saw DRIVER fail: drop it now; the thread closes it and
+        reconnects. A stale report about an older driver is ignored.
+        """
+        sensor = self.sensors[name]
+        if driver is not None and driver is not sensor.driver:
+            return
+        self._drop(sensor, error)
+
+    def _drop(self, sensor, error):
+        driver = sensor.driver
+        if driver is None:
+            return
+        sensor.set_down(error, self.clock())
+        sensor.state = STARTING
+        sensor.runtime_failures += 1
+        sensor.closing.append(driver)
+        self._log(f"[SUP] {sensor.name} lost: {error}")
+        sensor.wake.set()
+
+    def delay(self, failures):
+        """
+        Backoff before the next attempt after FAILURES failures in a row.
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+        return delay * (1.0 - self.jitter * self.rng.random())
+
+    def start(self):
+        self.running = True
+        for sensor in self.sensors.values():
+            sensor.thread = threading.Thread(target=self._run, args=(sensor,),
+                                             name=f"supervisor-{sensor.name}")
+            sensor.thread.daemon = True
+            sensor.thread.start()
+        return self
+
+    def _run(self, sensor):
+        while self.running:
+            while sensor.closing:
+                self._close(sensor, sensor.closing.pop())
+            if sensor.driver is None:
+                self._attempt(sensor)
+                continue
+            sensor.wake.wait(self.check_interval)
+            sensor.wake.clear()
+            driver = sensor.driver
+            if driver is not None and sensor.check is not None and self.running:
+                try:
+                    healthy = sensor.check(driver)
+                except Exception as e:
+                    healthy, error = False, e
+                else:
+                    error = "health check failed"
+                if not healthy:
+                    self._drop(sensor, error)
+
+    def _attempt(self, sensor):
+        sensor.attempts += 1
+        start = self.clock()
+        if sensor.first_attempt is None:
+            sensor.first_attempt = start
+        try:
+            driver = sensor.init()
+            error = None if driver is not None else "init returned None"
+        except Exception as e:
+            driver, error = None, e
+        now = self.clock()
+        sensor.last_init_time = now - start
+        if not self.running:
+            if driver is not None:
+                self._close(sensor, driver)
+            return
+        if driver is not None:
+            sensor.set_up(driver, now)
+            self._log(f"[SUP] {sensor.name} up (attempt {sensor.attempts}, "
+                      f"init {sensor.last_init_time * 1e3:.0f} ms)")
+            return
+        sensor.init_failures += 1
+        sensor.consecutive += 1
+        sensor.last_error = str(error)
+        sensor.state = BACKOFF
+        delay = self.delay(sensor.consecutive)
+        sensor.next_attempt = now + delay
+        if sensor.consecutive == 1:
+            self._log(f"[SUP] {sensor.name} unavailable: {error}, retrying with backoff")
+        sensor.wake.wait(delay)
+        sensor.wake.clear()
+
+    def _close(self, sensor, driver):
+        if sensor.close is None:
+            return
+        try:
+            sensor.close(driver)
+        except Exception:
+            pass
+
+    def health(self):
+        return {name: sensor.health() for name, sensor in self.sensors.items()}
+
+    def stop(self, timeout=2.0):
+        self.running = False
+        for sensor in self.sensors.values():
+            sensor.wake.set()
+        for sensor in self.sensors.values():
+            if sensor.thread is not None:
+                sensor.thread.join(timeout)
+            if sensor.driver is not None:
+                self._close(sensor, sensor.driver)
+                sensor.set_down(None, self.clock())
+            sensor.state = STOPPED
+
+    def _log(self, message):
+        if self.verbose:
+            print(message)
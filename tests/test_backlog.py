@@ -0,0 +1,103 @@
+import json
+import os
+
+from backlog import Backlog
+from bt_sender import BluetoothSender
+from sim_i2c import SimClock
+
+
+def take_all(backlog, n=7):
+    out = []
+    while True:
+        chunk = backlog.take(n)
+        if not chunk:
+            return out
+        out += chunk
+
+
+def test_ram_only_keeps_the_newest():
+    backlog = Backlog(ram_packets=10)
+    for i in range(25):
+        backlog.append({"i": i}, float(i))
+    backlog.spill()  # nowhere to spill to
+    assert len(backlog) == 10 and backlog.dropped == 15
+    assert [t for t, _ in take_all(backlog)] == [float(i) for i in range(15, 25)]
+
+
+def test_spill_and_replay_in_order(tmp_path):
+    path = str(tmp_path)
+    with open(os.path.join(path, "00000007.seg"), "w") as f:
+        f.write("[0, {}]\n")  # from a previous boot
+    backlog = Backlog(path, ram_packets=10, segment_packets=4)
+    assert os.listdir(path) == []
+    for i in range(30):
+        backlog.append({"i": i}, float(i))
+        if i % 5 == 4:
+            backlog.spill()
+    # RAM is back at its budget, the rest went out in segments of 4
+    assert backlog.stats()["ram_packets"] == 10
+    assert backlog.spilled == 20 and len(os.listdir(path)) == 5
+    assert len(backlog) == 30
+
+    # replay while new packets keep coming in
+    out = backlog.take(6)
+    for i in range(30, 35):
+        backlog.append({"i": i}, float(i))
+    out += take_all(backlog)
+    assert [packet["i"] for t, packet in out] == list(range(35))
+    assert [t for t, packet in out] == [float(i) for i in range(35)]
+    assert os.listdir(path) == [] and backlog.disk_used == 0
+    assert backlog.dropped == 0
+
+
+def test_disk_budget_drops_the_oldest_segments(tmp_path):
+    line = len(json.dumps([0.0, {"i": 0}])) + 1
+    backlog = Backlog(str(tmp_path), ram_packets=4, segment_packets=4,
+                      disk_bytes=3 * 4 * line)
+    for i in range(40):
+        backlog.append({"i": i}, float(i))
+        backlog.spill()
+    assert backlog.disk_used <= 3 * 4 * line
+    assert backlog.dropped > 0
+    got = [packet["i"] for t, packet in take_all(backlog)]
+    # a gap-free run of the newest packets
+    assert got == list(range(40 - len(got), 40))
+    assert len(got) + backlog.dropped == 40
+
+
+class Phone(object):
+    def __init__(self):
+        self.data = bytearray()
+
+    def send(self, data):
+        self.data += data
+        return len(data)
+
+    def packets(self):
+        return [json.loads(line) for line in bytes(self.data).splitlines()]
+
+
+def test_sender_replays_the_backlog_after_live_packets():
+    clock = SimClock()
+    sender = BluetoothSender(clock=clock.time, transports=[])
+    for i in range(100):
+        sender.send_data({"i": i, "dist_cm": 300})
+        clock.sleep(0.01)
+    assert len(sender.backlog) == 100
+    phone = Phone()
+    sender.add_client(phone, "phone")
+    for i in range(100, 110):
+        sender.send_data({"i": i, "dist_cm": 300})
+        sender.flush()
+        clock.sleep(0.01)
+    while len(sender.backlog):
+        sender.flush()
+    sender.flush()
+    got = [packet["i"] for packet in phone.packets()]
+    assert sorted(got) == list(range(110))
+    # the backlog and the live stream each stay in order
+    assert [i for i in got if i < 100] == list(range(100))
+    assert [i for i in got if i >= 100] == list(range(100, 110))
+    # the first live packet did not wait for the whole backlog
+    assert got.index(100) < 100
+    assert sender.catchup["packets"] == 100
@@ -0,0 +1,149 @@
+import errno
+import json
+import socket
+import threading
+import time
+
+from bt_sender import BluetoothSender, Subscriber
+from sim_i2c import SimClock
+from transport import UnixTransport
+
+
+class SlowLink(object):
+    """
+    Socket stand-in that takes BYTE_RATE bytes per second of simulated
+    time and refuses the rest, like a full RFCOMM buffer.
+    """
+
+    def __init__(self, clock, byte_rate):
+        self.clock = clock
+        self.byte_rate = byte_rate
+        self.room = 0.0
+        self.last = clock.time()
+        self.received = bytearray()
+        self.arrivals = []  # (time, line)
+
+    def send(self, data):
+        now = self.clock.time()
+        self.room = min(self.room + (now - self.last) * self.byte_rate, 512.0)
+        self.last = now
+        n = min(len(data), int(self.room))
+        if n == 0:
+            raise BlockingIOError(errno.EAGAIN, "full")
+        self.room -= n
+        self.received += data[:n]
+        while b"\n" in self.received:
+            line, _, rest = bytes(self.received).partition(b"\n")
+            self.received = bytearray(rest)
+            self.arrivals.append((now, json.loads(line)))
+        return n
+
+
+def test_obstacle_goes_ahead_of_a_backpressured_batch():
+    clock = SimClock()
+    budget = BluetoothSender.LATENCY_BUDGET
+    link = SlowLink(clock, byte_rate=20000.0)
+    client = Subscriber(link, "slow", clock.time)
+    sent = {}
+    for i in range(400):
+        now = clock.time()
+        urgent = i % 20 == 19
+        packet = {"i": i, "t": now, "dist_cm": 50 if urgent else 300, "pad": "x" * 80}
+        sent[i] = now
+        client.offer(packet, urgent, now, budget)
+        due = client.due(now, budget)
+        if due == 0.0:
+            client.take(now, budget)
+        client.write()
+        clock.sleep(0.005)  # 200 packets/s into a link that carries about 150
+    assert len(client.out) > 0  # still backpressured at the end
+
+    obstacles = [t - sent[p["i"]] for t, p in link.arrivals if p["dist_cm"] == 50]
+    ordinary = [t - sent[p["i"]] for t, p in link.arrivals if p["dist_cm"] != 50]
+    assert len(obstacles) >= 19
+    assert max(obstacles) <= budget
+    # the ordinary packets did wait for the link, or were dropped
+    assert max(ordinary) > 2 * budget
+    assert client.packets_dropped > 0
+
+
+def test_obstacle_never_splits_a_half_sent_frame():
+    clock = SimClock()
+    link = SlowLink(clock, byte_rate=1000.0)
+    client = Subscriber(link, "slow", clock.time)
+    for i in range(5):
+        client.offer({"i": i, "dist_cm": 300, "pad": "x" * 80}, False, clock.time(), 0.0)
+    client.take(clock.time(), 0.0)
+    clock.sleep(0.05)  # room for half a line
+    client.write()
+    assert 0 < client._sent
+    client.offer({"i": 99, "dist_cm": 50}, True, clock.time(), 0.0)
+    client.take(clock.time(), 0.0)
+    for _ in range(100):
+        clock.sleep(0.05)
+        try:
+            client.write()
+        except BlockingIOError:
+            pass
+    # every line arrived whole, the obstacle right after the half sent one
+    assert [p["i"] for _, p in link.arrivals] == [0, 99, 1, 2, 3, 4]
+
+
+def wait_until(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.01)
+
+
+def read_lines(sock, lines):
+    buf = b""
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            return
+        buf += data
+        *complete, buf = buf.split(b"\n")
+        lines += [json.loads(line) for line in complete]
+
+
+def test_fan_out_to_every_phone_past_a_stalled_one(tmp_path):
+    link = UnixTransport(str(tmp_path / "bt.sock"))
+    sender = BluetoothSender(transports=[link], max_clients=3, max_pending=16)
+    sender.start()
+    phones = []
+    try:
+        wait_until(lambda: sender.server_socks)
+        phones = [link.connect() for _ in range(3)]
+        wait_until(lambda: len(sender.clients) == 3)
+        # a fourth phone is refused and sees the connection close
+        extra = link.connect()
+        extra.settimeout(5.0)
+        assert extra.recv(1) == b""
+        extra.close()
+
+        received = [[], []]
+        readers = [threading.Thread(target=read_lines, args=(phone, lines), daemon=True)
+                   for phone, lines in zip(phones, received)]
+        for reader in readers:
+            reader.start()
+        # phones[2] never reads; its socket buffer fills up after a few hundred
+        start = time.monotonic()
+        for i in range(800):
+            sender.send_data({"i": i, "dist_cm": 300, "pad": "x" * 1000})
+            time.sleep(0.002)
+        # the main loop never waited on the stalled phone
+        assert time.monotonic() - start < 800 * 0.002 + 2.0
+        wait_until(lambda: all(len(lines) == 800 for lines in received))
+        for lines in received:
+            assert [packet["i"] for packet in lines] == list(range(800))
+
+        fast, fast2, stalled = sender.stats()["per_client"]
+        assert fast["packets_dropped"] == fast2["packets_dropped"] == 0
+        assert stalled["packets_dropped"] > 0
+        assert stalled["queued"] <= 16
+        assert stalled["unsent_bytes"] > 0
+    finally:
+        sender.stop()
+        for phone in phones:
+            phone.close()
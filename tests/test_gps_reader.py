@@ -0,0 +1,100 @@
+import pytest
+
+from gps_reader import BAUD_RATE, GpsConfigurator, GpsService, NmeaParser
+from sim_i2c import SimClock
+from sim_serial import FakeGpsModule, nmea_epoch, nmea_sentence
+
+
+def test_parser_stamps_the_time_on_position_sentences_only():
+    parser = NmeaParser()
+    lines = nmea_epoch(3600.0, speed_knots=2.0).splitlines()
+    stamped = {}
+    for now, line in enumerate(lines):
+        fix = parser.feed_line(line, now)
+        if fix is not None:
+            stamped[line[3:6]] = fix.time
+    # GSA and GSV are skipped, VTG keeps the RMC time
+    assert parser.skipped == 4 and parser.sentences == 3
+    assert stamped == {b"GGA": 0, b"RMC": 5, b"VTG": 5}
+    fix = parser.fix
+    assert fix.valid and fix.utc == "010000.00" and fix.sats == 8
+    assert fix.lat == pytest.approx(45.4215 + 0.036, abs=1e-4)
+    assert fix.lon == pytest.approx(-75.6972, abs=1e-4)
+    assert fix.speed == pytest.approx(3.7 / 3.6)  # VTG km/h wins over RMC knots
+    assert fix.course == pytest.approx(54.7)
+
+
+def test_parser_rejects_bad_sentences():
+    parser = NmeaParser()
+    good = nmea_sentence("GPVTG,054.7,T,034.4,M,2.0,N,3.7,K")
+    assert parser.feed_line(good.replace(b"054.7", b"055.7"), 1.0) is None
+    assert parser.bad_checksums == 1
+    assert parser.feed_line(nmea_sentence("GPGGA,010000.00,45x,N"), 2.0) is None
+    assert parser.errors == 1
+    # a lone VTG gives a course but no fix time
+    fix = parser.feed_line(good, 3.0)
+    assert fix.course == pytest.approx(54.7) and fix.time is None and not fix.valid
+
+
+def configure(**module):
+    clock = SimClock()
+    gps = FakeGpsModule(clock=clock.time, **module)
+    result = GpsConfigurator(gps, clock=clock.time, sleep=clock.sleep).configure(10, 115200)
+    return clock, gps, result
+
+
+def read_fixes(clock, gps, seconds=3.0):
+    service = GpsService(gps, clock=clock.time)
+    utcs = set()
+    end = clock.time() + seconds
+    while clock.time() < end:
+        clock.sleep(0.1)
+        fix = service.fix()
+        if fix.valid:
+            utcs.add(fix.utc)
+    return utcs
+
+
+@pytest.mark.parametrize("chip", ["mtk", "ublox"])
+def test_detects_the_module_and_switches_to_high_rate(chip):
+    clock, gps, result = configure(chip=chip)
+    assert result.ok, result.message
+    assert (result.chip, result.baud, result.rate_hz) == (chip, 115200, 10)
+    assert result.measured_hz >= 8
+    assert (gps.baud, gps.baudrate, gps.rate) == (115200, 115200, 10)
+    # the probe already trimmed the output to what the parser keeps
+    assert gps.enabled == {"GGA", "RMC", "VTG"}
+
+
+def test_module_already_at_high_baud():
+    # battery backed config from a previous run: 115200 before we start
+    clock = SimClock()
+    gps = FakeGpsModule(chip="mtk", baud=115200, clock=clock.time)
+    gps.baudrate = BAUD_RATE
+    result = GpsConfigurator(gps, clock=clock.time, sleep=clock.sleep).configure(10, 115200)
+    assert result.ok and result.chip == "mtk"
+    assert gps.baudrate == 115200
+
+
+def test_unresponsive_module_is_left_at_the_default():
+    clock, gps, result = configure(chip=None)
+    assert not result.ok
+    assert result.chip is None and result.baud == BAUD_RATE
+    assert (gps.baud, gps.baudrate, gps.rate) == (BAUD_RATE, BAUD_RATE, 1)
+    assert gps.commands  # it was asked
+    assert len(read_fixes(clock, gps)) >= 2
+
+
+@pytest.mark.parametrize("chip", ["mtk", "ublox"])
+@pytest.mark.parametrize("limit", [{"max_rate": 5}, {"max_baud": 57600}])
+def test_recovers_after_the_baud_change(chip, limit):
+    # the module takes the new baud but refuses 10 Hz, or ignores the
+    # baud change so the host talks to it at the wrong speed: either way
+    # both ends must end up at 9600 baud / 1 Hz again
+    clock, gps, result = configure(chip=chip, **limit)
+    assert not result.ok and result.chip == chip
+    assert (result.baud, result.rate_hz) == (BAUD_RATE, 1)
+    assert "not acknowledged" in result.message
+    assert (gps.baud, gps.baudrate, gps.rate) == (BAUD_RATE, BAUD_RATE, 1)
+    assert result.measured_hz == pytest.approx(1.0, abs=0.5)
+    assert 2 <= len(read_fixes(clock, gps)) <= 4
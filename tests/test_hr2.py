@@ -0,0 +1,19 @@
+import numpy as np
+
+from hr2 import HeartRateMonitor
+from sim_i2c import synthetic_ppg
+
+
+def test_streaming_estimator_reset_on_finger_removal():
+    monitor = HeartRateMonitor(streaming=True)
+    ir, red = synthetic_ppg(n=200, bpm=72, noise=50)
+    monitor.process(np.array(red), np.array(ir))
+    assert monitor.bpm > 0
+
+    # finger off: a full window of low IR
+    low = np.full(100, 1000)
+    monitor.process(low, low)
+    assert monitor.bpm == 0
+    assert monitor._estimator.count == 0
+    assert monitor._estimator._n_valleys == 0
+    assert monitor._estimator._n_ratios == 0
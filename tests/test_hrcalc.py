@@ -0,0 +1,122 @@
+import numpy as np
+
+import hrcalc
+from sim_i2c import synthetic_ppg
+
+
+def test_streaming_ratios_follow_their_valleys():
+    estimator = hrcalc.StreamingEstimator()
+    ir, red = synthetic_ppg(n=200, bpm=72, noise=50, seed=1)
+    estimator.extend(ir, red)
+    assert estimator._n_ratios > 0
+
+    # every ratio ends on a valley that is still in the window
+    ends = estimator._ratio_ends[:estimator._n_ratios]
+    valleys = estimator._valleys[:estimator._n_valleys]
+    assert set(ends) <= set(valleys)
+
+    # once the beats have scrolled out only new pairs count
+    estimator.extend(*synthetic_ppg(n=hrcalc.BUFFER_SIZE, bpm=72, noise=50, seed=2))
+    oldest = estimator.count - estimator.size
+    assert np.all(estimator._ratio_ends[:estimator._n_ratios] >= oldest)
+
+
+def test_streaming_close_valley_keeps_earlier_ratio():
+    estimator = hrcalc.StreamingEstimator()
+    estimator.count = 60
+    estimator._valleys[:3] = (5, 20, 40)
+    estimator._n_valleys = 3
+    # 5-20 gave a ratio, 20-40 did not
+    estimator._ratios[0] = 50
+    estimator._ratio_ends[0] = 20
+    estimator._n_ratios = 1
+    estimator.ma[40] = 10.0
+
+    # a deeper valley right after 40 replaces it
+    estimator._add_valley(42, 5.0)
+    assert list(estimator._valleys[:estimator._n_valleys]) == [5, 20, 42]
+    assert list(estimator._ratios[:estimator._n_ratios]) == [50]
+
+
+def parity_windows(seed, n=hrcalc.BUFFER_SIZE):
+    """
+    Windows of every shape the sensor hands over: real-looking beats at
+    random rates and noise, flat, saturated, no finger, steps and spikes.
+    """
+    rng = np.random.default_rng(seed)
+    for i in range(20):
+        yield synthetic_ppg(n=n, bpm=int(rng.integers(40, 180)),
+                            noise=float(rng.choice([0, 50, 400, 2500])), seed=seed * 100 + i)
+    for level in (0, 1, 110000, 0x03FFFF):
+        # flat, down to an all-zero and up to a saturated ADC
+        yield [level] * n, [level] * n
+    # saturated with a dip now and then
+    ir = np.full(n, 0x03FFFF)
+    ir[rng.integers(0, n, 5)] -= rng.integers(1, 5000, 5)
+    yield ir.tolist(), ir.tolist()
+    # no finger: ambient light, a few hundred counts of noise
+    yield rng.integers(0, 800, n).tolist(), rng.integers(0, 800, n).tolist()
+    # finger put on halfway through
+    ir, red = synthetic_ppg(n=n, seed=seed)
+    yield [v if k > n // 2 else 300 for k, v in enumerate(ir)], \
+          [v if k > n // 2 else 300 for k, v in enumerate(red)]
+    # random spikes on a flat line
+    spikes = np.full(n, 100000)
+    spikes[rng.integers(0, n, 10)] += rng.integers(-50000, 50000, 10)
+    yield spikes.tolist(), spikes[::-1].tolist()
+    # pure noise over the full range
+    yield rng.integers(0, 0x03FFFF, n).tolist(), rng.integers(0, 0x03FFFF, n).tolist()
+
+
+def test_numpy_engine_matches_reference():
+    checked = 0
+    for seed in range(10):
+        for ir, red in parity_windows(seed):
+            expected = hrcalc.calc_hr_and_spo2(ir, red)
+            got = hrcalc.calc_hr_and_spo2_np(ir, red, exact=True)
+            assert got == expected, (seed, checked, ir, red)
+            assert [type(v) for v in got] == [type(v) for v in expected]
+            checked += 1
+    assert checked > 250
+
+
+def small_ac_ppg(n, bpm, noise, seed):
+    """
+    A PPG whose AC/DC products stay clear of the 32-bit wrap that
+    calc_hr_and_spo2 emulates, so the SpO2 ratio does not flip on a
+    one-count difference.
+    """
+    rng = np.random.default_rng(seed)
+    phase = 2 * np.pi * bpm / 60.0 * np.arange(n) / hrcalc.SAMPLE_FREQ
+    pulse = np.sin(phase) + 0.3 * np.sin(2 * phase + 0.8)
+    ir = 60000 + 600 * pulse + rng.normal(0, noise, n)
+    red = 50000 + 300 * pulse + rng.normal(0, noise, n)
+    return ir.astype(np.int64).tolist(), red.astype(np.int64).tolist()
+
+
+def test_streaming_matches_reference_within_tolerance():
+    # at every confirmed beat, against calc_hr_and_spo2 on the same
+    # 100 samples: the same validity, the beat interval (1500 / bpm)
+    # within one sample, SpO2 within 2.5 points (the estimator keeps the
+    # ratios of the newest 5 beats, calc_hr_and_spo2 those of the oldest)
+    size = hrcalc.BUFFER_SIZE
+    beats = 0
+    for bpm in (45, 60, 72, 90, 110, 150):
+        for noise in (5, 20):
+            for seed in range(5):
+                ir, red = small_ac_ppg(400, bpm, noise, seed)
+                estimator = hrcalc.StreamingEstimator()
+                for k, (ir_k, red_k) in enumerate(zip(ir, red)):
+                    got = estimator.update(ir_k, red_k)
+                    if got is None or not estimator.full:
+                        continue
+                    hr, hr_valid, spo2, spo2_valid = got
+                    expected = hrcalc.calc_hr_and_spo2(ir[k + 1 - size:k + 1], red[k + 1 - size:k + 1])
+                    assert (hr_valid, spo2_valid) == (expected[1], expected[3]), (bpm, noise, seed, k)
+                    if hr_valid:
+                        interval = hrcalc.SAMPLE_FREQ * 60
+                        assert abs(round(interval / hr) - round(interval / expected[0])) <= 1
+                    if spo2_valid:
+                        assert abs(spo2 - expected[2]) <= 2.5
+                    beats += 1
+    assert beats > 1000
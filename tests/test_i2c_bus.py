@@ -0,0 +1,93 @@
+import threading
+import time
+
+from i2c_bus import BLOCK_MAX, BusManager, PRIORITY_HR, PRIORITY_IMU, PRIORITY_LIDAR, merge_ranges
+
+
+class RecordingBus(object):
+    """
+    Bus that logs the order of calls. Register R of device A reads A + R.
+    """
+
+    def __init__(self):
+        self.order = []
+
+    def read_byte(self, address):
+        self.order.append(address)
+        return address
+
+    def read_i2c_block_data(self, address, register, length):
+        assert length <= BLOCK_MAX
+        self.order.append((register, length))
+        return [(address + r) & 0xFF for r in range(register, register + length)]
+
+
+def wait_until(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.001)
+
+
+def queue_behind_holder(manager, clients):
+    """
+    Hold the bus, queue one read per client in the given order, then
+    let go. Returns the order the reads ran in.
+    """
+    holder = manager.client("holder", PRIORITY_LIDAR)
+    manager.acquire(holder)
+    threads = []
+    for client, address in clients:
+        thread = threading.Thread(target=client.read_byte, args=(address,))
+        thread.start()
+        threads.append(thread)
+        # queued before the next one starts
+        wait_until(lambda: len(manager._waiters) == len(threads))
+    manager.release()
+    for thread in threads:
+        thread.join(2.0)
+    return manager.bus.order
+
+
+def test_priority_client_preempts_queued_low_priority_one():
+    manager = BusManager(RecordingBus())
+    hr = manager.client("max30102", PRIORITY_HR)
+    imu = manager.client("mpu6050", PRIORITY_IMU)
+    lidar = manager.client("tfluna", PRIORITY_LIDAR)
+    order = queue_behind_holder(manager, [(hr, 0x57), (imu, 0x68), (lidar, 0x10)])
+    assert order == [0x10, 0x68, 0x57]
+    assert hr.stats.wait_time > lidar.stats.wait_time
+
+
+def test_alert_goes_before_every_priority():
+    manager = BusManager(RecordingBus())
+    lidar = manager.client("tfluna", PRIORITY_LIDAR)
+    hr = manager.client("max30102", PRIORITY_HR)
+    hr.alert = True
+    # same priority: first come first served
+    imu_a = manager.client("imu_a", PRIORITY_IMU)
+    imu_b = manager.client("imu_b", PRIORITY_IMU)
+    order = queue_behind_holder(manager, [(imu_a, 1), (lidar, 0x10), (imu_b, 2), (hr, 0x57)])
+    assert order == [0x57, 0x10, 1, 2]
+    assert not manager._busy
+
+
+def test_merge_ranges_splits_at_the_block_limit():
+    assert merge_ranges([(0x43, 6), (0x3B, 6), (0x41, 2)]) == [(0x3B, 14)]
+    assert merge_ranges([(0, 2), (5, 1)]) == [(0, 2), (5, 1)]
+    # overlapping ranges merge first, then the span is cut into blocks
+    assert merge_ranges([(0, 20), (10, 30)]) == [(0, BLOCK_MAX), (BLOCK_MAX, 8)]
+    assert merge_ranges([(0, 70)]) == [(0, 32), (32, 32), (64, 6)]
+    assert all(length <= BLOCK_MAX for _, length in merge_ranges([(0, 100), (90, 50)]))
+
+
+def test_read_batch_returns_every_range():
+    manager = BusManager(RecordingBus())
+    client = manager.client("mpu6050", PRIORITY_IMU)
+    ranges = [(0x3B, 6), (0x41, 2), (0x43, 6), (0x00, 40)]
+    got = client.read_batch(0x68, ranges)
+    # 0x3B-0x48 in one block, 0x00-0x27 in two
+    assert manager.bus.order == [(0x00, 32), (0x20, 8), (0x3B, 14)]
+    assert client.stats.transactions == 3
+    for (register, length), values in zip(ranges, got):
+        assert values == [0x68 + r for r in range(register, register + length)]
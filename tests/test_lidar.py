@@ -0,0 +1,62 @@
+from lidar import FRAME_SIZE, Frame, FrameParser, LidarUart, read_frame
+from sim_serial import ByteStream, tfluna_frame
+
+
+def corrupt(frame):
+    # flip a distance bit, the checksum no longer matches
+    return frame[:2] + bytes([frame[2] ^ 0x01]) + frame[3:]
+
+
+def test_frames_split_across_reads():
+    parser = FrameParser()
+    data = tfluna_frame(123, 4567, 2256) + tfluna_frame(124)
+    frames = []
+    for i in range(len(data)):
+        frames += parser.feed(data[i:i + 1])
+    assert frames == [Frame(123, 4567, 26.0), Frame(124, 1000, 26.0)]
+    assert parser.frames == 2 and parser.bad_checksums == 0 and parser.skipped_bytes == 0
+    assert not parser.buffer
+
+
+def test_bad_checksum_costs_one_frame():
+    parser = FrameParser()
+    frames = parser.feed(tfluna_frame(10) + corrupt(tfluna_frame(11)) + tfluna_frame(12))
+    assert [f.distance for f in frames] == [10, 12]
+    assert parser.bad_checksums == 1
+    assert parser.skipped_bytes == FRAME_SIZE
+
+
+def test_resync_after_garbage_and_dropped_bytes():
+    parser = FrameParser()
+    # noise with a false header, a frame that lost its last 3 bytes,
+    # and a 'YY' inside a payload (distance 0x5959)
+    garbage = b"\x00YYx\x13\xff" + tfluna_frame(20)[:-3]
+    data = garbage + tfluna_frame(0x5959) + tfluna_frame(21)
+    frames = []
+    for start in range(0, len(data), 5):
+        frames += parser.feed(data[start:start + 5])
+    assert [f.distance for f in frames] == [0x5959, 21]
+    assert parser.skipped_bytes == len(garbage)
+    assert parser.bad_checksums >= 2
+
+
+def test_feed_newest_skips_a_corrupt_last_frame():
+    parser = FrameParser()
+    data = tfluna_frame(30) + tfluna_frame(31) + corrupt(tfluna_frame(32)) + tfluna_frame(33)[:4]
+    assert parser.feed_newest(data).distance == 31
+    assert parser.bad_checksums == 1
+    # the unfinished frame is kept for the next read
+    assert parser.feed_newest(tfluna_frame(33)[4:]).distance == 33
+    assert parser.feed_newest(b"") is None
+
+
+def test_uart_readers_on_a_stream():
+    frames = b"".join(tfluna_frame(d) for d in (40, 41, 42))
+    uart = LidarUart(ByteStream(b"\xff\x00" + frames, loop=False), mode="every")
+    assert [f.distance for f in uart.read()] == [40, 41, 42]
+    uart = LidarUart(ByteStream(frames, loop=False))
+    assert uart.read().distance == 42
+    # the byte at a time reader
+    port = ByteStream(frames[:FRAME_SIZE] + corrupt(frames[FRAME_SIZE:2 * FRAME_SIZE]), loop=False)
+    assert read_frame(port) == (40, 1000)
+    assert read_frame(port) is None
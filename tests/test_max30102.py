@@ -0,0 +1,84 @@
+import numpy as np
+
+import max30102
+from max30102 import MAX30102, FifoPoller, SAMPLE_RATE, decode_fifo
+from sim_i2c import SimBus, SimClock, SimInterruptPin, SimMax30102
+
+
+def sim_sensor():
+    clock = SimClock()
+    bus = SimBus()
+    ppg = bus.attach(SimMax30102(sample_rate=SAMPLE_RATE, clock=clock.time))
+    sensor = MAX30102(bus=bus)
+    sensor.drain()
+    return clock, ppg, sensor
+
+
+def a_full_samples(ppg):
+    return max30102.FIFO_DEPTH - (ppg.regs[max30102.REG_FIFO_CONFIG] & 0x0F)
+
+
+def test_overflow_reprograms_a_full():
+    clock, ppg, sensor = sim_sensor()
+    pin = SimInterruptPin(ppg, sleep=clock.sleep)
+    poller = FifoPoller(sensor, int_pin=pin, target=28, clock=clock.time, sleep=clock.sleep)
+    assert a_full_samples(ppg) == 28
+    assert len(poller.read()[1]) == 28
+
+    clock.sleep(2.0)  # the HR thread stalled, the FIFO overflowed
+    poller.read()
+    assert poller.overflows == 1
+    assert poller.target == 14
+    # as low as the register goes
+    assert a_full_samples(ppg) == max30102.A_FULL_MIN
+
+
+def test_target_below_a_full_wakes_on_the_timeout():
+    clock, ppg, sensor = sim_sensor()
+    pin = SimInterruptPin(ppg, sleep=clock.sleep)
+    poller = FifoPoller(sensor, int_pin=pin, clock=clock.time, sleep=clock.sleep)
+    poller.read()
+    clock.sleep(2.0)
+    poller.read()
+    assert poller.target == max30102.A_FULL_MIN // 2
+    counts = [len(poller.read()[1]) for _ in range(5)]
+    # read after about TARGET samples, not when A_FULL (17) fires
+    assert max(counts) <= poller.target + 1
+    assert poller.overflows == 1
+
+
+def test_decode_fifo_masks_to_18_bits():
+    data = [0x01, 0x02, 0x03, 0x02, 0x00, 0x01,   # red 0x10203, ir 0x20001
+            0xFF, 0xFF, 0xFF, 0xFC, 0x12, 0x34]   # bits 23:18 are not data
+    red, ir = decode_fifo(data)
+    assert red.tolist() == [0x10203, 0x03FFFF]
+    assert ir.tolist() == [0x20001, 0x1234]
+    red, ir = decode_fifo([])
+    assert len(red) == len(ir) == 0
+
+
+def test_read_fifo_burst_matches_sample_by_sample_reads():
+    sensors = []
+    for _ in range(2):
+        bus = SimBus()
+        ppg = bus.attach(SimMax30102())
+        sensors.append(MAX30102(bus=bus))
+        ppg.push_samples(17)
+    before = bus.transactions
+    red, ir = sensors[1].read_fifo_burst(17)
+    # 5 samples (30 bytes) per SMBus block: 5 + 5 + 5 + 2
+    assert bus.transactions - before == 4
+    expected = np.array([sensors[0].read_fifo() for _ in range(17)])
+    assert red.tolist() == expected[:, 0].tolist()
+    assert ir.tolist() == expected[:, 1].tolist()
+
+
+def test_drain_reads_a_full_fifo():
+    clock, ppg, sensor = sim_sensor()
+    ppg.push_samples(max30102.FIFO_DEPTH + 3)
+    red, ir = sensor.drain()
+    # equal pointers with the overflow counter running mean 32, not 0
+    assert len(red) == len(ir) == max30102.FIFO_DEPTH
+    assert sensor.overflow_count == 3
+    assert ir.tolist() == ppg._ir[:max30102.FIFO_DEPTH]
+    assert len(sensor.drain()[0]) == 0
@@ -0,0 +1,56 @@
+import metrics
+
+
+def test_histogram_buckets_are_upper_bounds():
+    h = metrics.Histogram("test.bounds", bounds=(10, 20, 50))
+    for value in (0, 10, 10.5, 20, 49, 50, 51, 1000):
+        h.observe(value)
+    # a value equal to a bound counts in that bucket, above the last in inf
+    assert h.counts == [2, 2, 2, 2]
+    assert h.count == 8 and h.max == 1000 and h.total == 1190.5
+    snap = h.snapshot()
+    assert snap["buckets"] == {"10": 2, "20": 2, "50": 2, "inf": 2}
+    assert snap["mean"] == 1190.5 / 8
+
+
+def test_histogram_percentiles():
+    h = metrics.Histogram("test.percentiles", bounds=(10, 20, 50))
+    assert h.percentile(0.99) == 0.0
+    for value in [5] * 90 + [15] * 9 + [300]:
+        h.observe(value)
+    assert h.percentile(0.5) == 10
+    assert h.percentile(0.9) == 10
+    assert h.percentile(0.99) == 20
+    # the open top bucket reports the largest value seen
+    assert h.percentile(1.0) == 300
+    h.reset()
+    assert h.count == 0 and h.counts == [0, 0, 0, 0] and h.max == 0.0
+
+
+def test_default_buckets_cover_the_hot_paths():
+    for bounds in (metrics.BUCKETS_US, metrics.BUCKETS_MS):
+        assert list(bounds) == sorted(bounds) and len(set(bounds)) == len(bounds)
+    h = metrics.histogram("test.default_us")
+    h.observe(1500)
+    assert h.snapshot()["buckets"]["2000.0"] == 1
+
+
+def test_registry_and_reporter_deltas():
+    assert metrics.histogram("test.shared") is metrics.histogram("test.shared")
+    h = metrics.histogram("test.line_us", (10, 100))
+    c = metrics.counter("test.count")
+    metrics.gauge("test.depth", lambda: 7)
+    reporter = metrics.Reporter()
+    reporter.line()
+    for _ in range(99):
+        h.observe(5)
+    h.observe(500)
+    c.inc(3)
+    line = reporter.line()
+    assert "test.line_us 10/10/500" in line
+    assert "test.count+3" in line and "test.depth=7" in line
+    # nothing new since the last line: histogram and counter are left out
+    line = reporter.line()
+    assert "test.line_us" not in line and "test.count" not in line
+    h.observe(50)
+    assert "test.line_us 100/100/500" in reporter.line()
@@ -0,0 +1,34 @@
+from mpu6050 import MPU6050
+from sim_i2c import SimBus, SimClock, SimMpu6050
+
+
+def sim_mpu(sample_rate=200):
+    clock = SimClock()
+    bus = SimBus()
+    device = bus.attach(SimMpu6050(clock=clock.time))
+    mpu = MPU6050(bus=bus, sample_rate=sample_rate, clock=clock.time, sleep=clock.sleep)
+    mpu.enable_fifo()
+    return clock, device, mpu
+
+
+def test_drain_decodes_fifo_samples():
+    clock, device, mpu = sim_mpu()
+    clock.sleep(0.1)
+    block = mpu.drain()
+    assert len(block.t) == 20
+    assert block.accel.shape == (20, 3) and block.gyro.shape == (20, 3)
+    # standing still-ish: about 1 g on z
+    assert abs(block.accel[:, 2].mean() - 9.81) < 3.0
+    assert mpu.drain().t.shape[0] == 0
+
+
+def test_overflow_resets_the_fifo_and_recovers():
+    clock, device, mpu = sim_mpu()
+    clock.sleep(2.0)  # 400 samples, the 1024 byte FIFO holds 85
+    assert len(mpu.drain().t) == 0
+    assert mpu.overflow_count == 1
+    assert len(device.fifo) == 0
+
+    clock.sleep(0.1)
+    assert len(mpu.drain().t) == 20
+    assert mpu.overflow_count == 1
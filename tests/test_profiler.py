@@ -0,0 +1,86 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+import metrics
+import profiler
+
+
+@pytest.fixture
+def control(tmp_path, monkeypatch):
+    """
+    A metrics socket with the profile command installed, profiles in TMP_PATH.
+    """
+    monkeypatch.setattr(profiler, "OUT_DIR", str(tmp_path))
+    previous = signal.getsignal(signal.SIGUSR1)
+    profiler.install(duration=0.2)
+    server = metrics.MetricsServer(str(tmp_path / "metrics.sock")).start()
+    yield server.path
+    server.stop()
+    signal.signal(signal.SIGUSR1, previous)
+    running = profiler.active()
+    if running is not None:
+        running.stop()
+        running.join(2.0)
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def wait_done(timeout=5.0):
+    end = time.monotonic() + timeout
+    while profiler.active() is not None:
+        assert time.monotonic() < end
+        time.sleep(0.01)
+
+
+def test_profile_through_the_metrics_socket(control):
+    stop = threading.Event()
+    busy = threading.Thread(target=spin, args=(stop,), name="busy")
+    busy.start()
+    try:
+        reply = metrics.fetch(control, "profile 0.3")
+        assert reply["seconds"] == 0.3
+        # one profile at a time
+        again = metrics.fetch(control, "profile 0.3")
+        assert again == {"error": "profile already running", "path": reply["path"]}
+        wait_done()
+    finally:
+        stop.set()
+        busy.join()
+    with open(reply["path"]) as f:
+        lines = f.read().splitlines()
+    stacks = dict(line.rsplit(" ", 1) for line in lines)
+    spinning = [stack for stack in stacks if stack.startswith("busy;")]
+    assert any(stack.endswith("test_profiler.py:spin") for stack in spinning)
+    # the sampler does not sample itself
+    assert not any(stack.startswith("profiler;") for stack in stacks)
+    assert all(int(count) > 0 for count in stacks.values())
+
+
+def test_profile_command_arguments(control, monkeypatch):
+    monkeypatch.setattr(profiler, "MAX_DURATION", 0.2)
+    assert "must be > 0" in metrics.fetch(control, "profile -1")["error"]
+    assert "error" in metrics.fetch(control, "profile soon")
+    # capped at MAX_DURATION
+    assert metrics.fetch(control, "profile 3600")["seconds"] == 0.2
+    wait_done()
+    reply = metrics.fetch(control, "flamegraph")
+    assert reply["error"] == "unknown command flamegraph"
+    assert "profile" in reply["commands"]
+    # no command: the usual snapshot
+    assert isinstance(metrics.fetch(control), dict)
+
+
+def test_profile_on_sigusr1(control):
+    os.kill(os.getpid(), signal.SIGUSR1)
+    running = profiler.active()
+    assert running is not None and running.duration == 0.2
+    wait_done()
+    assert os.path.exists(running.path)
+    assert running.samples > 0
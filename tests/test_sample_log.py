@@ -0,0 +1,91 @@
+import os
+
+from sample_log import BLOCK_PAYLOAD, PAGE, SampleLog, SampleLogReader, _segment_name
+from sensor_trace import RECORD
+
+# 200-byte GPS records, 19 to a block
+SENTENCE = 200
+PER_BLOCK = BLOCK_PAYLOAD // (RECORD.size + SENTENCE)
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def log_records(log, first, count):
+    for i in range(first, first + count):
+        log.gps(b"$GP%08d" % i + b"," * (SENTENCE - 11), t=float(i))
+
+
+def logged(path):
+    reader = SampleLogReader(path)
+    try:
+        return [int(value[3:11]) for kind, t, value in reader.read()]
+    finally:
+        reader.close()
+
+
+def test_flush_appends_whole_blocks_only(tmp_path):
+    clock = Clock()
+    log = SampleLog(str(tmp_path), segments=4, segment_bytes=16 * PAGE, clock=clock)
+    log_records(log, 0, PER_BLOCK + 5)
+    log.flush()
+    assert log.pages_written == 1
+    # the 5 left over wait for their block to fill, whatever the flushes
+    log.flush()
+    log_records(log, PER_BLOCK + 5, 3)
+    log.flush()
+    assert log.pages_written == 1
+    assert logged(str(tmp_path)) == list(range(PER_BLOCK))
+    # ... or to get too old, then they go out padded
+    clock.now = log.max_block_age
+    log.flush()
+    assert log.pages_written == 2
+    assert logged(str(tmp_path)) == list(range(PER_BLOCK + 8))
+    log.close()
+    assert log.pages_written == 2
+
+
+def test_torn_tail_after_a_crash(tmp_path):
+    path = str(tmp_path)
+    log = SampleLog(path, segments=4, segment_bytes=16 * PAGE, clock=Clock())
+    log_records(log, 0, 5 * PER_BLOCK + 7)
+    log.flush()
+    # crash: the 7 records in memory are lost and the last block on the
+    # card is only half written
+    os.close(log._fd)
+    with open(os.path.join(path, _segment_name(0)), "r+b") as f:
+        f.seek(5 * PAGE + PAGE // 2)
+        f.write(b"\xff" * (PAGE // 2))
+    assert logged(path) == list(range(4 * PER_BLOCK))
+
+    # the next run carries on in a new segment, the good blocks stay
+    log = SampleLog(path, segments=4, segment_bytes=16 * PAGE, clock=Clock())
+    assert log._index == 1
+    log_records(log, 1000, 3)
+    log.close()
+    assert logged(path) == list(range(4 * PER_BLOCK)) + [1000, 1001, 1002]
+
+
+def test_segments_wrap_and_evict_the_oldest(tmp_path):
+    path = str(tmp_path)
+    # 2 blocks per segment, 3 segments
+    log = SampleLog(path, segments=3, segment_bytes=3 * PAGE, clock=Clock())
+    total = 10 * PER_BLOCK + 4
+    for first in range(0, total, 25):
+        log_records(log, first, min(25, total - first))
+        log.flush()
+    log.close()
+    assert sorted(os.listdir(path)) == [_segment_name(i) for i in range(3)]
+    # 10 full blocks filled 5 segments; the 6th (in file 2) holds the last
+    # 4 records, and the blocks of the segment it replaced are not read
+    assert logged(path) == list(range(6 * PER_BLOCK, total))
+
+    # sized down: the segments past the end go
+    log = SampleLog(path, segments=2, segment_bytes=3 * PAGE, clock=Clock())
+    log.close()
+    assert sorted(os.listdir(path)) == [_segment_name(i) for i in range(2)]
@@ -0,0 +1,71 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+from shm_ring import SampleRing
+
+WIDTH = 16
+ROWS = 200000
+
+
+def write_rows(name, count):
+    # every row is [i, i, ..., i]: a row that mixes two writes is torn
+    ring = SampleRing.attach(name)
+    values = np.empty(WIDTH)
+    for i in range(1, count + 1):
+        values[:] = i
+        ring.write(float(i), values)
+    ring.close()
+
+
+def test_ring_round_trip_and_wrap():
+    ring = SampleRing.create(f"pathpal-test-{os.getpid()}", width=2, capacity=4)
+    try:
+        assert ring.latest() == (None, None)
+        for i in range(6):
+            ring.write(float(i), (i, -i))
+        seq, row = ring.latest()
+        assert seq == 5 and list(row) == [5.0, 5.0, -5.0]
+        # only the newest 4 rows survive the wrap
+        seq, rows = ring.since(-1)
+        assert seq == 5 and list(rows[:, 0]) == [2.0, 3.0, 4.0, 5.0]
+        assert not ring.valid(1) and ring.valid(2)
+        seq, rows = ring.since(3)
+        assert list(rows[:, 0]) == [4.0, 5.0]
+    finally:
+        ring.close()
+
+
+def test_readers_never_see_torn_rows():
+    # a tiny ring so the writer laps the reader all the time
+    ring = SampleRing.create(f"pathpal-test-{os.getpid()}", width=WIDTH, capacity=4)
+    writer = multiprocessing.get_context("fork").Process(target=write_rows, args=(ring.name, ROWS))
+    writer.start()
+    latest = since = 0
+    last = -1
+    try:
+        while last < ROWS - 1:
+            seq, row = ring.latest()
+            if seq is not None:
+                copy = row.copy()
+                if ring.valid(seq):
+                    assert np.all(copy == copy[0]), copy
+                    assert copy[0] == seq + 1
+                    latest += 1
+            seq, rows = ring.since(last)
+            if len(rows):
+                assert np.all(rows == rows[:, :1]), rows
+                assert np.all(rows[:, 0] > last + 1)
+                assert rows[-1, 0] == seq + 1
+                last = seq
+                since += len(rows)
+            elif not writer.is_alive():
+                break
+        writer.join()
+        assert writer.exitcode == 0
+    finally:
+        if writer.is_alive():
+            writer.terminate()
+        ring.close()
+    assert latest > 100 and since > 100
@@ -0,0 +1,76 @@
+"""
+Smoke check of the default start path: the sample log is the recorder
+and the init functions bring every sensor up on a simulated bus.
+"""
+import time
+
+import i2c_bus
+import Sensortest
+import sensor_trace
+from i2c_bus import BusManager
+from max30102 import SAMPLE_RATE
+from sample_log import SampleLog, SampleLogReader
+from sim_i2c import SimBus, SimMax30102, SimMpu6050, SimTfLuna
+
+
+def test_default_start_with_sample_log(tmp_path, monkeypatch):
+    bus = SimBus()
+    bus.attach(SimMax30102(sample_rate=SAMPLE_RATE))
+    bus.attach(SimTfLuna())
+    bus.attach(SimMpu6050())
+    monkeypatch.setitem(i2c_bus._shared, Sensortest.I2C_CHANNEL, BusManager(bus))
+    log = SampleLog(str(tmp_path), segments=2, segment_bytes=64 * 4096, flush_interval=0.05).start()
+    monkeypatch.setattr(Sensortest, "RECORDER", log)
+
+    hr = Sensortest.init_max30102()
+    mpu = Sensortest.init_mpu6050()
+    lidar = Sensortest.init_lidar()
+    try:
+        assert hr is not None
+        assert mpu is not None
+        assert lidar is not None
+        deadline = time.monotonic() + 2.0
+        while time.monotonic() < deadline and log.records < 20:
+            mpu.motion()
+            time.sleep(0.02)
+    finally:
+        if hr is not None: hr.stop_sensor()
+        if lidar is not None: lidar.stop()
+        if mpu is not None: mpu.close()
+        log.close()
+
+    reader = SampleLogReader(str(tmp_path))
+    kinds = {kind for kind, _, _ in reader.read()}
+    reader.close()
+    assert {sensor_trace.PPG, sensor_trace.LIDAR, sensor_trace.IMU} <= kinds
+
+
+def test_import_survives_a_missing_library(monkeypatch, capsys):
+    import importlib
+    import sys
+    # an import in the guarded block fails, like a missing PyBluez
+    monkeypatch.setitem(sys.modules, "bt_sender", None)
+    monkeypatch.delitem(sys.modules, "Sensortest")
+    module = importlib.import_module("Sensortest")
+    assert module.LOOP_WORK_US is not None
+    assert "[CRITICAL] Library missing" in capsys.readouterr().out
+
+
+def test_hr_thread_on_the_int_pin(monkeypatch):
+    from sim_i2c import SimInterruptPin
+    bus = SimBus()
+    ppg = bus.attach(SimMax30102(sample_rate=SAMPLE_RATE))
+    monkeypatch.setitem(i2c_bus._shared, Sensortest.I2C_CHANNEL, BusManager(bus))
+    pin = SimInterruptPin(ppg)
+    monkeypatch.setattr(Sensortest, "HR_INT_PIN", 4)
+    monkeypatch.setitem(Sensortest._int_pins, 4, pin)
+
+    hr = Sensortest.init_max30102()
+    try:
+        assert hr.int_pin is pin
+        deadline = time.monotonic() + 2.0
+        while time.monotonic() < deadline and pin.waits < 2:
+            time.sleep(0.02)
+    finally:
+        hr.stop_sensor()
+    assert pin.waits >= 2
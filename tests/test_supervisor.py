@@ -0,0 +1,112 @@
+import random
+import threading
+import time
+
+from supervisor import STOPPED, UP, Supervisor
+
+
+def wait_until(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.005)
+
+
+class FlakyInit(object):
+    """
+    init function that fails FAILURES times, then returns a new driver.
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.times = []
+
+    def __call__(self):
+        self.times.append(time.monotonic())
+        if len(self.times) <= self.failures:
+            raise OSError(121, "Remote I/O error")
+        return object()
+
+
+def test_backoff_doubles_up_to_the_cap():
+    sup = Supervisor(base_delay=0.5, max_delay=30.0, jitter=0.0)
+    assert [sup.delay(n) for n in range(1, 9)] == [0.5, 1, 2, 4, 8, 16, 30, 30]
+    # jitter only ever shortens a delay, by up to half
+    sup = Supervisor(base_delay=0.5, max_delay=30.0, jitter=0.5, rng=random.Random(1))
+    delays = [sup.delay(4) for _ in range(200)]
+    assert 2.0 <= min(delays) < 2.2 and 3.8 < max(delays) <= 4.0
+
+
+def test_failed_init_is_retried_with_backoff():
+    init = FlakyInit(failures=3)
+    sup = Supervisor(base_delay=0.02, jitter=0.0, verbose=False).add("lidar", init)
+    sup.start()
+    try:
+        wait_until(lambda: sup.get("lidar") is not None)
+        gaps = [b - a for a, b in zip(init.times, init.times[1:])]
+        assert len(gaps) == 3
+        for gap, delay in zip(gaps, (0.02, 0.04, 0.08)):
+            assert gap >= delay * 0.9
+        health = sup.health()["lidar"]
+        assert health["state"] == UP and health["attempts"] == 4
+        assert health["init_failures"] == 3 and "Remote I/O" in health["last_error"]
+    finally:
+        sup.stop()
+    assert sup.health()["lidar"]["state"] == STOPPED
+
+
+def test_get_never_waits_for_a_hanging_init():
+    release = threading.Event()
+    sup = Supervisor(verbose=False).add("gps", lambda: release.wait(5.0) and object())
+    sup.start()
+    try:
+        start = time.monotonic()
+        assert sup.get("gps") is None
+        assert time.monotonic() - start < 0.01
+        release.set()
+        wait_until(lambda: sup.get("gps") is not None)
+    finally:
+        sup.stop()
+
+
+def test_runtime_failure_closes_and_reconnects():
+    init = FlakyInit(failures=2)
+    closed = []
+    sup = Supervisor(base_delay=0.02, jitter=0.0, verbose=False)
+    sup.add("imu", init, close=closed.append)
+    sup.start()
+    try:
+        wait_until(lambda: sup.get("imu") is not None)
+        first = sup.get("imu")
+        sup.failed("imu", first, OSError("unplugged"))
+        assert sup.get("imu") is None  # dropped at once, not on the thread
+        wait_until(lambda: sup.get("imu") is not None)
+        assert closed == [first]
+        # a late report about the old driver does not drop the new one
+        second = sup.get("imu")
+        sup.failed("imu", first, OSError("stale"))
+        assert sup.get("imu") is second
+        health = sup.health()["imu"]
+        assert health["runtime_failures"] == 1 and health["attempts"] == 4
+    finally:
+        sup.stop()
+    assert closed == [first, second]
+
+
+def test_failing_check_drops_the_driver():
+    healthy = threading.Event()
+    healthy.set()
+    init = FlakyInit(failures=0)
+    sup = Supervisor(base_delay=0.02, check_interval=0.01, verbose=False)
+    sup.add("hr", init, check=lambda driver: healthy.is_set())
+    sup.start()
+    try:
+        wait_until(lambda: sup.get("hr") is not None)
+        healthy.clear()
+        wait_until(lambda: sup.health()["hr"]["runtime_failures"] >= 1)
+        assert sup.health()["hr"]["last_error"] == "health check failed"
+        healthy.set()
+        wait_until(lambda: sup.get("hr") is not None)
+        assert len(init.times) >= 2
+    finally:
+        sup.stop()
@@ -0,0 +1,48 @@
+import pytest
+
+from TfLunaI2C import TfLunaI2C
+from sim_i2c import SimBus, SimClock, SimTfLuna
+
+
+def sim_lidar(distance):
+    clock = SimClock()
+    bus = SimBus()
+    device = bus.attach(SimTfLuna(distance=distance, clock=clock.time))
+    return clock, bus, device, TfLunaI2C(i2cbus=bus)
+
+
+def test_read_frame_decodes_one_block_read():
+    clock, bus, device, lidar = sim_lidar(lambda t: 150 + 100 * t)
+    clock.sleep(0.5)
+    before = bus.bytes, bus.transactions
+    assert lidar.read_frame() == (200, 1000, 45.0, 500)
+    # all four words in a single 8-byte transaction
+    assert (bus.bytes - before[0], bus.transactions - before[1]) == (8, 1)
+    assert lidar.read_data() == [200, 1000]
+    assert lidar.distance == 200 and lidar.tick == 500
+
+
+def test_read_frame_drops_out_of_range_distances():
+    clock, bus, device, lidar = sim_lidar(lambda t: 1201 if t > 0.1 else 1200)
+    assert lidar.read_frame()[0] == 1200
+    clock.sleep(0.2)
+    distance, amplitude, temp, tick = lidar.read_frame()
+    assert distance == 0 and amplitude == 1000
+    assert lidar.dist == 0
+
+
+def test_read_frame_in_trigger_mode_only_sees_triggered_frames():
+    clock, bus, device, lidar = sim_lidar(lambda t: 100 + 1000 * t)
+    lidar.set_trigger_mode()
+    first = lidar.read_frame()
+    clock.sleep(0.5)
+    assert lidar.read_frame() == first
+    lidar.trigger()
+    assert lidar.read_frame()[0] == 600
+
+
+def test_read_frame_raises_when_the_device_is_gone():
+    clock, bus, device, lidar = sim_lidar(None)
+    del bus.devices[device.address]
+    with pytest.raises(OSError):
+        lidar.read_frame()
@@ -0,0 +1,82 @@
+import os
+import socket
+
+import pytest
+
+import transport
+
+
+def test_tcp_url_host_and_port():
+    for url, host, port in (
+        ("tcp://phone.local", "phone.local", transport.TCP_PORT),
+        ("tcp://10.0.0.2:9000", "10.0.0.2", 9000),
+        ("tcp://:9000", "0.0.0.0", 9000),
+        ("tcp://", "0.0.0.0", transport.TCP_PORT),
+        # not a port: part of the host name
+        ("tcp://host:port", "host:port", transport.TCP_PORT),
+    ):
+        t = transport.from_url(url)
+        assert (t.host, t.port) == (host, port), url
+
+
+def test_rfcomm_url_address_and_channel():
+    mac = "B8:27:EB:12:34:56"
+    for url, address, channel in (
+        ("rfcomm://", None, None),
+        ("rfcomm://3", None, 3),
+        ("rfcomm://" + mac, mac, None),
+        ("rfcomm://" + mac + ":5", mac, 5),
+    ):
+        t = transport.from_url(url)
+        assert isinstance(t, transport.RfcommTransport), url
+        assert (t.address, t.channel) == (address, channel), url
+        # url gives back what was parsed
+        assert transport.from_url(t.url).url == t.url
+
+
+def test_unix_url_path():
+    assert transport.from_url("unix://").path == transport.UNIX_PATH
+    t = transport.from_url("unix:///run/pathpal/bt.sock")
+    assert t.path == "/run/pathpal/bt.sock"
+    assert t.url == "unix:///run/pathpal/bt.sock"
+
+
+@pytest.mark.parametrize("url", ["localhost:8765", "tcp:/host:1", "udp://host:1"])
+def test_bad_urls_are_rejected(url):
+    with pytest.raises(ValueError):
+        transport.from_url(url)
+
+
+def test_tcp_listen_on_a_free_port_and_connect():
+    t = transport.from_url("tcp://127.0.0.1:0")
+    server = t.listen(1)
+    try:
+        assert t.port != 0 and t.url == f"tcp://127.0.0.1:{t.port}"
+        client = t.connect()
+        accepted, _ = server.accept()
+        t.accepted(accepted)
+        assert accepted.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        client.sendall(b"hi")
+        assert accepted.recv(2) == b"hi"
+        client.close()
+        accepted.close()
+    finally:
+        server.close()
+
+
+def test_unix_listen_replaces_a_stale_socket_file(tmp_path):
+    path = str(tmp_path / "bt.sock")
+    open(path, "w").close()  # left behind by a crash
+    t = transport.from_url("unix://" + path)
+    server = t.listen(1)
+    try:
+        client = t.connect()
+        accepted, _ = server.accept()
+        client.sendall(b"hi")
+        assert accepted.recv(2) == b"hi"
+        client.close()
+        accepted.close()
+    finally:
+        server.close()
+        t.close()
+    assert not os.path.exists(path)
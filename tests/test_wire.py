@@ -0,0 +1,82 @@
+import pytest
+
+import wire
+
+PACKET = {"bpm": 72.5, "dist_cm": 143, "accel": [0.12, -9.81, 0.5], "gyro": [0.001, -0.25, 1.5]}
+GPS = {"lat": 43.6532260, "lon": -79.3831843, "speed": 1.25, "age_ms": 180}
+
+
+def test_round_trip():
+    encoder = wire.Encoder(clock=lambda: 10.0)
+    for packet in (PACKET, dict(PACKET, gps=GPS)):
+        frame = encoder.encode(packet)
+        assert len(frame) == (41 if "gps" in packet else 29)
+        decoded = wire.decode(frame)
+        assert decoded["bpm"] == 72.5
+        assert decoded["dist_cm"] == 143
+        assert decoded["accel"] == pytest.approx(packet["accel"], abs=0.005)
+        assert decoded["gyro"] == pytest.approx(packet["gyro"], abs=0.0005)
+        assert not decoded["backlog"]
+        if "gps" in packet:
+            assert decoded["gps"]["lat"] == pytest.approx(GPS["lat"], abs=1e-7)
+            assert decoded["gps"]["lon"] == pytest.approx(GPS["lon"], abs=1e-7)
+            assert decoded["gps"]["speed"] == 1.25
+            assert decoded["gps"]["age_ms"] == 180
+    assert [wire.decode(f)["seq"] for f in (encoder.encode(PACKET), encoder.encode(PACKET))] == [2, 3]
+
+
+def test_backlog_flag_moves_timestamp_back():
+    encoder = wire.Encoder(clock=iter([0.0, 5.0]).__next__)
+    decoded = wire.decode(encoder.encode(dict(PACKET, backlog_ms=1500)))
+    assert decoded["backlog"]
+    assert decoded["t_ms"] == 3500
+
+
+def test_out_of_range_fields_saturate():
+    encoder = wire.Encoder(clock=lambda: 0.0)
+    packet = {"bpm": 9000, "dist_cm": -5, "accel": [1e6, -1e6, 0], "gyro": [100.0, -100.0, 0],
+              "gps": {"lat": 1.0, "lon": 2.0, "speed": 1e9, "age_ms": 10 ** 7}}
+    decoded = wire.decode(encoder.encode(packet))
+    assert decoded["bpm"] == 6553.5
+    assert decoded["dist_cm"] == 0
+    assert decoded["accel"][:2] == [327.67, -327.68]
+    assert decoded["gyro"][:2] == [32.767, -32.768]
+    assert decoded["gps"]["speed"] == 655.35
+    assert decoded["gps"]["age_ms"] == 65535
+
+
+def test_bad_crc():
+    frame = bytearray(wire.Encoder().encode(PACKET))
+    frame[13] ^= 0x01
+    with pytest.raises(wire.WireError, match="CRC"):
+        wire.decode(bytes(frame))
+    frames, rest = wire.split_frames(bytes(frame))
+    assert frames == []
+
+
+def test_split_frames_resyncs_after_garbage():
+    encoder = wire.Encoder()
+    good = [encoder.encode(dict(PACKET, dist_cm=i)) for i in range(4)]
+    damaged = bytearray(good[1])
+    damaged[15] ^= 0xFF
+    # a false MAGIC with a huge length, then a corrupted frame
+    garbage = b"\x00PP\x01\x00\xff" + b"\x17" * 10
+    stream = garbage + good[0] + bytes(damaged) + good[2] + b"PPjunk" + good[3]
+    frames, rest = wire.split_frames(stream)
+    assert [wire.decode(f)["dist_cm"] for f in frames] == [0, 2, 3]
+    assert rest == b""
+
+
+def test_split_frames_keeps_an_incomplete_tail():
+    encoder = wire.Encoder()
+    one, two = encoder.encode(PACKET), encoder.encode(PACKET)
+    frames, rest = wire.split_frames(one + two[:10])
+    assert frames == [one]
+    frames, rest = wire.split_frames(rest + two[10:])
+    assert frames == [two] and rest == b""
+
+
+def test_frame_size_rejects_an_impossible_length():
+    header = wire.HEADER.pack(wire.MAGIC, wire.VERSION, 0, 250, 0, 0)
+    with pytest.raises(wire.WireError):
+        wire.frame_size(header)
@@ -0,0 +1,92 @@
+"""
+Startup timeline: when each boot phase started and how long it took,
+counted from the moment the process was started (not from the first
+line of Python), so the interpreter and import time show up too.
+
+    boot = Timeline()
+    with boot.phase("bluetooth"):
+        bt.start()
+    boot.add("lidar", start, end)       # e.g. from another thread
+    boot.event("loop")
+    print(boot.format())
+
+Phases can overlap; the report is sorted by start time.
+"""
+import os
+import threading
+import time
+
+
+def process_age():
+    """
+    Seconds since this process was started, from /proc. None elsewhere.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # the command name can contain spaces, fields restart after ")"
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Timeline(object):
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        now = clock()
+        age = process_age()
+        # /proc times have 10 ms resolution, never start in the future
+        self.t0 = now - max(age or 0.0, 0.0)
+        self.entries = []  # (name, start, end), end is None for events
+        self._lock = threading.Lock()
+        if age:
+            self.add("interpreter", self.t0, now)
+
+    def add(self, name, start, end=None):
+        with self._lock:
+            self.entries.append((name, start, end))
+
+    def event(self, name):
+        self.add(name, self.clock())
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def elapsed(self):
+        return self.clock() - self.t0
+
+    def report(self):
+        """
+        [(name, start_s, duration_s or None)] since process start, by start.
+        """
+        with self._lock:
+            entries = sorted(self.entries, key=lambda entry: entry[1])
+        return [(name, start - self.t0, None if end is None else end - start)
+                for name, start, end in entries]
+
+    def format(self):
+        lines = []
+        for name, start, duration in self.report():
+            if duration is None:
+                lines.append(f"[BOOT] {start * 1e3:7.0f} ms  {name}")
+            else:
+                lines.append(f"[BOOT] {start * 1e3:7.0f} ms  {name} ({duration * 1e3:.0f} ms)")
+        return "\n".join(lines)
+
+
+class _Phase(object):
+
+    def __init__(self, timeline, name):
+        self.timeline = timeline
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.timeline.clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.timeline.add(self.name, self.start, self.timeline.clock())
+        return False
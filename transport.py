@@ -0,0 +1,205 @@
+"""
+Listening sockets for BluetoothSender.
+
+The sender only needs a listening socket to accept from, so everything
+that differs between links lives here: how to open it, what to do with
+an accepted connection and how to clean up. All of them hand the sender
+ordinary socket objects that work with selectors.
+
+    RfcommTransport()                      Bluetooth SPP, advertised over SDP
+    TcpTransport("0.0.0.0", 8765)          Wi-Fi, phone on the same network
+    UnixTransport("/tmp/pathpal.sock")     local tools and load tests
+
+from_url() builds one from "rfcomm://[address:][channel]", "tcp://host:port" or
+"unix:///path", for command lines. connect() opens the client side.
+PyBluez is only imported when an RFCOMM link is opened.
+"""
+import os
+import socket
+
+SPP_UUID = "00001101-0000-1000-8000-00805F9B34FB"
+TCP_PORT = 8765
+UNIX_PATH = "/tmp/pathpal.sock"
+
+
+def _bluetooth():
+    try:
+        import bluetooth
+    except ImportError:
+        raise OSError("PyBluez is not installed")
+    return bluetooth
+
+
+class Transport(object):
+    """
+    One kind of link. listen() returns a listening socket; accepted() sets
+    up each connection; close() undoes listen().
+    """
+
+    scheme = None
+
+    def listen(self, backlog):
+        raise NotImplementedError
+
+    def accepted(self, sock):
+        pass
+
+    def connect(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    @property
+    def url(self):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.url}>"
+
+
+class RfcommTransport(Transport):
+    """
+    Bluetooth RFCOMM through PyBluez, advertised as a serial port.
+    """
+
+    scheme = "rfcomm"
+
+    def __init__(self, channel=None, name="PathPalPi", address=None):
+        self.channel = channel
+        self.name = name
+        self.address = address  # the Pi's, for connect()
+        self.sock = None
+
+    def listen(self, backlog):
+        bluetooth = _bluetooth()
+        sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+        sock.bind(("", bluetooth.PORT_ANY if self.channel is None else self.channel))
+        sock.listen(backlog)
+
+        self.channel = sock.getsockname()[1]
+        print(f"[BT] Waiting for connections on RFCOMM channel {self.channel}...")
+
+        bluetooth.advertise_service(sock, self.name,
+                                    service_id=SPP_UUID,
+                                    service_classes=[bluetooth.SERIAL_PORT_CLASS],
+                                    profiles=[bluetooth.SERIAL_PORT_PROFILE])
+        self.sock = sock
+        return sock
+
+    def connect(self):
+        bluetooth = _bluetooth()
+        sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+        sock.connect((self.address, self.channel))
+        return sock
+
+    def close(self):
+        if self.sock is not None:
+            try: _bluetooth().stop_advertising(self.sock)
+            except Exception: pass
+            self.sock = None
+
+    @property
+    def url(self):
+        parts = [str(part) for part in (self.address, self.channel) if part is not None]
+        return "rfcomm://" + ":".join(parts)
+
+
+class TcpTransport(Transport):
+    """
+    TCP, for phones on the same Wi-Fi network. Port 0 picks a free port,
+    the bound one is in .port after listen().
+    """
+
+    scheme = "tcp"
+
+    def __init__(self, host="0.0.0.0", port=TCP_PORT):
+        self.host = host
+        self.port = port
+
+    def listen(self, backlog):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(backlog)
+        self.port = sock.getsockname()[1]
+        print(f"[BT] Waiting for connections on TCP {self.host}:{self.port}...")
+        return sock
+
+    def accepted(self, sock):
+        # the sender batches on its own, Nagle would only add delay
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def connect(self):
+        host = "127.0.0.1" if self.host in ("", "0.0.0.0") else self.host
+        sock = socket.create_connection((host, self.port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    @property
+    def url(self):
+        return f"tcp://{self.host}:{self.port}"
+
+
+class UnixTransport(Transport):
+    """
+    Unix domain stream socket. A stale socket file is removed first.
+    """
+
+    scheme = "unix"
+
+    def __init__(self, path=UNIX_PATH):
+        self.path = path
+        self.sock = None
+
+    def listen(self, backlog):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.listen(backlog)
+        print(f"[BT] Waiting for connections on {self.path}...")
+        self.sock = sock
+        return sock
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock
+
+    def close(self):
+        if self.sock is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        self.sock = None
+
+    @property
+    def url(self):
+        return f"unix://{self.path}"
+
+
+def from_url(url):
+    """
+    A Transport from "rfcomm://[address:][channel]", "tcp://[host][:port]"
+    or "unix:///path".
+    """
+    scheme, sep, rest = url.partition("://")
+    if not sep:
+        raise ValueError(f"not a transport url: {url!r}")
+    if scheme == "rfcomm":
+        # a MAC address has 5 colons of its own
+        if rest.count(":") == 6:
+            address, _, channel = rest.rpartition(":")
+        elif rest.count(":") == 5:
+            address, channel = rest, ""
+        else:
+            address, channel = "", rest
+        return RfcommTransport(int(channel) if channel else None, address=address or None)
+    if scheme == "tcp":
+        host, _, port = rest.rpartition(":")
+        if port and not port.isdigit():
+            # "tcp://host": no port, the whole rest is the host
+            host, port = rest, ""
+        return TcpTransport(host or "0.0.0.0", int(port) if port else TCP_PORT)
+    if scheme == "unix":
+        return UnixTransport(rest or UNIX_PATH)
+    raise ValueError(f"unknown transport {scheme!r} in {url!r}")
@@ -0,0 +1,252 @@
+"""
+Binary wire protocol for the sensor packets sent to the phone.
+
+Every packet is one frame, all fields little-endian:
+
+    offset size
+    0      2    magic b"PP"
+    2      1    version (1)
+    3      1    flags (bit 0: GPS block present, bit 1: from the backlog)
+    4      1    body length in bytes
+    5      2    sequence number, wraps at 65536
+    7      4    timestamp, ms since the encoder was created (wraps)
+    11     2    bpm * 10
+    13     2    distance, cm
+    15     6    accel x, y, z: int16, 0.01 m/s^2
+    21     6    gyro x, y, z: int16, 0.001 rad/s
+    [GPS block, when flag bit 0 is set]
+    27     4    latitude, int32, 1e-7 degree
+    31     4    longitude, int32, 1e-7 degree
+    35     2    speed, cm/s
+    37     2    fix age, ms (65535 = older)
+    end    2    CRC-16/CCITT-FALSE of everything before it
+
+A packet replayed from the backlog (see backlog.py) carries
+"backlog_ms", how long ago it was recorded; in a frame it sets flag
+bit 1 and moves the timestamp back by that much.
+
+Fixed-point values saturate at the limits of their type. 29 bytes
+without GPS, 41 with, versus about 120 and 195 for the JSON line.
+
+The encoding is chosen per connection: the phone sends a JSON line
+{"proto": ["bin1", "json"]} listing what it understands, the sender
+answers {"proto": "<chosen>"} and switches. Phones that never ask get
+JSON lines as before.
+
+decode() is the reference decoder (pure Python, no dependencies beyond
+the standard library) for tests and for the phone app.
+"""
+import binascii
+import json
+import struct
+import time
+
+MAGIC = b"PP"
+VERSION = 1
+FLAG_GPS = 0x01
+FLAG_BACKLOG = 0x02
+
+HEADER = struct.Struct("<2sBBBHI")
+BODY = struct.Struct("<HH3h3h")
+GPS = struct.Struct("<iiHH")
+CRC = struct.Struct("<H")
+MAX_SIZE = HEADER.size + BODY.size + GPS.size + CRC.size
+
+ACCEL_SCALE = 100.0    # 0.01 m/s^2
+GYRO_SCALE = 1000.0    # 0.001 rad/s
+COORD_SCALE = 1e7
+
+# encodings in order of preference
+JSON = "json"
+BINARY = "bin1"
+ENCODINGS = (BINARY, JSON)
+
+
+class WireError(ValueError):
+    """
+    A frame that cannot be decoded (bad magic, version, length or CRC).
+    """
+
+
+def crc16(data):
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def _i16(value, scale):
+    return max(-32768, min(32767, int(round(value * scale))))
+
+
+def _u16(value, scale=1.0):
+    return max(0, min(65535, int(round(value * scale))))
+
+
+class Encoder(object):
+    """
+    Packs packet dicts (bpm, dist_cm, accel, gyro, gps) into frames,
+    reusing one preallocated buffer.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.t0 = clock()
+        self.seq = 0
+        self._buffer = bytearray(MAX_SIZE)
+        self._view = memoryview(self._buffer)
+
+    def reset(self):
+        self.seq = 0
+
+    def encode(self, packet):
+        buf = self._buffer
+        gps = packet.get("gps")
+        flags = FLAG_GPS if gps else 0
+        length = BODY.size + (GPS.size if gps else 0)
+        t_ms = int((self.clock() - self.t0) * 1000)
+        if "backlog_ms" in packet:
+            flags |= FLAG_BACKLOG
+            t_ms -= packet["backlog_ms"]
+        t_ms &= 0xFFFFFFFF
+        HEADER.pack_into(buf, 0, MAGIC, VERSION, flags, length, self.seq, t_ms)
+        self.seq = (self.seq + 1) & 0xFFFF
+
+        bpm = packet.get("bpm") or 0
+        dist = packet.get("dist_cm") or 0
+        ax, ay, az = packet.get("accel") or (0, 0, 0)
+        gx, gy, gz = packet.get("gyro") or (0, 0, 0)
+        try:
+            BODY.pack_into(buf, HEADER.size, round(bpm * 10), round(dist),
+                           round(ax * ACCEL_SCALE), round(ay * ACCEL_SCALE), round(az * ACCEL_SCALE),
+                           round(gx * GYRO_SCALE), round(gy * GYRO_SCALE), round(gz * GYRO_SCALE))
+        except struct.error:
+            # out of range somewhere: saturate (slow path, rare)
+            BODY.pack_into(buf, HEADER.size, _u16(bpm, 10), _u16(dist),
+                           _i16(ax, ACCEL_SCALE), _i16(ay, ACCEL_SCALE), _i16(az, ACCEL_SCALE),
+                           _i16(gx, GYRO_SCALE), _i16(gy, GYRO_SCALE), _i16(gz, GYRO_SCALE))
+        end = HEADER.size + BODY.size
+        if gps:
+            GPS.pack_into(buf, end,
+                          round(gps["lat"] * COORD_SCALE), round(gps["lon"] * COORD_SCALE),
+                          _u16(gps.get("speed") or 0, 100), _u16(gps.get("age_ms") or 0))
+            end += GPS.size
+        CRC.pack_into(buf, end, crc16(self._view[:end]))
+        return bytes(self._view[:end + CRC.size])
+
+
+def frame_size(header):
+    """
+    Total frame size from the first HEADER.size bytes.
+    """
+    magic, version, flags, length, seq, t_ms = HEADER.unpack_from(header)
+    if magic != MAGIC:
+        raise WireError("bad magic {0!r}".format(magic))
+    if version != VERSION:
+        raise WireError("unsupported version {0}".format(version))
+    if not BODY.size <= length <= MAX_SIZE - HEADER.size - CRC.size:
+        raise WireError("bad body length {0}".format(length))
+    return HEADER.size + length + CRC.size
+
+
+def decode(frame):
+    """
+    Reference decoder: one frame (bytes) back to a packet dict with
+    "seq" and "t_ms" added. Raises WireError on a damaged frame.
+    """
+    if len(frame) < HEADER.size + CRC.size:
+        raise WireError("short frame ({0} bytes)".format(len(frame)))
+    magic, version, flags, length, seq, t_ms = HEADER.unpack_from(frame)
+    if magic != MAGIC:
+        raise WireError("bad magic {0!r}".format(magic))
+    if version != VERSION:
+        raise WireError("unsupported version {0}".format(version))
+    end = HEADER.size + length
+    if len(frame) != end + CRC.size:
+        raise WireError("length {0} does not match header ({1})".format(len(frame), end + CRC.size))
+    if crc16(frame[:end]) != CRC.unpack_from(frame, end)[0]:
+        raise WireError("CRC mismatch")
+
+    bpm, dist, ax, ay, az, gx, gy, gz = BODY.unpack_from(frame, HEADER.size)
+    packet = {
+        "seq": seq,
+        "t_ms": t_ms,
+        "bpm": bpm / 10.0,
+        "dist_cm": dist,
+        "accel": [ax / ACCEL_SCALE, ay / ACCEL_SCALE, az / ACCEL_SCALE],
+        "gyro": [gx / GYRO_SCALE, gy / GYRO_SCALE, gz / GYRO_SCALE],
+        "gps": None,
+        "backlog": bool(flags & FLAG_BACKLOG),
+    }
+    if flags & FLAG_GPS:
+        lat, lon, speed, age = GPS.unpack_from(frame, HEADER.size + BODY.size)
+        packet["gps"] = {"lat": lat / COORD_SCALE, "lon": lon / COORD_SCALE,
+                         "speed": speed / 100.0, "age_ms": age}
+    return packet
+
+
+def split_frames(data):
+    """
+    Split a received byte stream into frames. Returns (frames, rest)
+    where REST is an incomplete frame to prepend to the next data.
+    A damaged frame (bad header or CRC) is dropped and the search for
+    MAGIC goes on one byte after where it started, so a corrupted
+    length or a false match inside a payload costs only the frames it
+    overlaps.
+    """
+    frames = []
+    pos = 0
+    while len(data) - pos >= HEADER.size:
+        start = data.find(MAGIC, pos)
+        if start < 0 or len(data) - start < HEADER.size:
+            pos = len(data) - 1 if start < 0 else start
+            break
+        try:
+            size = frame_size(data[start:start + HEADER.size])
+        except WireError:
+            pos = start + 1
+            continue
+        if len(data) - start < size:
+            pos = start
+            break
+        end = start + size - CRC.size
+        if crc16(data[start:end]) != CRC.unpack_from(data, end)[0]:
+            pos = start + 1
+            continue
+        frames.append(bytes(data[start:start + size]))
+        pos = start + size
+    return frames, data[pos:]
+
+
+# ---------------------------------------------------------------
+# NEGOTIATION
+# ---------------------------------------------------------------
+
+def hello(encodings=ENCODINGS):
+    """
+    What the phone sends after connecting.
+    """
+    return (json.dumps({"proto": list(encodings)}) + "\n").encode()
+
+
+def negotiate(line):
+    """
+    The encoding to use for a hello LINE (bytes), None if it is not one.
+    """
+    try:
+        offer = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(offer, dict) or "proto" not in offer:
+        return None
+    wanted = offer["proto"]
+    if isinstance(wanted, str):
+        wanted = [wanted]
+    for encoding in wanted:
+        if encoding in ENCODINGS:
+            return encoding
+    return JSON
+
+
+def reply(encoding):
+    """
+    The sender's answer, always a JSON line.
+    """
+    return (json.dumps({"proto": encoding}) + "\n").encode()